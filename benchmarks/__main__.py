@@ -0,0 +1,85 @@
+import json
+import logging
+import platform
+import sys
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from pathlib import Path
+
+from structlog import (
+    PrintLoggerFactory,
+    configure,
+    make_filtering_bound_logger,
+)
+
+from benchmarks.daemon import bench_codec, bench_scale, bench_services
+from benchmarks.runner import Runner
+from benchmarks.zones import ZoneSpec
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        prog="python -m benchmarks",
+        description="Microbenchmarks for the consulns daemon hot paths",
+    )
+    parser.add_argument(
+        "--scale",
+        action="append",
+        type=ZoneSpec.parse,
+        help="zones and records per zone, as ZONESxRECORDS (repeatable)",
+    )
+    parser.add_argument(
+        "--only",
+        action="append",
+        help="only run benchmarks whose name contains this (repeatable)",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--label", help="stored along with the results, e.g. a commit"
+    )
+    parser.add_argument(
+        "--output", type=Path, help="write the JSON results here, not stdout"
+    )
+    args = parser.parse_args()
+    scales = args.scale or [
+        ZoneSpec.parse(s)
+        for s in (
+            "1x1000",
+            "10x1000",
+            "1x100000",
+            # Small zones, for the cost of finding the zone of a name
+            "10x1",
+            "1000x1",
+            "10000x1",
+            "100000x1",
+        )
+    ]
+
+    # Results go to stdout, progress and daemon warnings to stderr
+    configure(
+        wrapper_class=make_filtering_bound_logger(logging.WARNING),
+        logger_factory=PrintLoggerFactory(sys.stderr),
+    )
+
+    runner = Runner(repeat=args.repeat, only=args.only)
+    bench_codec(runner)
+    bench_services(runner)
+    for spec in scales:
+        bench_scale(runner, spec)
+
+    report = {
+        "label": args.label,
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "results": runner.to_json(),
+    }
+    raw = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write_text(raw + "\n")
+    else:
+        print(raw)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+import json
+import tracemalloc
+from itertools import cycle
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import List
+from uuid import uuid4
+
+from consul import Consul as ConsulClient
+from dns.name import from_text as dns_from_text
+
+from benchmarks.runner import Result, Runner
+from benchmarks.zones import Generated, ZoneSpec, generate
+from consulns.daemon.cache import Cache
+from consulns.daemon.config import Config
+from consulns.daemon.persist import SnapshotFile
+from consulns.daemon.proto import (
+    QType,
+    QueryAdapter,
+    RecordInfo,
+    Response,
+    encode_records,
+    encode_response,
+)
+from consulns.store.record import Record, RecordType
+from consulns.store.zone import Zone
+from consulns.testing import FakeConsul
+
+# Names looked up by each benchmark, cycled through
+SAMPLE_SIZE = 1000
+# Distinct names queried by a random-subdomain flood
+FLOOD_SIZE = 100 * SAMPLE_SIZE
+
+
+class BenchCache(Cache):
+    """A cache reading from a fake Consul."""
+
+    def __init__(self, config: Config, fake: FakeConsul) -> None:
+        self._fake = fake
+        super().__init__(config)
+
+    def _client(self) -> ConsulClient:
+        return self._fake  # type: ignore[return-value]
+
+
+def _config() -> Config:
+    return Config(watch=False, watch_services=False)
+
+
+def _sample[T](items: List[T]) -> List[T]:
+    step = max(len(items) // SAMPLE_SIZE, 1)
+    return items[::step][:SAMPLE_SIZE]
+
+
+def bench_scale(runner: Runner, spec: ZoneSpec) -> None:
+    fake = FakeConsul()
+    gen = generate(fake.store(), spec)
+    scale = spec.label
+
+    # Loading is timed once, the cache is then used by the other benchmarks
+    start = perf_counter()
+    cache = BenchCache(_config(), fake)
+    runner.add(
+        Result(
+            name="cache.load",
+            scale=scale,
+            ns_per_op=(perf_counter() - start) * 1e9,
+            ops=1,
+        )
+    )
+
+    _bench_snapshot_file(runner, scale, fake)
+    _bench_zone_by_qname(runner, scale, cache, gen)
+    _bench_lookup(runner, scale, cache, gen)
+    _bench_random_subdomains(runner, scale, cache, gen)
+    _bench_before_and_after(runner, scale, cache, gen)
+    _bench_records(runner, scale, cache)
+    _bench_list(runner, scale, cache)
+
+
+def _bench_snapshot_file(runner: Runner, scale: str, fake: FakeConsul) -> None:
+    """Time to map a snapshot file, the cold start cost with SNAPSHOT_PATH."""
+    if not runner.wants("snapshot_file"):
+        return
+
+    with TemporaryDirectory() as tmp:
+        path = Path(tmp) / "snapshot"
+        config = Config(watch=False, watch_services=False, snapshot_path=path)
+        BenchCache(config, fake)
+        runner.time(
+            "snapshot_file.read",
+            scale,
+            lambda: SnapshotFile(path).read(),
+            size=path.stat().st_size,
+        )
+
+
+def _bench_zone_by_qname(
+    runner: Runner, scale: str, cache: Cache, gen: Generated
+) -> None:
+    names = cycle(
+        _sample(gen.names)
+        + _sample(gen.missing_names)
+        + [dns_from_text("outside.example.org.")]
+    )
+    runner.time(
+        "cache.zone_by_qname", scale, lambda: cache.zone_by_qname(next(names))
+    )
+
+
+def _bench_lookup(
+    runner: Runner, scale: str, cache: Cache, gen: Generated
+) -> None:
+    for kind, names in (
+        ("existing", gen.names),
+        ("wildcard", gen.wildcard_names),
+        ("missing", gen.missing_names),
+    ):
+        if len(names) == 0:
+            continue
+
+        pairs = []
+        for name in _sample(names):
+            _, cz = cache.zone_by_qname(name)
+            assert cz is not None
+            pairs.append((cz, name))
+        it = cycle(pairs)
+
+        def lookup() -> None:
+            cz, name = next(it)
+            list(cz.lookup(QType.ANY, name))
+
+        def answer() -> None:
+            cz, name = next(it)
+            cz.answer(QType.ANY, name)
+
+        runner.time(f"cached_zone.lookup.{kind}", scale, lookup)
+        runner.time(f"cached_zone.answer.{kind}", scale, answer)
+
+
+def _bench_random_subdomains(
+    runner: Runner, scale: str, cache: Cache, gen: Generated
+) -> None:
+    """Answers for names never queried before, as in a random-subdomain flood.
+
+    The memory still allocated after the flood is reported along, it should
+    not grow with the number of names queried.
+    """
+    name = "cached_zone.answer.random_subdomain"
+    if not runner.wants(name):
+        return
+
+    queries = []
+    for parent in _sample(gen.names) * (FLOOD_SIZE // SAMPLE_SIZE):
+        _, cz = cache.zone_by_qname(parent)
+        assert cz is not None
+        queries.append((cz, dns_from_text(uuid4().hex, parent)))
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for cz, qname in queries:
+        cz.answer(QType.A, qname)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    it = cycle(queries)
+
+    def answer() -> None:
+        cz, qname = next(it)
+        cz.answer(QType.A, qname)
+
+    runner.time(name, scale, answer, retained_bytes=after - before)
+
+
+def _bench_before_and_after(
+    runner: Runner, scale: str, cache: Cache, gen: Generated
+) -> None:
+    """Owner names surrounding a name, as for a DNSSEC denial of existence."""
+    pairs = []
+    for name in _sample(gen.names) + _sample(gen.missing_names):
+        _, cz = cache.zone_by_qname(name)
+        assert cz is not None
+        pairs.append((cz, name))
+    it = cycle(pairs)
+
+    def before_and_after() -> None:
+        cz, name = next(it)
+        cz.before_and_after(name)
+
+    runner.time("cached_zone.before_and_after", scale, before_and_after)
+
+
+def _bench_records(runner: Runner, scale: str, cache: Cache) -> None:
+    _, cz = next(cache.zones)
+    runner.time(
+        "cached_zone.records",
+        scale,
+        lambda: list(cz.records),
+        repeat=1,
+        records=cz.record_count,
+    )
+
+
+def _status_bytes(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+    raise OSError(f"no {field} in /proc/self/status")
+
+
+def _reset_peak_rss() -> int | None:
+    """Resets the peak resident set size, returning the current one.
+
+    Returns None where this is not supported, outside of Linux.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return _status_bytes("VmRSS")
+    except OSError:
+        return None
+
+
+def _bench_list(runner: Runner, scale: str, cache: Cache) -> None:
+    """Peak memory and time to first byte of a whole-zone `list` response.
+
+    The peak resident set size is measured over a first run, the peak of
+    memory allocated by Python over a second one, traced.
+    """
+    if not runner.wants("list"):
+        return
+
+    _, cz = next(cache.zones)
+    for name, encode in (
+        (
+            "list.streamed",
+            lambda: encode_records(info for _, info in cz.records),
+        ),
+        (
+            "list.whole",
+            lambda: iter([encode_response([info for _, info in cz.records])]),
+        ),
+    ):
+        rss = _reset_peak_rss()
+        start = perf_counter()
+        chunks = encode()
+        next(chunks)
+        first_byte = perf_counter() - start
+        for _ in chunks:
+            pass
+        total = perf_counter() - start
+        peak_rss = _status_bytes("VmHWM") - rss if rss is not None else None
+
+        tracemalloc.start()
+        for _ in encode():
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        runner.add(
+            Result(
+                name=name,
+                scale=scale,
+                ns_per_op=total * 1e9,
+                ops=1,
+                extra={
+                    "records": cz.record_count,
+                    "first_byte_ns": first_byte * 1e9,
+                    "peak_bytes": peak,
+                    "peak_rss_bytes": peak_rss,
+                },
+            )
+        )
+
+
+def bench_codec(runner: Runner) -> None:
+    raw_queries = [
+        json.dumps(
+            {
+                "method": "lookup",
+                "parameters": {
+                    "qtype": "ANY",
+                    "qname": f"host{i}.zone0.bench.",
+                    "zone-id": -1,
+                },
+            }
+        ).encode("utf-8")
+        for i in range(SAMPLE_SIZE)
+    ]
+    it = cycle(raw_queries)
+    runner.time(
+        "query_adapter.validate_json",
+        "-",
+        lambda: QueryAdapter.validate_json(next(it)),
+    )
+
+    for n in (1, 10, 100):
+        infos = [
+            RecordInfo(
+                qtype=QType.A,
+                qname="host.zone0.bench.",
+                content=f"10.0.0.{i % 256}",
+                ttl=300,
+                auth=True,
+            )
+            for i in range(n)
+        ]
+        response = Response(result=infos)
+        runner.time(
+            "response.model_dump_json",
+            f"{n} records",
+            response.model_dump_json,
+        )
+        runner.time(
+            "proto.encode_response",
+            f"{n} records",
+            lambda: encode_response(infos),
+        )
+
+
+def bench_services(runner: Runner) -> None:
+    """Compares answers resolved from a Consul service to static ones."""
+    fake = FakeConsul()
+    fake.set_service("api", [(f"10.0.1.{i}", 8080, True) for i in range(1, 4)])
+    consul = fake.store()
+    zone_name = dns_from_text("services.bench.")
+    zone = Zone(consul, zone_name)
+    consul.add_zone(zone)
+    for record, rtype, value in (
+        ("static", RecordType.A, "10.0.0.1"),
+        ("api", RecordType.CONSUL, "api"),
+    ):
+        r = Record(
+            id=uuid4(), record=record, record_type=rtype, value=value, ttl=60
+        )
+        zone._records.records[r.id] = r
+    zone._update_records()
+
+    cache = BenchCache(_config(), fake)
+    cz = cache.zone_by_id(0)
+    assert cz is not None
+    for record in ("static", "api"):
+        name = dns_from_text(record, zone_name)
+        runner.time(
+            f"cached_zone.answer.{record}",
+            "services",
+            lambda: cz.answer(QType.A, name),
+        )
@@ -0,0 +1,64 @@
+import sys
+from dataclasses import asdict, dataclass, field
+from timeit import Timer
+from typing import Any, Callable, Dict, List
+
+
+@dataclass
+class Result:
+    name: str
+    scale: str
+    # Nanoseconds per operation, best of all repeats
+    ns_per_op: float
+    ops: int
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+class Runner:
+    """Times benchmarks and collects their results."""
+
+    def __init__(self, repeat: int = 3, only: List[str] | None = None) -> None:
+        self._repeat = repeat
+        self._only = only
+        self.results: List[Result] = []
+
+    def wants(self, name: str) -> bool:
+        return self._only is None or any(o in name for o in self._only)
+
+    def time(
+        self,
+        name: str,
+        scale: str,
+        fn: Callable[[], Any],
+        repeat: int | None = None,
+        number: int | None = None,
+        **extra: object,
+    ) -> Result | None:
+        """Times fn, calling it enough times to run for about 0.2s."""
+        if not self.wants(name):
+            return None
+
+        timer = Timer(fn)
+        if number is None:
+            number, _ = timer.autorange()
+        best = min(timer.repeat(repeat or self._repeat, number))
+        result = Result(
+            name=name,
+            scale=scale,
+            ns_per_op=best / number * 1e9,
+            ops=number,
+            extra=extra,
+        )
+        print(
+            f"{name} [{scale}]: {result.ns_per_op:.1f} ns/op",
+            file=sys.stderr,
+        )
+        self.results.append(result)
+        return result
+
+    def add(self, result: Result) -> None:
+        if self.wants(result.name):
+            self.results.append(result)
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        return [asdict(r) for r in self.results]
@@ -0,0 +1,117 @@
+from dataclasses import dataclass, field
+from ipaddress import IPv4Address, IPv6Address
+from random import Random
+from typing import List
+from uuid import UUID
+
+from dns.name import Name as DNSName
+from dns.name import from_text as dns_from_text
+
+from consulns.const import CONSUL_PATH_ZONES
+from consulns.store.consul import Consul
+from consulns.store.record import Record, RecordType
+from consulns.store.zone import Zone
+
+
+@dataclass
+class ZoneSpec:
+    """The shape of a synthetic zone set."""
+
+    zones: int = 1
+    records: int = 1000
+    # Fraction of the owner names that are wildcards
+    wildcards: float = 0.05
+    # Owner names have between 1 and max_depth labels below the apex, plus
+    # one for wildcards
+    max_depth: int = 3
+    seed: int = 0
+
+    @classmethod
+    def parse(cls, scale: str) -> "ZoneSpec":
+        """Parses a scale in the ZONESxRECORDS form, e.g. 10x1000."""
+        zones, _, records = scale.partition("x")
+        return cls(zones=int(zones), records=int(records))
+
+    @property
+    def label(self) -> str:
+        return f"{self.zones}x{self.records}"
+
+
+@dataclass
+class Generated:
+    zones: List[DNSName] = field(default_factory=list)
+    # Names owning records
+    names: List[DNSName] = field(default_factory=list)
+    # Names only answered through a wildcard
+    wildcard_names: List[DNSName] = field(default_factory=list)
+    # Names in the zones not owning any record
+    missing_names: List[DNSName] = field(default_factory=list)
+
+
+_TYPES = [RecordType.A, RecordType.AAAA, RecordType.MX, RecordType.CNAME]
+
+
+def _value(rng: Random, rtype: RecordType, zone: DNSName) -> str:
+    match rtype:
+        case RecordType.A:
+            return str(IPv4Address(rng.getrandbits(32)))
+        case RecordType.AAAA:
+            return str(IPv6Address(rng.getrandbits(128)))
+        case RecordType.MX:
+            return f"10 mail.{zone.to_text()}"
+        case _:
+            return f"www.{zone.to_text()}"
+
+
+def _label(rng: Random) -> str:
+    return "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=8))
+
+
+def generate(consul: Consul, spec: ZoneSpec) -> Generated:
+    """Fills a store with synthetic zones, returning the names in them.
+
+    Records are written directly to the shards of each zone, bypassing
+    staging. The zones are new, so they are built empty rather than read
+    back, and their names are written once at the end: Consul.add_zone
+    rewrites all of them for each zone.
+    """
+    rng = Random(spec.seed)
+    gen = Generated()
+    zone_names = consul._zone_names()
+    for z in range(spec.zones):
+        zone_name = dns_from_text(f"zone{z}.bench.")
+        zone = Zone.from_values(consul, zone_name, [])
+        zone_names.zones.add(str(zone.name))
+        gen.zones.append(zone_name)
+
+        records = zone._records.records
+        for _ in range(spec.records):
+            depth = rng.randint(1, spec.max_depth)
+            labels = [_label(rng) for _ in range(depth)]
+            if rng.random() < spec.wildcards:
+                gen.wildcard_names.append(
+                    dns_from_text(".".join([_label(rng), *labels]), zone_name)
+                )
+                labels.insert(0, "*")
+            relative = ".".join(labels)
+            gen.names.append(dns_from_text(relative, zone_name))
+            # Generated labels are all 8 characters long, so this never owns
+            # records, a wildcard may still answer for it.
+            gen.missing_names.append(
+                dns_from_text(f"nx{_label(rng)}", zone_name)
+            )
+
+            rtype = rng.choice(_TYPES)
+            record = Record(
+                id=UUID(int=rng.getrandbits(128), version=4),
+                record=relative,
+                record_type=rtype,
+                value=_value(rng, rtype, zone_name),
+                ttl=300,
+            )
+            records[record.id] = record
+        zone._update_records()
+        zone._update_info()
+
+    consul._kv_set(CONSUL_PATH_ZONES, zone_names)
+    return gen
@@ -0,0 +1,106 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Dict, cast
+
+from consulns.bench.load import (
+    DEFAULT_MIX,
+    QUERY_TIMEOUT,
+    Generator,
+    Stats,
+    discover,
+    replay,
+    replayed,
+    run,
+)
+from consulns.daemon.metrics import Histogram
+
+QUANTILES = [0.5, 0.99, 0.999]
+
+
+def _mix(raw: str) -> Dict[str, int]:
+    mix = {}
+    for part in raw.split(","):
+        method, _, weight = part.partition("=")
+        mix[method.strip()] = int(weight) if weight else 1
+    return mix
+
+
+def _report(stats: Stats, elapsed: float) -> None:
+    overall = Histogram()
+    for h in stats.latencies.values():
+        overall.merge(h)
+    print(
+        f"{overall.count} queries in {elapsed:.2f}s: "
+        f"{overall.count / elapsed:.0f} q/s, {stats.errors} errors"
+    )
+
+    print(f"{'method':>32}{'count':>12}", end="")
+    print("".join(f"{f'p{q * 100:g}':>12}" for q in QUANTILES))
+    rows = [*sorted(stats.latencies.items()), ("all", overall)]
+    for method, h in rows:
+        print(f"{method:>32}{h.count:>12}", end="")
+        print("".join(f"{h.quantile(q) / 1000:>10.0f}us" for q in QUANTILES))
+
+
+def bench() -> None:
+    parser = ArgumentParser(
+        prog="cnsd-bench",
+        description="Load generator for cnsd, speaking the PowerDNS remote "
+        "backend protocol",
+    )
+    parser.add_argument("socket_path", type=Path)
+    parser.add_argument(
+        "-c",
+        "--connections",
+        type=int,
+        default=8,
+        help="concurrent connections, as many PowerDNS backend threads",
+    )
+    parser.add_argument(
+        "-d", "--duration", type=float, default=10, help="seconds to run for"
+    )
+    parser.add_argument(
+        "--mix",
+        type=_mix,
+        default=DEFAULT_MIX,
+        help="weights of the generated methods, e.g. lookup=90,list=1",
+    )
+    parser.add_argument(
+        "--miss-ratio",
+        type=float,
+        default=0.1,
+        help="fraction of generated names that do not exist",
+    )
+    parser.add_argument(
+        "--max-names",
+        type=int,
+        default=10000,
+        help="names of each zone to pick queries from",
+    )
+    parser.add_argument(
+        "--replay",
+        type=Path,
+        help="replay the queries of a capture or query log instead",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=QUERY_TIMEOUT,
+        help="seconds to wait for a response before counting an error",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    socket_path = cast(Path, args.socket_path)
+    connections = cast(int, args.connections)
+
+    if args.replay is not None:
+        source = replayed(replay(args.replay), connections)
+    else:
+        zones = discover(socket_path, args.max_names, args.timeout)
+        generator = Generator(zones, args.mix, args.miss_ratio, args.seed)
+        source = generator.queries
+
+    stats, elapsed = run(
+        socket_path, source, connections, args.duration, args.timeout
+    )
+    _report(stats, elapsed)
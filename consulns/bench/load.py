@@ -0,0 +1,387 @@
+import json
+import re
+import socket
+from dataclasses import dataclass, field
+from itertools import cycle
+from pathlib import Path
+from random import Random
+from threading import Barrier, BrokenBarrierError, Thread
+from time import monotonic, perf_counter_ns
+from typing import Any, Callable, Dict, Iterator, List, Set, Tuple, cast
+
+from consulns.daemon.metrics import Histogram
+
+# Metadata kinds PowerDNS asks for while answering queries
+METADATA_KINDS = ["PRESIGNED", "SOA-EDIT", "NSEC3PARAM", "API-RECTIFY"]
+DEFAULT_MIX = {
+    "lookup": 90,
+    "getDomainMetadata": 6,
+    "getBeforeAndAfterNamesAbsolute": 3,
+    "list": 1,
+}
+# Seconds to wait for a response, PowerDNS gives up on the remote backend
+# after as long by default
+QUERY_TIMEOUT = 2.0
+
+
+class BackendError(Exception):
+    pass
+
+
+# A JSON string, and the rest of one after its opening quote
+_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_STRING_REST = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+
+def _ends_escaped(data: bytes) -> bool:
+    return (len(data) - len(data.rstrip(b"\\"))) % 2 == 1
+
+
+class _ObjectEnd:
+    """Tells when a JSON object received in chunks is complete.
+
+    Strings are dropped with a regular expression and braces are counted in
+    what remains, so each chunk is only scanned once. Bytes of multibyte
+    characters never match, a chunk may split one. A response is never
+    followed by anything before the next query, so the object ends with the
+    chunk that completes it.
+    """
+
+    def __init__(self) -> None:
+        self._depth = 0
+        # The previous chunk ended in a string, and right after a backslash
+        self._in_string = False
+        self._escaped = False
+
+    def complete(self, chunk: bytes) -> bool:
+        pos = 0
+        if self._in_string:
+            # Skip the byte escaped at the end of the previous chunk
+            pos = 1 if self._escaped else 0
+            m = _STRING_REST.match(chunk, pos)
+            if m is None:
+                self._escaped = _ends_escaped(chunk[pos:])
+                return False
+            self._in_string = False
+            pos = m.end()
+
+        rest = _STRING.sub(b"", chunk[pos:])
+        # What follows the opening quote of a string left open is its content
+        quote = rest.find(b'"')
+        if quote >= 0:
+            rest = rest[:quote]
+            self._in_string = True
+            self._escaped = _ends_escaped(chunk[pos:])
+        self._depth += rest.count(b"{") - rest.count(b"}")
+        return self._depth == 0 and not self._in_string
+
+
+class Connection:
+    """A connection to cnsd, speaking the protocol the way PowerDNS does.
+
+    Queries are newline-terminated JSON objects, and each one waits for its
+    response, a single JSON object, before the next one is sent. cnsd sends
+    no response to a query it fails to handle, so waiting for one is bounded
+    by timeout seconds.
+    """
+
+    def __init__(self, path: Path, timeout: float = QUERY_TIMEOUT) -> None:
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        try:
+            self._sock.connect(str(path))
+        except OSError:
+            self._sock.close()
+            raise
+
+    def query(self, raw: bytes) -> object:
+        try:
+            return self._query(raw)
+        except socket.timeout:
+            raise BackendError("no response from cnsd") from None
+
+    def _query(self, raw: bytes) -> object:
+        self._sock.sendall(raw)
+        chunks = []
+        end = _ObjectEnd()
+        while True:
+            chunk = self._sock.recv(1 << 16)
+            if len(chunk) == 0:
+                raise BackendError("connection closed by cnsd")
+            chunks.append(chunk)
+            if end.complete(chunk):
+                return json.loads(b"".join(chunks))["result"]
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+def _encode(method: str, parameters: Dict[str, Any]) -> bytes:
+    query = {"method": method, "parameters": parameters}
+    return json.dumps(query).encode("utf-8") + b"\n"
+
+
+@dataclass
+class Zone:
+    id: int
+    name: str
+    names: List[str] = field(default_factory=list)
+
+
+def discover(
+    path: Path, max_names: int, timeout: float = QUERY_TIMEOUT
+) -> List[Zone]:
+    """Lists the zones served by cnsd, and up to max_names names of each."""
+    conn = Connection(path, timeout)
+    try:
+        domains = cast(
+            List[Dict[str, Any]],
+            conn.query(_encode("getAllDomains", {"include_disabled": False})),
+        )
+        zones = []
+        for domain in domains:
+            zone = Zone(id=domain["id"], name=domain["zone"])
+            records = cast(
+                List[Dict[str, Any]],
+                conn.query(
+                    _encode(
+                        "list", {"zonename": zone.name, "domain_id": zone.id}
+                    )
+                ),
+            )
+            seen: Set[str] = set()
+            for record in records:
+                if len(seen) >= max_names:
+                    break
+                seen.add(record["qname"])
+            zone.names = sorted(seen)
+            zones.append(zone)
+        return zones
+    finally:
+        conn.close()
+
+
+# A method and the raw query to send
+Query = Tuple[str, bytes]
+
+
+class Generator:
+    """Generates endless random mixes of queries for the given zones."""
+
+    def __init__(
+        self,
+        zones: List[Zone],
+        mix: Dict[str, int],
+        miss_ratio: float,
+        seed: int,
+    ) -> None:
+        if len(zones) == 0:
+            raise BackendError("cnsd serves no zones to query")
+        self._zones = zones
+        self._methods = list(mix)
+        self._weights = list(mix.values())
+        self._miss_ratio = miss_ratio
+        self._seed = seed
+
+    def queries(self, i: int) -> Iterator[Query]:
+        """Returns the queries of the i-th connection."""
+        rng = Random(self._seed + i)
+        while True:
+            method = rng.choices(self._methods, self._weights)[0]
+            zone = rng.choice(self._zones)
+            yield method, self._query(rng, method, zone)
+
+    def _name(self, rng: Random, zone: Zone) -> str:
+        if len(zone.names) == 0 or rng.random() < self._miss_ratio:
+            return f"nx{rng.getrandbits(32):x}.{zone.name}"
+        return rng.choice(zone.names)
+
+    def _query(self, rng: Random, method: str, zone: Zone) -> bytes:
+        match method:
+            case "lookup":
+                return _encode(
+                    method,
+                    {
+                        "qname": self._name(rng, zone),
+                        "qtype": "ANY",
+                        "zone-id": -1,
+                    },
+                )
+            case "getDomainMetadata":
+                return _encode(
+                    method,
+                    {"name": zone.name, "kind": rng.choice(METADATA_KINDS)},
+                )
+            case "getBeforeAndAfterNamesAbsolute":
+                name = self._name(rng, zone)
+                name = name.removesuffix(zone.name).rstrip(".")
+                return _encode(method, {"id": zone.id, "qname": name})
+            case "list":
+                return _encode(
+                    method, {"zonename": zone.name, "domain_id": zone.id}
+                )
+            case _:
+                raise BackendError(f"cannot generate {method} queries")
+
+
+def replay(path: Path) -> List[Query]:
+    """Reads queries from a capture, to be replayed in order.
+
+    Each line is either a raw query, as sent by PowerDNS, or a line of the
+    cnsd query log.
+    """
+    queries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("{"):
+                query = json.loads(line)
+                queries.append((query["method"], line.encode("utf-8") + b"\n"))
+                continue
+
+            # A query log line, only the methods it fully describes can be
+            # replayed.
+            fields = dict(
+                pair.split("=", 1) for pair in line.split() if "=" in pair
+            )
+            method = fields.get("method")
+            if method == "lookup":
+                queries.append(
+                    (
+                        method,
+                        _encode(
+                            method,
+                            {
+                                "qname": fields["qname"],
+                                "qtype": fields.get("qtype", "ANY"),
+                                "zone-id": int(fields.get("zone_id", -1)),
+                            },
+                        ),
+                    )
+                )
+            elif method == "list":
+                queries.append(
+                    (
+                        method,
+                        _encode(
+                            method,
+                            {
+                                "zonename": fields["qname"],
+                                "domain_id": int(fields.get("zone_id", -1)),
+                            },
+                        ),
+                    )
+                )
+    if len(queries) == 0:
+        raise BackendError(f"no queries to replay in {path}")
+    return queries
+
+
+@dataclass
+class Stats:
+    latencies: Dict[str, Histogram] = field(default_factory=dict)
+    errors: int = 0
+
+    def record(self, method: str, latency: int) -> None:
+        histogram = self.latencies.get(method)
+        if histogram is None:
+            histogram = self.latencies[method] = Histogram()
+        histogram.record(latency)
+
+    def merge(self, other: "Stats") -> None:
+        for method, histogram in other.latencies.items():
+            self.latencies.setdefault(method, Histogram()).merge(histogram)
+        self.errors += other.errors
+
+
+def replayed(
+    queries: List[Query], connections: int
+) -> Callable[[int], Iterator[Query]]:
+    """Returns the queries of each connection replaying a capture.
+
+    Each connection loops over the capture from its own offset.
+    """
+
+    def queries_of(i: int) -> Iterator[Query]:
+        offset = i * len(queries) // connections
+        return cycle(queries[offset:] + queries[:offset])
+
+    return queries_of
+
+
+def run(
+    path: Path,
+    source: Callable[[int], Iterator[Query]],
+    connections: int,
+    duration: float,
+    timeout: float = QUERY_TIMEOUT,
+) -> Tuple[Stats, float]:
+    """Sends queries over several connections for duration seconds.
+
+    The queries of the i-th connection are taken from source(i). A query
+    left without a response counts as an error, and its connection is
+    replaced so that a late response is not taken for the next one. Returns
+    the merged statistics and the time actually spent.
+    """
+    stats = [Stats() for _ in range(connections)]
+    start = Barrier(connections + 1)
+    errors: List[OSError] = []
+
+    def work(i: int) -> None:
+        try:
+            conn = Connection(path, timeout)
+        except OSError as err:
+            # Release the other connections and the caller
+            errors.append(err)
+            start.abort()
+            return
+
+        s = stats[i]
+        it = source(i)
+        try:
+            start.wait()
+        except BrokenBarrierError:
+            conn.close()
+            return
+        deadline = monotonic() + duration
+        try:
+            while monotonic() < deadline:
+                method, raw = next(it)
+                before = perf_counter_ns()
+                try:
+                    result = conn.query(raw)
+                except BackendError:
+                    s.errors += 1
+                    conn.close()
+                    try:
+                        conn = Connection(path, timeout)
+                    except OSError:
+                        break
+                    continue
+                s.record(method, perf_counter_ns() - before)
+                if result is False:
+                    s.errors += 1
+        finally:
+            conn.close()
+
+    threads = [
+        Thread(target=work, args=(i,), name=f"conn-{i}")
+        for i in range(connections)
+    ]
+    for thr in threads:
+        thr.start()
+    try:
+        start.wait()
+    except BrokenBarrierError:
+        for thr in threads:
+            thr.join()
+        raise BackendError(f"could not connect to cnsd: {errors[0]}")
+    began = monotonic()
+    for thr in threads:
+        thr.join()
+    elapsed = monotonic() - began
+
+    total = Stats()
+    for s in stats:
+        total.merge(s)
+    return total, elapsed
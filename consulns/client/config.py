@@ -35,6 +35,10 @@ class ConsulDsn(HttpUrl):
 
 class Config(BaseSettings):
     consul_addr: ConsulDsn = ConsulDsn("http://127.0.0.1:8500")
+    # Timeouts of requests to Consul, in seconds, and retries of failed reads
+    consul_connect_timeout: float = 2.0
+    consul_read_timeout: float = 10.0
+    consul_retries: int = 3
 
 
 def pass_config(f):
@@ -1,8 +1,8 @@
 import click
-from consul import Consul as ConsulClient
 from functools import update_wrapper
 
 from consulns.store import Consul
+from consulns.store.transport import Client, Transport
 from consulns.client.config import Config, pass_config
 from consulns.const import CLICK_CONSUL_CTX_KEY, CLICK_ZONE_CTX_KEY
 
@@ -16,8 +16,13 @@ def pass_consul(f):
             scheme = config.consul_addr.scheme
             host = config.consul_addr.host
             port = config.consul_addr.port
+            transport = Transport(
+                connect_timeout=config.consul_connect_timeout,
+                read_timeout=config.consul_read_timeout,
+                retries=config.consul_retries,
+            )
             ctx.obj[CLICK_CONSUL_CTX_KEY] = Consul(
-                ConsulClient(scheme=scheme, host=host, port=port)
+                Client(transport, scheme=scheme, host=host, port=port)
             )
             pass
 
@@ -1,9 +1,13 @@
+from contextlib import contextmanager
+from typing import Iterator, TextIO
+
 import click
-from pydantic import UUID4
+from pydantic import UUID4, ValidationError
 from tabulate import tabulate
 
 from consulns.client.cli import cli
 from consulns.store import Record, RecordType, Zone
+from consulns.store.consul import TransactionTooLarge
 from consulns.client.ctx import pass_zone
 
 
@@ -43,22 +47,94 @@ def status(zone: Zone) -> None:
     click.echo(tbl)
 
 
+@contextmanager
+def staging_errors() -> Iterator[None]:
+    """Reports changes too large for Consul to stage as a command error."""
+    try:
+        yield
+    except TransactionTooLarge as err:
+        raise click.ClickException(
+            f"{err}, nothing was staged: stage the changes in several steps, "
+            "or use cnsc zone import"
+        ) from err
+
+
+class InvalidRecord(Exception):
+    pass
+
+
+def _read_records(f: TextIO) -> Iterator[Record]:
+    """Reads records in the format they are printed in, one per line.
+
+    That is `<record> IN <type> <ttl> <value>`, blank lines and lines
+    starting with # are skipped.
+    """
+    for n, line in enumerate(f, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        fields = line.split(maxsplit=4)
+        if len(fields) != 5 or fields[1] != "IN":
+            raise InvalidRecord(
+                f"line {n}: expected <record> IN <type> <ttl> <value>"
+            )
+        record, _, record_type, ttl, value = fields
+        try:
+            yield Record(
+                record=record,
+                record_type=RecordType(record_type),
+                value=value,
+                ttl=int(ttl),
+            )
+        except (ValueError, ValidationError) as err:
+            raise InvalidRecord(f"line {n}: {err}") from err
+
+
 @stage.command()
-@click.argument("record", type=str)
-@click.argument("record_type", type=RecordType)
-@click.argument("value", type=str)
+@click.argument("record", type=str, required=False)
+@click.argument("record_type", type=RecordType, required=False)
+@click.argument("value", type=str, required=False)
 @click.option("--ttl", type=int, default=300)
+@click.option(
+    "--from-file",
+    type=click.File("r"),
+    help="Stage the records in this file (- for stdin), one per line as "
+    "<record> IN <type> <ttl> <value>",
+)
 @pass_zone
 def add(
-    zone: Zone, record: str, record_type: RecordType, value: str, ttl: int
+    zone: Zone,
+    record: str | None,
+    record_type: RecordType | None,
+    value: str | None,
+    ttl: int,
+    from_file: TextIO | None,
 ) -> None:
+    if from_file is not None:
+        if record is not None:
+            raise click.UsageError("cannot stage both a record and a file")
+
+        # All records are staged with as few writes as possible
+        with staging_errors(), zone.stage.batch():
+            n = 0
+            for r in _read_records(from_file):
+                zone.stage.add_record(r)
+                n += 1
+        click.echo(f"On zone {zone.name}")
+        click.secho(f"Added {n} record{'s' if n != 1 else ''}", fg="green")
+        return
+
+    if record is None or record_type is None or value is None:
+        raise click.UsageError("missing RECORD, RECORD_TYPE or VALUE")
     r = Record(
         record=record,
         record_type=record_type,
         value=value,
         ttl=ttl,
     )
-    zone.stage.add_record(r)
+    with staging_errors():
+        zone.stage.add_record(r)
     click.echo(f"On zone {zone.name}")
     click.echo("Added record:")
     click.secho(
@@ -78,7 +154,8 @@ def delete(zone: Zone, id: UUID4) -> None:
     if r is None:
         raise MissingRecord(id)
 
-    zone.stage.del_record(r)
+    with staging_errors():
+        zone.stage.del_record(r)
     click.echo(f"On zone {zone.name}")
     click.echo("Deleted record:")
     click.secho(
@@ -90,7 +167,8 @@ def delete(zone: Zone, id: UUID4) -> None:
 @click.argument("id", type=int)
 @pass_zone
 def revert(zone: Zone, id: int) -> None:
-    zone.stage.revert(id)
+    with staging_errors():
+        zone.stage.revert(id)
     click.secho(f"Reverted staged change {id}", fg="yellow")
 
 
@@ -102,7 +180,13 @@ def commit(zone: Zone) -> None:
         f"Committing {l} change{'s' if l > 1 else ''} to zone {zone.name}...",
         fg="yellow",
     )
-    zone.commit()
+    try:
+        zone.commit()
+    except TransactionTooLarge as err:
+        raise click.ClickException(
+            f"{err}, the changes are still staged: revert some of them and "
+            "commit in several steps, or use cnsc zone import"
+        ) from err
     click.secho(f"Updates applied successfully", fg="green")
 
 
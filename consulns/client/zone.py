@@ -1,10 +1,19 @@
+from collections import Counter
+from typing import Iterator, TextIO
+
 import click
 from dns.name import Name as DNSName, from_text as dns_from_text
 from tabulate import tabulate
 
 from consulns.client.cli import cli
 from consulns.client.ctx import pass_consul, pass_zone
-from consulns.store import Consul, Zone
+from consulns.client.stage import staging_errors
+from consulns.store import Consul, Record, Zone
+from consulns.store.zonefile import (
+    rdtype2rtype,
+    read_zone_file,
+    write_zone_file,
+)
 
 
 @cli.group()
@@ -17,9 +26,11 @@ def zone():
 def list(consul: Consul):
     cz = consul.current_zone()
     cz_name = None if cz is None else cz.name
-    for zone in consul.zones:
-        selected = "\t" if zone.name != cz_name else "*\t"
-        click.echo(f"{selected}{zone.name}\t{zone.serial}")
+    # Only the serials are needed, records are not read
+    infos = consul.zone_infos()
+    for zone_name, info in sorted(infos.items()):
+        selected = "\t" if zone_name != cz_name else "*\t"
+        click.echo(f"{selected}{zone_name}\t{info.serial}")
 
 
 class InvalidDomain(Exception):
@@ -71,7 +82,74 @@ def use(consul: Consul, zone_name: DNSName):
     click.secho(f"Selected zone: {zone.name}", fg="green")
 
 
+def _read_zone_file(file: TextIO, zone: Zone) -> Iterator[Record]:
+    """Yields the records of a zone file, reporting the ones skipped last."""
+    skipped: Counter[str] = Counter()
+    for batch in read_zone_file(
+        file, zone.name, lambda _, rdtype: skipped.update([rdtype])
+    ):
+        yield from batch
+    for rdtype, n in sorted(skipped.items()):
+        click.secho(f"Skipped {n} unsupported {rdtype} record(s)", fg="yellow")
+
+
+@zone.command(name="import")
+@click.argument("file", type=click.File("r"))
+@click.option(
+    "--replace",
+    is_flag=True,
+    help="Drop all records of the zone before importing",
+)
+@pass_zone
+def import_(zone: Zone, file: TextIO, replace: bool) -> None:
+    """Imports the records of an RFC 1035 zone file (- for stdin).
+
+    Records are written to the zone directly, without being staged.
+    """
+    records = _read_zone_file(file, zone)
+    added = zone.add_records(records, replace=replace)
+    click.echo(f"On zone {zone.name}")
+    click.secho(
+        f"Imported {added} record{'s' if added != 1 else ''}", fg="green"
+    )
+
+
+@zone.command()
+@click.argument("file", type=click.File("w"), default="-")
+@pass_zone
+def export(zone: Zone, file: TextIO) -> None:
+    """Exports the records of the zone as an RFC 1035 zone file."""
+    write_zone_file(file, zone)
+
+
+@zone.command()
+@click.argument("file", type=click.File("r"))
+@pass_zone
+def sync(zone: Zone, file: TextIO) -> None:
+    """Stages the changes making the zone match an RFC 1035 zone file.
+
+    Only records missing from the zone are added, and only records missing
+    from the file are deleted. CONSUL records, which zone files cannot hold,
+    are left alone.
+    """
+    records = _read_zone_file(file, zone)
+    with staging_errors():
+        added, deleted = zone.stage.sync(records, set(rdtype2rtype.values()))
+    click.echo(f"On zone {zone.name}")
+    if added == 0 and deleted == 0:
+        click.secho("Already in sync", fg="green")
+        return
+    cli_name = click.get_current_context().find_root().info_name
+    click.secho(
+        f"Staged {added} addition(s) and {deleted} deletion(s)", fg="green"
+    )
+    click.echo(f"  (use {cli_name} commit to publish all changes)")
+
+
 zone.add_command(list)
 zone.add_command(add)
 zone.add_command(show)
 zone.add_command(use)
+zone.add_command(import_)
+zone.add_command(export)
+zone.add_command(sync)
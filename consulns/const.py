@@ -8,8 +8,22 @@ CONSUL_PATH_ZONES = f"{CONSUL_BASE_PATH}/zones"
 CONSUL_PATH_CURRENT_ZONE = f"{CONSUL_PATH_ZONES}/current"
 CONSUL_PATH_ZONE = f"{CONSUL_PATH_ZONES}/{{zone}}"
 CONSUL_PATH_ZONE_INFO = f"{CONSUL_PATH_ZONE}/info"
+# Staged changes are spread over chunks, in the order they were staged. The
+# single key at CONSUL_PATH_ZONE_STAGING is the legacy layout, read as the
+# first chunk.
 CONSUL_PATH_ZONE_STAGING = f"{CONSUL_PATH_ZONE}/staging"
+CONSUL_PATH_ZONE_STAGING_CHUNK = f"{CONSUL_PATH_ZONE_STAGING}/{{chunk}}"
+# Records of a zone are stored under a key per owner name, so that changes
+# only rewrite the names they touch. A commit writes its changes to a single
+# log key, along with the zone info and the staging area, in one transaction,
+# and moves them to the keys of their names afterwards. The single key at
+# CONSUL_PATH_ZONE_RECORDS is the legacy layout. Keys in the legacy layout,
+# or in any other layout under it, are migrated on the next commit.
 CONSUL_PATH_ZONE_RECORDS = f"{CONSUL_PATH_ZONE}/records"
+CONSUL_PATH_ZONE_RECORD_NAMES = f"{CONSUL_PATH_ZONE_RECORDS}/names"
+CONSUL_PATH_ZONE_RECORD_NAME = f"{CONSUL_PATH_ZONE_RECORD_NAMES}/{{name}}"
+CONSUL_PATH_ZONE_RECORD_LOG = f"{CONSUL_PATH_ZONE_RECORDS}/log"
+CONSUL_PATH_ZONE_RECORD_LOG_ENTRY = f"{CONSUL_PATH_ZONE_RECORD_LOG}/{{id}}"
 
 CONSUL_PATH_ZONE_METADATA = f"{CONSUL_PATH_ZONE}/metadata"
 CONSUL_PATH_ZONE_KEYS = f"{CONSUL_PATH_ZONE}/keys"
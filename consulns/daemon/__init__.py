@@ -1,13 +1,18 @@
+from logging import getLevelNamesMapping
 from typing import cast
 from socket import socket, AF_UNIX, SOCK_STREAM
-from threading import Thread
 from argparse import ArgumentParser
 from pathlib import Path
-from structlog import get_logger
+from tempfile import TemporaryDirectory
+from structlog import configure, get_logger, make_filtering_bound_logger
 
 from consulns.daemon.config import Config
-from consulns.daemon.handler import Handler
 from consulns.daemon.cache import Cache
+from consulns.daemon.querylog import querylog
+from consulns.daemon.server import serve_asyncio, serve_threaded
+from consulns.daemon.stats import serve_stats
+from consulns.daemon.watcher import Watcher
+from consulns.daemon.workers import Supervisor
 
 log = get_logger()
 
@@ -18,12 +23,47 @@ def daemon() -> None:
         description="ConsulNS daemon implementing PowerDNS remote backend",
     )
     parser.add_argument("socket_path", type=Path)
+    parser.add_argument(
+        "--engine",
+        choices=["threaded", "asyncio"],
+        default="threaded",
+        help="serve each connection from its own thread, or all of them "
+        "from a single asyncio event loop",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="serve from this many pre-forked worker processes",
+    )
     args = parser.parse_args()
     socket_path = cast(Path, args.socket_path)
+    engine = cast(str, args.engine)
+    workers = cast(int, args.workers)
 
     config = Config()
+    # Calls below the configured level are no-ops. Older structlog releases
+    # only take the level as a number.
+    level = getLevelNamesMapping()[config.log_level.upper()]
+    configure(
+        wrapper_class=make_filtering_bound_logger(level),
+        cache_logger_on_first_use=True,
+    )
     log.info("loaded config", config=config)
-    cache = Cache(config)
+    querylog.configure(config)
+    tmp = None
+    if workers > 0:
+        if config.snapshot_path is None:
+            # Workers map the snapshot file on every change
+            tmp = TemporaryDirectory(prefix="cnsd-")
+            config.snapshot_path = Path(tmp.name) / "snapshot"
+        # Threads are only started once the supervisor has forked
+        cache = Cache(config, background=False)
+    else:
+        querylog.start()
+        cache = Cache(config)
+        if config.watch:
+            Watcher(cache).start()
 
     if socket_path.exists():
         log.warning("deleting old socket", path=socket_path)
@@ -32,16 +72,23 @@ def daemon() -> None:
     srv = socket(AF_UNIX, SOCK_STREAM)
     srv.bind(str(socket_path))
     srv.listen()
-    log.info("listening on UNIX socket", path=socket_path)
+    log.info("listening on UNIX socket", path=socket_path, engine=engine)
+
+    def on_fork(worker: int | None) -> None:
+        if worker is not None:
+            querylog.start()
+        serve_stats(cache, worker=worker)
 
+    serve = serve_asyncio if engine == "asyncio" else serve_threaded
     try:
-        while True:
-            sock, _ = srv.accept()
-            handler = Handler(sock, cache)
-            thr = Thread(target=handler.handle)
-            thr.daemon = True
-            thr.start()
+        if workers > 0:
+            Supervisor(srv, cache, serve, workers, on_fork=on_fork).run()
+        else:
+            serve_stats(cache)
+            serve(srv, cache)
     finally:
         log.info("Shutting down server")
         srv.close()
         socket_path.unlink()
+        if tmp is not None:
+            tmp.cleanup()
@@ -1,22 +1,29 @@
+import json
+from bisect import bisect_right
 from collections import defaultdict
-from typing import Dict, Iterator, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from ipaddress import IPv4Address, ip_address
+from threading import Lock, Thread
+from time import monotonic, perf_counter, sleep
+from typing import Callable, Dict, Iterator, List, Mapping, Set, Tuple
 
 from consul import Consul as ConsulClient
 from dns.name import Name as DNSName, from_text as dns_from_text
+from structlog import get_logger
 
+from consulns.daemon.catalog import Catalog
 from consulns.daemon.config import Config
-from consulns.daemon.proto import QType, RecordInfo
+from consulns.daemon.metrics import metrics
+from consulns.daemon.persist import InvalidSnapshot, SnapshotFile
+from consulns.daemon.proto import QType, RecordInfo, encode_response
 from consulns.store.zone import Zone
 from consulns.store.record import Record, RecordType
 from consulns.store.consul import Consul
 
-qtype2rtype = {
-    QType.A: RecordType.A,
-    QType.AAAA: RecordType.AAAA,
-    QType.CNAME: RecordType.CNAME,
-    QType.MX: RecordType.MX,
-    QType.NS: RecordType.NS,
-}
+log = get_logger()
+
+# Seconds to wait before retrying a failed load in the background
+RETRY_DELAY = 1
 
 rtype2qtype = {
     RecordType.A: QType.A,
@@ -29,15 +36,62 @@ rtype2qtype = {
 
 class CachedZone:
     def __init__(
-        self, zone: Zone, records: Dict[DNSName, List[Record]]
+        self,
+        zone: Zone,
+        records: Dict[DNSName, List[Record]],
+        index: int,
+        catalog: Catalog,
     ) -> None:
         self._zone = zone
         self._records = records
+        self._index = index
+        self._catalog = catalog
+        # Services referenced by CONSUL records
+        self._services = {
+            str(record.value)
+            for _, record in self.raw_records
+            if record.record_type == RecordType.CONSUL
+        }
+        # Owner names, in DNSSEC canonical order
+        self._names = sorted(self._owner_names())
+        # All names in the zone, empty non-terminals included
+        self._existing = self._existing_names()
+        self._answers = self._build_answers()
+        self._wildcards = self._build_wildcards()
 
     @property
     def zone(self) -> Zone:
         return self._zone
 
+    @property
+    def index(self) -> int:
+        """The Consul ModifyIndex this zone was loaded at."""
+        return self._index
+
+    @property
+    def services(self) -> Set[str]:
+        """The Consul services this zone resolves records from."""
+        return self._services
+
+    def rebuild(self) -> "CachedZone":
+        """Returns a copy of the zone with the current service instances."""
+        return CachedZone(
+            self._zone, self._records, self._index, self._catalog
+        )
+
+    @property
+    def raw_data(self) -> bytes | memoryview:
+        """The data of the zone as JSON, as stored in snapshot files.
+
+        Serialized on each access rather than kept around, as it is only
+        needed when writing the snapshot file.
+        """
+        return self._zone.data.model_dump_json().encode("utf-8")
+
+    @property
+    def record_count(self) -> int:
+        return sum(len(records) for records in self._records.values())
+
     @property
     def soa(self) -> RecordInfo:
         qname_str = self._zone.name.to_text()
@@ -58,9 +112,9 @@ class CachedZone:
             for record in records
         )
 
-    def _record_info(self, domain: DNSName, record: Record) -> RecordInfo:
+    def _record_info(self, qname: str, record: Record) -> RecordInfo:
         return RecordInfo(
-            qname=domain.to_text(),
+            qname=qname,
             qtype=rtype2qtype[record.record_type],
             content=str(record.value),
             ttl=record.ttl,
@@ -70,29 +124,88 @@ class CachedZone:
             auth=True,
         )
 
+    def _service_infos(
+        self, qname: str, owner: str, record: Record
+    ) -> Iterator[RecordInfo]:
+        # A CONSUL record stands for the healthy instances of a service: an
+        # A/AAAA record for each of their addresses, and an SRV record for each
+        # port pointing back at the owner name, which carries the addresses.
+        ports = []
+        for instance in self._catalog.instances(str(record.value)):
+            try:
+                address = ip_address(instance.address)
+            except ValueError:
+                # Instances registered with a hostname cannot be served as
+                # address records.
+                continue
+            yield RecordInfo(
+                qname=qname,
+                qtype=QType.A
+                if isinstance(address, IPv4Address)
+                else QType.AAAA,
+                content=str(address),
+                ttl=record.ttl,
+                auth=True,
+            )
+            if instance.port not in ports:
+                ports.append(instance.port)
+
+        for port in ports:
+            yield RecordInfo(
+                qname=qname,
+                qtype=QType.SRV,
+                content=f"1 1 {port} {owner}",
+                ttl=record.ttl,
+                auth=True,
+            )
+
+    def _record_infos(
+        self, qname: str, owner: DNSName, record: Record
+    ) -> Iterator[RecordInfo]:
+        if record.record_type == RecordType.CONSUL:
+            yield from self._service_infos(qname, owner.to_text(), record)
+        else:
+            yield self._record_info(qname, record)
+
     @property
     def records(self) -> Iterator[Tuple[DNSName, RecordInfo]]:
         yield (self._zone.name, self.soa)
         for domain, record in self.raw_records:
-            yield domain, self._record_info(domain, record)
+            for info in self._record_infos(domain.to_text(), domain, record):
+                yield domain, info
 
-    def lookup(self, qtype: QType, qname: DNSName) -> Iterator[RecordInfo]:
-        # Handle queries such as *.example.com
-        sub, _ = qname.split(1)
-        if sub == "*":
-            records = self.raw_records
+    def _closest_encloser(self, qname: DNSName) -> DNSName | None:
+        if not qname.is_subdomain(self._zone.name):
+            return None
 
-        records = map(lambda r: (qname, r), self._records[qname])
+        name = qname
+        while name not in self._existing:
+            name = name.parent()
+        return name
 
-        def accept_qtype(r: Record) -> bool:
-            if qtype == QType.ANY:
-                return True
-            else:
-                rtype = qtype2rtype[qtype]
-                return r.record_type == rtype
+    def _source(self, qname: DNSName) -> DNSName | None:
+        """Returns the name whose records answer for qname.
+
+        That is qname itself when it exists, or the wildcard matching it
+        (RFC 4592) otherwise.
+        """
+        if qname in self._existing:
+            return qname
+
+        encloser = self._closest_encloser(qname)
+        if encloser is None:
+            return None
+        wildcard = WILDCARD.concatenate(encloser)
+        return wildcard if wildcard in self._records else None
+
+    def _rrset(
+        self, qtype: QType, source: DNSName, qname: str
+    ) -> Iterator[RecordInfo]:
+        def accept_qtype(info: RecordInfo) -> bool:
+            return qtype == QType.ANY or info.qtype == qtype
 
         # Return SOA on ANY/SOA on @
-        if qname == self._zone.name and (
+        if source == self._zone.name and (
             qtype == QType.ANY or qtype == QType.SOA
         ):
             yield self.soa
@@ -101,50 +214,360 @@ class CachedZone:
             # We are done already
             return
 
-        filtered = (
-            (domain, record)
-            for domain, record in records
-            if accept_qtype(record)
+        for record in self._records.get(source, []):
+            for info in self._record_infos(qname, source, record):
+                if accept_qtype(info):
+                    yield info
+
+    def lookup(self, qtype: QType, qname: DNSName) -> Iterator[RecordInfo]:
+        source = self._source(qname)
+        if source is not None:
+            yield from self._rrset(qtype, source, qname.to_text())
+
+    def _owner_names(self) -> Set[DNSName]:
+        names = {name for name, records in self._records.items() if records}
+        names.add(self._zone.name)
+        return names
+
+    def _existing_names(self) -> Set[DNSName]:
+        existing = {self._zone.name}
+        for name in self._names:
+            while name not in existing:
+                existing.add(name)
+                name = name.parent()
+
+        return existing
+
+    def _build_answers(self) -> Dict[Tuple[DNSName, QType], bytes]:
+        answers = {}
+        for name in self._names:
+            for qtype in QType:
+                infos = list(self._rrset(qtype, name, name.to_text()))
+                if len(infos) > 0:
+                    answers[(name, qtype)] = _serialize(infos)
+
+        return answers
+
+    def _build_wildcards(self) -> Dict[DNSName, Dict[QType, List[bytes]]]:
+        # Wildcard answers are rendered with a placeholder in place of the
+        # owner name, and split around it. Indexed by the closest encloser they
+        # are synthesized for.
+        wildcards: Dict[DNSName, Dict[QType, List[bytes]]] = {}
+        for name in self._names:
+            if name.labels[0] != b"*":
+                continue
+
+            templates = {}
+            for qtype in QType:
+                infos = list(self._rrset(qtype, name, _PLACEHOLDER))
+                if len(infos) > 0:
+                    raw = _serialize(infos)
+                    templates[qtype] = raw.split(_json_str(_PLACEHOLDER))
+            wildcards[name.parent()] = templates
+
+        return wildcards
+
+    def answer(self, qtype: QType, qname: DNSName) -> bytes:
+        """Returns the serialized `lookup` response for qtype/qname.
+
+        Answers are rendered once when the zone is cached, so this is a single
+        dictionary access for existing names. Other names cost a walk up to
+        their closest encloser, and wildcard answers only need qname spliced
+        in. Misses never modify the zone.
+        """
+        raw = self._answers.get((qname, qtype))
+        if raw is not None:
+            return raw
+        if qname in self._existing:
+            return EMPTY_ANSWER
+
+        encloser = self._closest_encloser(qname)
+        templates = self._wildcards.get(encloser) if encloser else None
+        if templates is None or qtype not in templates:
+            return EMPTY_ANSWER
+        return _json_str(qname.to_text()).join(templates[qtype])
+
+    def before_and_after(self, qname: DNSName) -> Tuple[DNSName, DNSName]:
+        """Returns the owner names surrounding qname, in canonical order.
+
+        `before` is the last name sorting before or equal to qname, `after` the
+        first one sorting after it. Both wrap around the ends of the zone.
+        """
+        i = bisect_right(self._names, qname)
+        before = self._names[i - 1]
+        after = self._names[i % len(self._names)]
+        return before, after
+
+
+class MappedZone(CachedZone):
+    """A zone read from a snapshot file, decoded on first access.
+
+    Only the index, services and record count are known upfront. The first
+    access to anything else decodes the data from the map and fills in the
+    attributes of a CachedZone, after which the zone behaves exactly like
+    one, and no longer holds on to the map.
+    """
+
+    def __init__(
+        self, cache: "Cache", entry: SnapshotFile.Entry, raw: memoryview
+    ) -> None:
+        self._cache = cache
+        self._entry = entry
+        self._raw = raw
+        self._index = entry.index
+        self._services = set(entry.services)
+        self._decode_lock = Lock()
+
+    def __getattr__(self, attr: str) -> object:
+        # Only reached for attributes not set yet, that is before decoding
+        with self._decode_lock:
+            if "_zone" not in self.__dict__:
+                log.debug("decoding mapped zone", zone=self._entry.name)
+                data = Zone.Data.model_validate_json(bytes(self._raw))
+                zone = Zone.from_data(
+                    self._cache._consul, dns_from_text(self._entry.name), data
+                )
+                cz = self._cache._load_zone(zone, self._index)
+                self.__dict__.update(cz.__dict__)
+                del self._raw
+        return object.__getattribute__(self, attr)
+
+    def _remap(self, entry: SnapshotFile.Entry, raw: memoryview) -> None:
+        """Switches to the data of the zone in a newer map, if not decoded.
+
+        So that the zone does not keep an older map alive.
+        """
+        with self._decode_lock:
+            if "_zone" not in self.__dict__:
+                self._entry = entry
+                self._raw = raw
+
+    def rebuild(self) -> CachedZone:
+        if "_zone" not in self.__dict__:
+            # Built with the current service instances once decoded
+            return self
+        return super().rebuild()
+
+    @property
+    def record_count(self) -> int:
+        return self._entry.records
+
+    @property
+    def raw_data(self) -> bytes | memoryview:
+        with self._decode_lock:
+            raw: memoryview | None = self.__dict__.get("_raw")
+        if raw is None:
+            return super().raw_data
+        return raw
+
+
+WILDCARD = DNSName([b"*"])
+_PLACEHOLDER = "\0qname\0"
+
+
+def _json_str(s: str) -> bytes:
+    return json.dumps(s)[1:-1].encode("utf-8")
+
+
+def _serialize(infos: List[RecordInfo]) -> bytes:
+    return encode_response(infos)
+
+
+EMPTY_ANSWER = _serialize([])
+
+
+def _folded_labels(name: DNSName) -> Tuple[bytes, ...]:
+    return tuple(label.lower() for label in name.labels)
+
+
+def _zone_indexes(snapshot: "Snapshot") -> Dict[DNSName, Tuple[int, int]]:
+    return {
+        zone_name: (i, cz.index)
+        for zone_name, (i, cz) in snapshot.zones_by_name.items()
+    }
+
+
+class Snapshot:
+    """An immutable view of all cached zones.
+
+    Snapshots are never modified once built: a reload builds a new snapshot
+    and swaps it in with a single assignment, so readers holding on to a
+    snapshot never observe a partially loaded state and need no locking.
+    """
+
+    def __init__(
+        self, index: int, czs: Dict[DNSName, Tuple[int, CachedZone]]
+    ) -> None:
+        self._index = index
+        self._czs = czs
+        self._czs_by_id = {i: cz for i, cz in czs.values()}
+        self._czs_by_labels = {
+            _folded_labels(zone_name): icz for zone_name, icz in czs.items()
+        }
+        self._depths = sorted(
+            {len(zone_name) for zone_name in czs}, reverse=True
         )
-        for domain, record in filtered:
-            yield self._record_info(domain, record)
+
+    @property
+    def index(self) -> int:
+        """The Consul index this snapshot is up to date with."""
+        return self._index
+
+    def zone_by_name(self, zone_name: DNSName) -> Tuple[int, CachedZone] | None:
+        return self._czs.get(zone_name)
+
+    @property
+    def zones_by_name(self) -> Mapping[DNSName, Tuple[int, CachedZone]]:
+        """The id and zone of each zone name.
+
+        Unlike going through the zones, this does not decode mapped zones.
+        """
+        return self._czs
+
+    @property
+    def zones(self) -> Iterator[Tuple[int, CachedZone]]:
+        for cz in self._czs.values():
+            yield cz
+
+    def zone_by_id(self, id: int) -> CachedZone | None:
+        if id in self._czs_by_id:
+            return self._czs_by_id[id]
+
+        return None
+
+    def zone_by_qname(
+        self, domain: DNSName, exact: bool = False
+    ) -> Tuple[int, CachedZone | None]:
+        if exact:
+            found = self._czs.get(domain)
+        else:
+            # Try the suffixes of the domain from the longest to the shortest,
+            # only considering lengths some zone actually has. The first hit
+            # is the closest enclosing zone.
+            labels = _folded_labels(domain)
+            found = None
+            for depth in self._depths:
+                if depth > len(labels):
+                    continue
+                found = self._czs_by_labels.get(labels[len(labels) - depth :])
+                if found is not None:
+                    break
+
+        if found is None:
+            return -1, None
+        return found
 
 
 class Cache:
-    _czs: Dict[DNSName, Tuple[int, CachedZone]]
-    _czs_by_id: Dict[int, CachedZone]
+    _snapshot: Snapshot
 
-    def __init__(self, config: Config) -> None:
+    def __init__(self, config: Config, background: bool = True) -> None:
+        """Loads the cache, or maps it from the snapshot file.
+
+        Unless `background` is False, the work done in background threads is
+        started right away, see `start`.
+        """
         self._config = config
-        self.load()
+        self._lock = Lock()
+        self._save_lock = Lock()
+        # Id and ModifyIndex of each zone in the snapshot file, as last
+        # written or mapped
+        self._saved: Dict[DNSName, Tuple[int, int]] | None = None
+        self._saves = True
+        self._listeners: List[Callable[[Snapshot, Snapshot], None]] = []
+        self._checked_at = monotonic()
+        self._refreshes = 0
+        self._refresh_duration = 0.0
+        self._load_durations: Dict[DNSName, float] = {}
+        self._catalog = Catalog(
+            config,
+            Consul(self._client(), metrics.observe_consul),
+            watch=background,
+        )
+        self._catalog.add_listener(self._refresh_service)
+        self._snapshot_file = (
+            SnapshotFile(config.snapshot_path)
+            if config.snapshot_path is not None
+            else None
+        )
+        self._mapped = self._map()
+        if not self._mapped:
+            self.load()
+        if background:
+            self.start()
+
+    @property
+    def config(self) -> Config:
+        return self._config
+
+    @property
+    def snapshot(self) -> Snapshot:
+        """The current snapshot of the cache.
+
+        Callers wanting a consistent view across several lookups should hold
+        on to a single snapshot rather than going through the cache each time.
+        """
+        return self._snapshot
+
+    @property
+    def index(self) -> int:
+        """The Consul index the cache is up to date with."""
+        return self._snapshot.index
+
+    @property
+    def catalog(self) -> Catalog:
+        return self._catalog
+
+    @property
+    def staleness(self) -> float:
+        """Seconds since the cache was last known to be up to date."""
+        return monotonic() - self._checked_at
+
+    @property
+    def refreshes(self) -> int:
+        return self._refreshes
+
+    @property
+    def refresh_duration(self) -> float:
+        """Duration of the last refresh, in seconds."""
+        return self._refresh_duration
+
+    @property
+    def load_durations(self) -> Dict[DNSName, float]:
+        """Duration of the last load of each zone, in seconds."""
+        return self._load_durations
+
+    def checked(self) -> None:
+        """Records that the cache was found to be up to date."""
+        self._checked_at = monotonic()
+
+    def _client(self) -> ConsulClient:
+        return self._config.consul_client()
+
+    def reconnect(self) -> None:
+        """Replaces the connections to Consul used by the cache."""
+        self._consul.reset(self._client())
+        self._catalog.reconnect(Consul(self._client(), metrics.observe_consul))
+
+    def start(self) -> None:
+        """Starts the work of the cache done in background threads.
+
+        That is watching the services used by its zones and, when the cache
+        was mapped from the snapshot file, loading it from Consul.
+        """
+        self._catalog.start()
+        if self._mapped:
+            thr = Thread(target=self._load_in_background, name="loader")
+            thr.daemon = True
+            thr.start()
 
     def load(self) -> None:
-        # TODO: add a reset method to Consul, so we don't need to re-instantiate
-        self._consul = Consul(
-            ConsulClient(
-                scheme=self._config.consul_addr.scheme,
-                host=self._config.consul_addr.host,
-                port=self._config.consul_addr.port,
-            )
-        )
+        self._consul = Consul(self._client(), metrics.observe_consul)
         # TODO: add zones for reverse domains
-        self._czs = {}
-        self._czs_by_id = {}
-
-        for i, zone in enumerate(self._consul.zones):
-            records = defaultdict(lambda: [])
-            cz = CachedZone(zone, records)
-
-            self._czs[zone.name] = (i, cz)
-            self._czs_by_id[i] = cz
-            for record in zone.records:
-                if record.record != "@":
-                    sub = dns_from_text(record.record, origin=None)
-                    domain = sub.concatenate(zone.name)
-                else:
-                    domain = zone.name
-                # TODO: handle CONSUL records
-                records[domain].append(record)
+        self._snapshot = Snapshot(0, {})
+        self._ids: Dict[DNSName, int] = {}
+
+        self._prefetch()
 
         # TODO: Get reverse IPs (need some information on netmask)
         # records = (record for records in self._records.values() for record in records)
@@ -153,30 +576,334 @@ class Cache:
         #     if record.record_type != RecordType.A or record.record_type != RecordType.AAAA:
         #         continue
 
+    def _map(self) -> bool:
+        """Serves the zones of the snapshot file until Consul is loaded.
+
+        The file is memory-mapped and zones are only decoded when first
+        accessed, so this takes about the same time whatever the size of the
+        zones. The authoritative load from Consul then runs in the background
+        once started, and only reloads zones whose ModifyIndex moved since the
+        snapshot. Returns False when there is no usable snapshot file.
+        """
+        if self._snapshot_file is None or not self._snapshot_file.path.exists():
+            return False
+
+        self._consul = Consul(self._client(), metrics.observe_consul)
+        snapshot = self._read_snapshot(Snapshot(0, {}))
+        if snapshot is None:
+            return False
+
+        self._snapshot = snapshot
+        self._saved = _zone_indexes(snapshot)
+        log.info(
+            "mapped snapshot file",
+            path=self._snapshot_file.path,
+            index=snapshot.index,
+            zones=len(snapshot.zones_by_name),
+        )
+        return True
+
+    def _read_snapshot(self, old: Snapshot) -> Snapshot | None:
+        """Maps the snapshot file, returning None if it is not usable.
+
+        Zones of `old` at the same ModifyIndex as in the file are carried over
+        as they are, those not decoded yet reading from the new map instead,
+        so that older maps are released.
+        """
+        assert self._snapshot_file is not None
+        try:
+            index, raws = self._snapshot_file.read()
+        except InvalidSnapshot as err:
+            log.warning(
+                "ignoring snapshot file",
+                path=self._snapshot_file.path,
+                err=err,
+            )
+            return None
+
+        self._ids = {
+            dns_from_text(zone_name): i for zone_name, i in index.ids.items()
+        }
+        # So that decoding zones never waits on Consul for their services
+        self._catalog.seed(index.services)
+        czs = {}
+        for entry, raw in zip(index.zones, raws):
+            zone_name = dns_from_text(entry.name)
+            current = old.zone_by_name(zone_name)
+            if current is not None and current[1].index == entry.index:
+                if isinstance(current[1], MappedZone):
+                    current[1]._remap(entry, raw)
+                czs[zone_name] = current
+            else:
+                czs[zone_name] = (entry.id, MappedZone(self, entry, raw))
+        return Snapshot(index.index, czs)
+
+    def _load_in_background(self) -> None:
+        while True:
+            try:
+                index = self._prefetch()
+            except Exception as err:
+                log.error("error while loading from Consul", err=err)
+                sleep(RETRY_DELAY)
+                continue
+
+            log.info("loaded from Consul", index=index)
+            return
+
+    def _prefetch(self) -> int:
+        """Loads all zones with a single request, returns the Consul index."""
+        index, zones = self._consul.prefetch()
+        self.refresh(
+            index,
+            {zone_name: i for zone_name, (i, _) in zones.items()},
+            {zone_name: zone for zone_name, (_, zone) in zones.items()},
+        )
+        return index
+
+    def save(self) -> None:
+        """Writes the current snapshot to the snapshot file, if any.
+
+        Nothing is written unless zones were added, removed or changed since
+        the file was last written or mapped. Zones are serialized without
+        holding the lock of the cache, so refreshes are not held up meanwhile.
+        """
+        if self._snapshot_file is None or not self._saves:
+            return
+
+        with self._save_lock:
+            with self._lock:
+                snapshot = self._snapshot
+                ids = dict(self._ids)
+            saved = _zone_indexes(snapshot)
+            if saved == self._saved:
+                return
+            instances = self._catalog.services
+            services = {
+                service: instances[service]
+                for _, cz in snapshot.zones_by_name.values()
+                for service in cz.services
+                if service in instances
+            }
+
+            start = perf_counter()
+            try:
+                self._snapshot_file.write(
+                    snapshot.index,
+                    {zone_name.to_text(): i for zone_name, i in ids.items()},
+                    (
+                        (
+                            SnapshotFile.Entry(
+                                name=zone_name.to_text(),
+                                id=i,
+                                index=cz.index,
+                                services=sorted(cz.services),
+                                records=cz.record_count,
+                            ),
+                            cz.raw_data,
+                        )
+                        for zone_name, (i, cz) in snapshot.zones_by_name.items()
+                    ),
+                    services,
+                )
+            except OSError as err:
+                log.error(
+                    "error while writing snapshot file",
+                    path=self._snapshot_file.path,
+                    err=err,
+                )
+                return
+            self._saved = saved
+        log.debug(
+            "wrote snapshot file",
+            path=self._snapshot_file.path,
+            duration=perf_counter() - start,
+        )
+
+    def _load_zone(self, zone: Zone, index: int) -> CachedZone:
+        # Make sure everything the handlers read is in memory, so that queries
+        # are never blocked on Consul.
+        zone.metadata
+        list(zone.keys)
+        records = defaultdict(lambda: [])
+        for record in zone.records:
+            if record.record != "@":
+                sub = dns_from_text(record.record, origin=None)
+                domain = sub.concatenate(zone.name)
+            else:
+                domain = zone.name
+            records[domain].append(record)
+
+        return CachedZone(zone, dict(records), index, self._catalog)
+
+    def _load_zones(
+        self, zones: List[Tuple[Zone, int]]
+    ) -> List[Tuple[DNSName, CachedZone, float]]:
+        """Loads zones, at their ModifyIndex, on up to load_workers threads.
+
+        Each zone is read from Consul, unless it was prefetched, decoded and
+        indexed on its own thread, so that the round trips of several zones
+        overlap. Returns each zone along with how long it took to load.
+        """
+        workers = min(self._config.load_workers, len(zones))
+        if workers <= 1:
+            return [self._timed_load_zone(zone, i) for zone, i in zones]
+
+        with ThreadPoolExecutor(workers, thread_name_prefix="loader") as pool:
+            return list(
+                pool.map(lambda args: self._timed_load_zone(*args), zones)
+            )
+
+    def _timed_load_zone(
+        self, zone: Zone, index: int
+    ) -> Tuple[DNSName, CachedZone, float]:
+        start = perf_counter()
+        cz = self._load_zone(zone, index)
+        duration = perf_counter() - start
+        log.info(
+            "loaded zone",
+            zone=zone.name,
+            index=index,
+            records=cz.record_count,
+            duration=duration,
+        )
+        return zone.name, cz, duration
+
+    def refresh(
+        self,
+        index: int,
+        indexes: Dict[DNSName, int],
+        zones: Dict[DNSName, Zone] | None = None,
+    ) -> None:
+        """Brings the cache up to date with the given zone ModifyIndexes.
+
+        Only zones that are new or whose ModifyIndex changed are re-read from
+        Consul, all the others are carried over as they are. Zones already
+        read, e.g. by Consul.prefetch, can be passed in `zones`. Zones missing
+        from `indexes` are dropped. The new state is published atomically.
+        """
+        zones = zones or {}
+        start = perf_counter()
+        with self._lock:
+            old = self._snapshot
+            # In the order of zone names, each zone carried over, or the id of
+            # a zone to load
+            entries: List[Tuple[DNSName, Tuple[int, CachedZone] | int]] = []
+            to_load = []
+            for zone_name, zone_index in sorted(indexes.items()):
+                current = old.zone_by_name(zone_name)
+                if current is not None and current[1].index == zone_index:
+                    entries.append((zone_name, current))
+                    continue
+
+                if current is not None:
+                    i = current[0]
+                else:
+                    i = self._ids.setdefault(zone_name, len(self._ids))
+                zone = zones.get(zone_name) or Zone(self._consul, zone_name)
+                to_load.append((zone, zone_index))
+                entries.append((zone_name, i))
+
+            # Replaced rather than updated, as the metrics read it meanwhile
+            durations = {
+                zone_name: duration
+                for zone_name, duration in self._load_durations.items()
+                if zone_name in indexes
+            }
+            # Loaded zones come back in the order they were listed
+            loaded = iter(self._load_zones(to_load))
+            czs = {}
+            for zone_name, entry in entries:
+                if isinstance(entry, int):
+                    _, cz, duration = next(loaded)
+                    entry = (entry, cz)
+                    durations[zone_name] = duration
+                czs[zone_name] = entry
+            self._load_durations = durations
+
+            self._publish(Snapshot(index, czs))
+            self._refreshed(perf_counter() - start)
+        self.save()
+
+    def _refreshed(self, duration: float) -> None:
+        self._refreshes += 1
+        self._refresh_duration = duration
+        self._checked_at = monotonic()
+
+    def _refresh_service(self, service: str) -> None:
+        """Rebuilds the zones resolving records from a service that changed."""
+        with self._lock:
+            old = self._snapshot
+            czs = {}
+            for zone_name, (i, cz) in old.zones_by_name.items():
+                if service in cz.services:
+                    log.info("rebuilding zone", zone=zone_name, service=service)
+                    cz = cz.rebuild()
+                czs[zone_name] = (i, cz)
+
+            self._publish(Snapshot(old.index, czs))
+
+    def install(
+        self, services: Dict[str, List[Consul.ServiceInstance]], remap: bool
+    ) -> None:
+        """Brings the cache up to date with the process refreshing it.
+
+        `services` holds the instances of the services that changed, or that
+        zones which changed use. With `remap`, zones changed and the snapshot
+        file is mapped again: zones whose ModifyIndex moved are replaced by
+        zones decoded from the file when first used. Zones using one of the
+        services are rebuilt.
+        """
+        start = perf_counter()
+        self._catalog.update(services)
+        with self._lock:
+            new = self._snapshot
+            if remap:
+                new = self._read_snapshot(new) or new
+            czs = {}
+            for zone_name, (i, cz) in new.zones_by_name.items():
+                if not cz.services.isdisjoint(services):
+                    cz = cz.rebuild()
+                czs[zone_name] = (i, cz)
+
+            self._publish(Snapshot(new.index, czs))
+            self._refreshed(perf_counter() - start)
+
+    def after_fork(self) -> None:
+        """Prepares the copy of the cache inherited by a forked worker.
+
+        The worker gets its own lock and connection to Consul, and does not
+        inherit the listeners of its parent. Nor does it watch services, their
+        instances are expected to come along with `install`. It maps the
+        snapshot file, but never writes it.
+        """
+        self._lock = Lock()
+        self._save_lock = Lock()
+        self._saves = False
+        self._listeners = []
+        self._catalog.after_fork()
+        self.reconnect()
+
+    def add_listener(
+        self, listener: Callable[[Snapshot, Snapshot], None]
+    ) -> None:
+        """Calls `listener` with the old and new snapshot on every change."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def _publish(self, snapshot: Snapshot) -> None:
+        old = self._snapshot
+        self._snapshot = snapshot
+        for listener in self._listeners:
+            listener(old, snapshot)
+
     @property
     def zones(self) -> Iterator[Tuple[int, CachedZone]]:
-        for cz in self._czs.values():
-            yield cz
+        return self._snapshot.zones
 
     def zone_by_id(self, id: int) -> CachedZone | None:
-        if id in self._czs_by_id:
-            return self._czs_by_id[id]
-
-        return None
+        return self._snapshot.zone_by_id(id)
 
     def zone_by_qname(
         self, domain: DNSName, exact: bool = False
     ) -> Tuple[int, CachedZone | None]:
-        best_cz = None
-        best_i = -1
-        best_len = 0
-        for zdom, (i, cz) in self._czs.items():
-            domain_match = (exact and zdom == domain) or (
-                not exact and domain.is_subdomain(zdom)
-            )
-            if domain_match and len(zdom) > best_len:
-                best_cz = cz
-                best_i = i
-                best_len = len(zdom)
-
-        return best_i, best_cz
+        return self._snapshot.zone_by_qname(domain, exact)
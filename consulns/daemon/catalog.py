@@ -0,0 +1,166 @@
+from threading import Lock, Thread
+from time import sleep
+from typing import Callable, Dict, List
+
+from structlog import get_logger
+
+from consulns.daemon.config import Config
+from consulns.store.consul import Consul
+
+log = get_logger()
+
+# Seconds to wait before retrying after a failed blocking query
+RETRY_DELAY = 1
+
+ServiceInstance = Consul.ServiceInstance
+
+
+class Catalog:
+    """An in-memory view of the healthy instances of Consul services.
+
+    A service is watched with Consul blocking queries on its health endpoint
+    from the first time its instances are requested, so that answering a DNS
+    query never requires a call to Consul. Listeners are notified with the
+    name of a service whenever its set of healthy instances changes.
+
+    With `watch` False, services are only watched once `start` is called, for
+    processes which fork and must not have any thread running until then.
+    """
+
+    def __init__(
+        self, config: Config, consul: Consul, watch: bool = True
+    ) -> None:
+        # Blocking queries hold on to their connection, the catalog should
+        # not share one with anything else.
+        self._consul = consul
+        self._wait = config.watch_wait
+        self._watch_services = config.watch_services
+        self._watching = self._watch_services and watch
+        self._lock = Lock()
+        self._instances: Dict[str, List[ServiceInstance]] = {}
+        # Services fetched before watching started, with their index
+        self._unwatched: Dict[str, int] = {}
+        self._listeners: List[Callable[[str], None]] = []
+
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+
+    def instances(self, service: str) -> List[ServiceInstance]:
+        """Returns the healthy instances of a service.
+
+        The first request for a service fetches its instances and starts
+        watching it.
+        """
+        with self._lock:
+            if service in self._instances:
+                return self._instances[service]
+
+        index, instances = self._consul.service_instances(service)
+        with self._lock:
+            if service in self._instances:
+                return self._instances[service]
+            self._instances[service] = instances
+            if not self._watching:
+                if self._watch_services:
+                    self._unwatched[service] = index
+                return instances
+
+        self._start_watch(service, index)
+        return instances
+
+    def start(self) -> None:
+        """Starts watching services, those fetched so far included."""
+        with self._lock:
+            if not self._watch_services or self._watching:
+                return
+            self._watching = True
+            unwatched, self._unwatched = self._unwatched, {}
+
+        for service, index in unwatched.items():
+            self._start_watch(service, index)
+
+    def _start_watch(self, service: str, index: int) -> None:
+        thr = Thread(target=self._watch, args=(service, index), name=service)
+        thr.daemon = True
+        thr.start()
+
+    @property
+    def services(self) -> Dict[str, List[ServiceInstance]]:
+        with self._lock:
+            return dict(self._instances)
+
+    def update(self, services: Dict[str, List[ServiceInstance]]) -> None:
+        """Stores instances fetched by someone else, without notifying."""
+        with self._lock:
+            self._instances.update(services)
+
+    def seed(self, services: Dict[str, List[ServiceInstance]]) -> None:
+        """Stores instances known from elsewhere, of services not known yet.
+
+        E.g. those of a snapshot file, which may be outdated: services are
+        watched from scratch, as they would be on their first request.
+        """
+        with self._lock:
+            seeded = [s for s in services if s not in self._instances]
+            for service in seeded:
+                self._instances[service] = services[service]
+            if not self._watch_services:
+                return
+            if not self._watching:
+                for service in seeded:
+                    self._unwatched[service] = 0
+                return
+
+        for service in seeded:
+            self._start_watch(service, 0)
+
+    def reconnect(self, consul: Consul) -> None:
+        """Switches to a new connection, e.g. after forking."""
+        self._consul = consul
+
+    def after_fork(self) -> None:
+        """Prepares the copy of the catalog inherited by a forked child.
+
+        Watches do not survive a fork: the child relies on `update` instead.
+        """
+        self._lock = Lock()
+        self._listeners = []
+        self._watch_services = False
+        self._watching = False
+        self._unwatched = {}
+
+    def _watch(self, service: str, index: int) -> None:
+        log.info("watching service", service=service, index=index)
+        while True:
+            try:
+                new_index, instances = self._consul.service_instances(
+                    service, index=index, wait=self._wait
+                )
+            except Exception as err:
+                log.error("error while watching service", err=err)
+                sleep(RETRY_DELAY)
+                continue
+
+            if new_index == index:
+                continue
+            # Consul indexes are not guaranteed to be monotonic, reset the
+            # watch when they go backwards.
+            index = new_index if new_index > index else 0
+
+            with self._lock:
+                if self._instances.get(service) == instances:
+                    continue
+                self._instances[service] = instances
+                listeners = list(self._listeners)
+
+            log.info(
+                "service instances changed",
+                service=service,
+                instances=len(instances),
+            )
+            for listener in listeners:
+                try:
+                    listener(service)
+                except Exception as err:
+                    log.error("error while notifying listener", err=err)
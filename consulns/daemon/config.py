@@ -1,7 +1,11 @@
+from pathlib import Path
+
+from consul import Consul as ConsulClient
 from pydantic import HttpUrl, UrlConstraints
 from pydantic_settings import BaseSettings
 
 from consulns.const import DEFAULT_CONSUL_PORT
+from consulns.store.transport import Client, Transport
 
 
 class ConsulDsn(HttpUrl):
@@ -33,3 +37,60 @@ class ConsulDsn(HttpUrl):
 
 class Config(BaseSettings):
     consul_addr: ConsulDsn = ConsulDsn("http://127.0.0.1:8500")
+    # Timeouts of requests to Consul, in seconds, and retries of failed reads
+    consul_connect_timeout: float = 2.0
+    consul_read_timeout: float = 10.0
+    consul_retries: int = 3
+    # Connections to Consul kept alive by each client
+    consul_pool_size: int = 10
+    # Consecutive failed requests after which requests to Consul fail fast,
+    # for consul_breaker_reset seconds
+    consul_breaker_failures: int = 5
+    consul_breaker_reset: float = 10.0
+    # Keep the cache up to date by watching Consul for changes
+    watch: bool = True
+    # Maximum duration of a single Consul blocking query
+    watch_wait: str = "5m"
+    # Keep the instances of services referenced by CONSUL records up to date
+    watch_services: bool = True
+    # Threads loading zones from Consul concurrently
+    load_workers: int = 8
+    # Snapshot of the cache written after each load, and served at startup
+    # while the cache is loaded from Consul
+    snapshot_path: Path | None = None
+
+    # Minimum level of the daemon logs
+    log_level: str = "info"
+    # Log a line for each query, from a background thread
+    query_log: bool = False
+    # File the query log is appended to, standard error when unset
+    query_log_path: Path | None = None
+    # Only log one query every query_log_sample
+    query_log_sample: int = 1
+    # Queries buffered before the oldest ones are dropped
+    query_log_size: int = 8192
+    # Seconds between two writes of the query log
+    query_log_interval: float = 1.0
+    # Exceptions of the same type reported every exception_interval seconds
+    exception_burst: int = 5
+    exception_interval: float = 60.0
+    # Serve metrics in Prometheus format over HTTP on this local port
+    metrics_port: int | None = None
+    # Write metrics in Prometheus format to clients of this UNIX socket
+    metrics_socket: Path | None = None
+
+    def consul_client(self) -> ConsulClient:
+        """Returns a new client for the configured Consul."""
+        return Client(
+            Transport(
+                connect_timeout=self.consul_connect_timeout,
+                read_timeout=self.consul_read_timeout,
+                retries=self.consul_retries,
+                pool_size=self.consul_pool_size,
+                breaker_failures=self.consul_breaker_failures,
+                breaker_reset=self.consul_breaker_reset,
+            ),
+            scheme=self.consul_addr.scheme,
+            host=self.consul_addr.host,
+            port=self.consul_addr.port,
+        )
@@ -0,0 +1,108 @@
+from socket import socket
+from typing import List
+
+# Bytes requested from the socket by each read
+RECV_SIZE = 1 << 16
+# Maximum length of a single query line
+MAX_QUERY_SIZE = 1 << 20
+# Maximum number of buffers passed to a single sendmsg, see IOV_MAX
+MAX_BUFFERS = 1024
+
+
+class QueryTooLarge(Exception):
+    pass
+
+
+class Framer:
+    """Splits the newline-delimited queries read from a socket.
+
+    Reads go straight into a single buffer, reused for the whole life of the
+    connection, and every query already received is handed out at once so
+    that queries sent back to back are answered in a single pass. Replies
+    are written back with one vectored write per batch.
+    """
+
+    def __init__(
+        self,
+        sock: socket,
+        recv_size: int = RECV_SIZE,
+        max_size: int = MAX_QUERY_SIZE,
+    ) -> None:
+        self._sock = sock
+        self._recv_size = recv_size
+        self._max_size = max_size
+        self._buf = bytearray(recv_size)
+        self._view = memoryview(self._buf)
+        # Data in the buffer lies in [_start, _end), and holds no newline
+        # before _scanned.
+        self._start = 0
+        self._end = 0
+        self._scanned = 0
+
+    def read(self) -> List[bytes]:
+        """Returns all the complete queries received, waiting for at least one.
+
+        An empty list is only returned once the peer closed the connection.
+        """
+        while True:
+            queries = self._split()
+            if len(queries) > 0:
+                return queries
+
+            self._reserve()
+            n = self._sock.recv_into(self._view[self._end :])
+            if n == 0:
+                return []
+            self._end += n
+
+    def _split(self) -> List[bytes]:
+        queries = []
+        while True:
+            nl = self._buf.find(b"\n", self._scanned, self._end)
+            if nl == -1:
+                self._scanned = self._end
+                break
+
+            # Decoders need their own bytes object, this is the only copy a
+            # query goes through.
+            queries.append(bytes(self._view[self._start : nl + 1]))
+            self._start = self._scanned = nl + 1
+
+        if self._start == self._end:
+            self._start = self._end = self._scanned = 0
+        return queries
+
+    def _reserve(self) -> None:
+        # Makes room for at least recv_size more bytes
+        if len(self._buf) - self._end >= self._recv_size:
+            return
+
+        pending = self._end - self._start
+        if pending >= self._max_size:
+            raise QueryTooLarge(f"query exceeds {self._max_size} bytes")
+
+        if self._start > 0:
+            self._view.release()
+            self._buf[: self._end - self._start] = self._buf[
+                self._start : self._end
+            ]
+            self._scanned -= self._start
+            self._start, self._end = 0, pending
+        if len(self._buf) - self._end < self._recv_size:
+            self._view.release()
+            self._buf.extend(bytes(self._recv_size))
+        self._view = memoryview(self._buf)
+
+    def write(self, replies: List[bytes]) -> None:
+        """Sends replies, in order, with as few system calls as possible."""
+        bufs = [memoryview(reply) for reply in replies if len(reply) > 0]
+        while len(bufs) > 0:
+            sent = self._sock.sendmsg(bufs[:MAX_BUFFERS])
+            # Drop whatever was written, partial writes included
+            while sent > 0:
+                if sent >= len(bufs[0]):
+                    sent -= len(bufs[0])
+                    bufs.pop(0)
+                else:
+                    bufs[0] = bufs[0][sent:]
+                    sent = 0
@@ -1,9 +1,9 @@
-from socket import socket
-from typing import Tuple
+from time import perf_counter_ns
+from typing import Iterator, Tuple
 from pydantic import ValidationError
 from structlog import get_logger
-from dns.name import from_text as dns_from_text
-from itertools import cycle
+from structlog.typing import FilteringBoundLogger
+from dns.name import Name as DNSName, from_text as dns_from_text
 
 from consulns.daemon.proto import (
     AddDomainKeyParameters,
@@ -20,114 +20,143 @@ from consulns.daemon.proto import (
     LookupParameters,
     Query,
     RemoveDomainKeyParameters,
-    Response,
-    QueryAdapter,
+    Result,
     SetDomainMetadataParameters,
     ZoneKind,
+    decode_query,
+    encode_records,
+    encode_response,
 )
 from consulns.daemon.cache import Cache, CachedZone
+from consulns.daemon.metrics import metrics
+from consulns.daemon.querylog import querylog
 
 dlog = get_logger()
 id_cnt = 0
 
 
+# A raw response, either whole or as a sequence of chunks to send in order
+Reply = bytes | Iterator[bytes]
+
+# Methods that write to Consul. Server engines that must not block, such as
+# the asyncio one, run these off the event loop.
+BLOCKING_METHODS = frozenset(
+    {"setDomainMetadata", "addDomainKey", "removeDomainKey"}
+)
+
+
 class Handler:
+    """Implements the remote backend protocol for a single connection.
+
+    The handler turns raw queries into raw responses and knows nothing about
+    sockets, so that its logic is shared by all server engines.
+    """
+
     __id_cnt = 0
 
-    def __init__(self, sock: socket, store: Cache) -> None:
+    def __init__(self, store: Cache) -> None:
         self._id = Handler.__id_cnt
         Handler.__id_cnt += 1
 
-        self._log = dlog.bind(conn_id=self._id)
-        self._sock = sock
+        self._log: FilteringBoundLogger = dlog.bind(conn_id=self._id)
         self._store = store
 
-    def handle(self) -> None:
-        self._log.info("connection enstablished")
+    @property
+    def log(self) -> FilteringBoundLogger:
+        return self._log
+
+    def decode(self, raw_query: bytes) -> Query | None:
+        self._log.debug("received raw query", raw_msg=raw_query)
         try:
-            with self._sock.makefile("rb") as f:
-                while True:
-                    raw_query = f.readline()
-                    if raw_query is None or len(raw_query) == 0:
-                        break
-                    self._log.debug("received raw query", raw_msg=raw_query)
-                    try:
-                        query = QueryAdapter.validate_json(raw_query)
-                    except ValidationError as err:
-                        self._log.error(
-                            "invalid query", raw_msg=raw_query, err=err
-                        )
-                        self.reply(Response(result=False))
-                        continue
-
-                    try:
-                        self.handle_query(query)
-                    except Exception as err:
-                        self._log.error(
-                            "error while handling query", query=query, err=err
-                        )
-                        from rich.console import Console
-
-                        Console().print_exception(show_locals=True)
-        finally:
-            self._log.info("connection closed")
-            self._sock.close()
-
-    def reply(self, resp: Response) -> None:
+            return decode_query(raw_query)
+        except ValidationError as err:
+            self._log.error("invalid query", raw_msg=raw_query, err=err)
+            return None
+
+    def handle(self, raw_query: bytes) -> Reply | None:
+        """Handles a raw query, returning the raw response to send, if any."""
+        query = self.decode(raw_query)
+        if query is None:
+            return self.reply(False)
+
+        return self.handle_query(query)
+
+    def reply(self, result: Result) -> bytes | None:
         try:
-            self._log.debug("sending response", response=resp)
-            json = resp.model_dump_json()
-            self._log.debug("sending raw response", raw_response=json)
-            self._sock.sendall(json.encode("utf-8"))
+            self._log.debug("sending response", result=result)
+            return encode_response(result)
         except Exception as err:
             self._log.error(
-                "error while serializing response", response=resp, err=err
+                "error while serializing response", result=result, err=err
             )
+            return None
 
-    def handle_query(self, msg: Query) -> None:
+    def handle_query(self, msg: Query) -> Reply | None:
+        start = perf_counter_ns()
+        try:
+            raw_resp = self._dispatch(msg)
+        except Exception as err:
+            self._log.error(
+                "error while handling query", method=msg.method, err=err
+            )
+            # The traceback is rendered off the hot path, if at all
+            querylog.exception(err)
+            raw_resp = None
+
+        duration = perf_counter_ns() - start
+        metrics.observe_query(msg.method, duration, raw_resp is None)
+        if querylog.enabled:
+            querylog.record(self._id, msg, duration, raw_resp)
+        return raw_resp
+
+    def _dispatch(self, msg: Query) -> Reply | None:
         self._log.debug("received query", msg=msg)
         match msg.method:
             case "initialize":
-                self.handle_initialize(msg.parameters)
+                return self.handle_initialize(msg.parameters)
             case "getAllDomains":
-                self.handle_get_all_domains(msg.parameters)
+                return self.handle_get_all_domains(msg.parameters)
             case "getDomainInfo":
-                self.handle_get_domain_info(msg.parameters)
+                return self.handle_get_domain_info(msg.parameters)
 
             case "lookup":
-                self.handle_lookup(msg.parameters)
+                return self.handle_lookup(msg.parameters)
             case "list":
-                self.handle_list(msg.parameters)
+                return self.handle_list(msg.parameters)
 
             case "getAllDomainMetadata":
-                self.handle_get_all_domain_metadata(msg.parameters)
+                return self.handle_get_all_domain_metadata(msg.parameters)
             case "getDomainMetadata":
-                self.handle_get_domain_metadata(msg.parameters)
+                return self.handle_get_domain_metadata(msg.parameters)
             case "setDomainMetadata":
-                self.handle_set_domain_metadata(msg.parameters)
+                return self.handle_set_domain_metadata(msg.parameters)
 
             case "getDomainKeys":
-                self.handle_get_domain_keys(msg.parameters)
+                return self.handle_get_domain_keys(msg.parameters)
             case "addDomainKey":
-                self.handle_add_domain_key(msg.parameters)
+                return self.handle_add_domain_key(msg.parameters)
             case "removeDomainKey":
-                self.handle_remove_domain_key(msg.parameters)
+                return self.handle_remove_domain_key(msg.parameters)
             case "getBeforeAndAfterNamesAbsolute":
-                self.handle_get_before_and_after_names_absolute(msg.parameters)
+                return self.handle_get_before_and_after_names_absolute(
+                    msg.parameters
+                )
 
             # TODO: do we even need to handle transactions?
             case "startTransaction":
-                self.reply(Response(result=True))
+                return self.reply(True)
             case "commitTransaction":
-                self.reply(Response(result=True))
+                return self.reply(True)
 
             case _:
                 assert False
 
-    def handle_initialize(self, _: InitializeParameters):
-        self.reply(Response(result=True))
+    def handle_initialize(self, _: InitializeParameters) -> bytes | None:
+        return self.reply(True)
 
-    def handle_get_all_domains(self, params: GetAllDomainsParameters) -> None:
+    def handle_get_all_domains(
+        self, params: GetAllDomainsParameters
+    ) -> bytes | None:
         domains = [
             DomainInfo(
                 id=i,
@@ -140,10 +169,12 @@ class Handler:
             for i, zone in self._store.zones
             if params.include_disabled or zone._zone.enabled
         ]
-        self._log.info("filtered out domains", domains=domains)
-        self.reply(Response(result=domains))
+        self._log.debug("filtered out domains", domains=len(domains))
+        return self.reply(domains)
 
-    def handle_get_domain_info(self, params: GetDomainInfoParameters) -> None:
+    def handle_get_domain_info(
+        self, params: GetDomainInfoParameters
+    ) -> bytes | None:
         id, zone = self._get_zone_checked(params.name)
         di = DomainInfo(
             id=id,
@@ -153,12 +184,9 @@ class Handler:
             last_check=zone._zone.last_check,
             kind=ZoneKind.MASTER,
         )
-        self.reply(Response(result=di))
+        return self.reply(di)
 
-    def handle_lookup(self, params: LookupParameters) -> None:
-        self._log.info(
-            "performing lookup", qtype=params.qtype, qname=params.qname
-        )
+    def handle_lookup(self, params: LookupParameters) -> bytes | None:
         qname = dns_from_text(params.qname)
         if params.zone_id is not None and params.zone_id != -1:
             zone = self._store.zone_by_id(params.zone_id)
@@ -169,109 +197,111 @@ class Handler:
             self._log.warning(
                 "lookup is requesting domain in missing zone", domain=qname
             )
-            self.reply(Response(result=False))
-            return
-
-        records = zone.lookup(params.qtype, qname)
+            return self.reply(False)
 
-        self.reply(Response(result=list(records)))
+        return zone.answer(params.qtype, qname)
 
-    def handle_list(self, params: ListParameters) -> None:
+    def handle_list(self, params: ListParameters) -> Reply | None:
         _, zone = self._get_zone_checked(params.zonename)
         self._log.info("listing zone", zone=zone.zone.name)
 
-        self.reply(Response(result=[record for _, record in zone.records]))
+        # Zones can be arbitrarily large, stream them instead of building the
+        # whole response in memory.
+        return encode_records(record for _, record in zone.records)
 
     def _get_zone_checked(self, zone: str) -> Tuple[int, CachedZone]:
         zonename = dns_from_text(zone)
         id, z = self._store.zone_by_qname(zonename, exact=True)
         if z is None:
-            self._log.warinig("requested missing zone", zone=zonename)
+            self._log.warning("requested missing zone", zone=zonename)
             assert False
 
         return id, z
 
     def handle_get_all_domain_metadata(
         self, params: GetAllDomainMetadataParameters
-    ) -> None:
+    ) -> bytes | None:
         _, cz = self._get_zone_checked(params.name)
-        self.reply(Response(result=cz.zone.metadata))
+        return self.reply(cz.zone.metadata)
 
     def handle_get_domain_metadata(
         self, params: GetDomainMetadataParameters
-    ) -> None:
+    ) -> bytes | None:
         _, cz = self._get_zone_checked(params.name)
         metadata = cz.zone.metadata
         if params.kind not in metadata:
             result = []
         else:
             result = metadata[params.kind]
-        self.reply(Response(result=result))
+        return self.reply(result)
 
     def handle_set_domain_metadata(
         self, params: SetDomainMetadataParameters
-    ) -> None:
+    ) -> bytes | None:
         _, cz = self._get_zone_checked(params.name)
         cz.zone.set_metadata(params.kind, params.value)
-        self.reply(Response(result=True))
+        return self.reply(True)
 
     # DNSSEC handlers
 
-    def handle_get_domain_keys(self, params: GetDomainKeysParameters) -> None:
+    def handle_get_domain_keys(
+        self, params: GetDomainKeysParameters
+    ) -> bytes | None:
         _, cz = self._get_zone_checked(params.name)
 
-        self.reply(Response(result=list(cz._zone.keys)))
+        return self.reply(list(cz._zone.keys))
 
-    def handle_add_domain_key(self, params: AddDomainKeyParameters) -> None:
+    def handle_add_domain_key(
+        self, params: AddDomainKeyParameters
+    ) -> bytes | None:
         _, cz = self._get_zone_checked(params.name)
 
         cz.zone.add_key(params.key)
-        self.reply(Response(result=True))
+        return self.reply(True)
 
     def handle_remove_domain_key(
         self, params: RemoveDomainKeyParameters
-    ) -> None:
+    ) -> bytes | None:
         _, cz = self._get_zone_checked(params.name)
 
         if not any(key.id == params.id for key in cz.zone.keys):
             self._log.warning(
                 "attempted to remove non-existing key", key_id=params.id
             )
-            self.reply(Response(result=False))
-            return
+            return self.reply(False)
 
         cz.zone.remove_key(params.id)
-        self.reply(Response(result=True))
+        return self.reply(True)
 
     def handle_get_before_and_after_names_absolute(
         self, params: GetBeforeAndAfterNamesAbsoluteParameters
-    ) -> None:
-        qname = dns_from_text(params.qname, origin=None)
-        _, zone = self._store.zone_by_qname(qname)
+    ) -> bytes | None:
+        if params.id is not None and params.id != -1:
+            # PowerDNS sends the name relative to the zone
+            zone = self._store.zone_by_id(params.id)
+            origin = zone.zone.name if zone is not None else None
+            qname = dns_from_text(params.qname, origin=origin)
+        else:
+            qname = dns_from_text(params.qname)
+            _, zone = self._store.zone_by_qname(qname)
+
         if zone is None:
             self._log.warning(
                 "could not get before/after for missing zone", qname=qname
             )
-            self.reply(Response(result=False))
-            return
-
-        records = cycle(zone.records)
-        before = None
-        for _, record in records:
-            cmp = dns_from_text(record.qname).relativize(zone.zone.name)
-            if cmp == params.qname and before is not None:
-                break
-
-            before = cmp
-        _, next_record = next(records)
-        after = dns_from_text(next_record.qname).relativize(zone.zone.name)
-
-        self.reply(
-            Response(
-                result=BeforeAndAfterNames(
-                    before=before.to_text() if before is not None else "",
-                    after=after.to_text() or "",
-                    unhashed="",
-                )
+            return self.reply(False)
+
+        before, after = zone.before_and_after(qname)
+        return self.reply(
+            BeforeAndAfterNames(
+                before=_relative_text(before, zone),
+                after=_relative_text(after, zone),
+                unhashed="",
             )
         )
+
+
+def _relative_text(name: DNSName, zone: CachedZone) -> str:
+    if name == zone.zone.name:
+        return ""
+    return name.relativize(zone.zone.name).to_text()
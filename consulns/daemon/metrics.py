@@ -0,0 +1,179 @@
+import os
+from threading import Lock, Thread, current_thread, local
+from typing import Dict, Iterator, List, Tuple
+
+# Histograms keep the SUB_BITS bits following the most significant one of
+# each value, so that every bucket is at most 1/2^SUB_BITS of its lower
+# bound wide.
+SUB_BITS = 3
+SUB_BUCKETS = 1 << SUB_BITS
+# Values are nanoseconds, anything above 2^MAX_BITS (about 18 minutes) is
+# counted in the last bucket.
+MAX_BITS = 40
+
+
+def _bucket(value: int) -> int:
+    bits = value.bit_length()
+    if bits <= SUB_BITS:
+        return value
+    if bits > MAX_BITS:
+        return N_BUCKETS - 1
+    shift = bits - SUB_BITS - 1
+    return ((shift + 1) << SUB_BITS) + ((value >> shift) - SUB_BUCKETS)
+
+
+def _upper_bound(bucket: int) -> int:
+    """The smallest value above those counted in a bucket."""
+    if bucket < SUB_BUCKETS:
+        return bucket + 1
+    shift = (bucket >> SUB_BITS) - 1
+    return (SUB_BUCKETS + (bucket & (SUB_BUCKETS - 1)) + 1) << shift
+
+
+N_BUCKETS = _bucket((1 << MAX_BITS) - 1) + 1
+
+
+class Histogram:
+    """A log-linear histogram of durations, in nanoseconds.
+
+    Histograms are not thread-safe: each one is only written to by a single
+    thread, and merged into a fresh one to be read.
+    """
+
+    __slots__ = ("count", "counts", "sum")
+
+    def __init__(self) -> None:
+        self.counts = [0] * N_BUCKETS
+        self.count = 0
+        self.sum = 0
+
+    def record(self, value: int) -> None:
+        self.counts[_bucket(value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "Histogram") -> None:
+        for i, n in enumerate(other.counts):
+            if n > 0:
+                self.counts[i] += n
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> int:
+        """Returns an upper bound of the q-quantile of the values."""
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n > 0 and seen >= rank:
+                return _upper_bound(i)
+        return 0
+
+    def cumulative(self, bounds: List[int]) -> Iterator[Tuple[int, int]]:
+        """Yields the number of values below each of the sorted bounds."""
+        seen = 0
+        i = 0
+        for bound in bounds:
+            while i < N_BUCKETS and _upper_bound(i) <= bound:
+                seen += self.counts[i]
+                i += 1
+            yield bound, seen
+
+
+class _Shard:
+    """The metrics of a single thread."""
+
+    def __init__(self, thread: Thread | None) -> None:
+        self.thread = thread
+        self.queries: Dict[str, Histogram] = {}
+        self.errors: Dict[str, int] = {}
+        self.consul: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+
+    def merge(self, other: "_Shard") -> None:
+        for dst, src in (
+            (self.queries, other.queries),
+            (self.consul, other.consul),
+        ):
+            for key, histogram in list(src.items()):
+                dst.setdefault(key, Histogram()).merge(histogram)
+        for counts, other_counts in (
+            (self.errors, other.errors),
+            (self.counters, other.counters),
+        ):
+            for key, n in list(other_counts.items()):
+                counts[key] = counts.get(key, 0) + n
+
+
+class Metrics:
+    """Counters and latency histograms for the daemon.
+
+    Every thread writes to its own shard, so recording never takes a lock.
+    Shards are only merged when the metrics are read, and the ones of
+    threads that exited are folded together then.
+    """
+
+    def __init__(self) -> None:
+        self._local = local()
+        self._lock = Lock()
+        self._shards: List[_Shard] = []
+        self._retired = _Shard(None)
+
+    def _shard(self) -> _Shard:
+        try:
+            shard: _Shard = self._local.shard
+            return shard
+        except AttributeError:
+            shard = self._local.shard = _Shard(current_thread())
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def observe_query(self, method: str, duration: int, failed: bool) -> None:
+        """Records a query taking `duration` nanoseconds."""
+        shard = self._shard()
+        histogram = shard.queries.get(method)
+        if histogram is None:
+            histogram = shard.queries[method] = Histogram()
+        histogram.record(duration)
+        if failed:
+            shard.errors[method] = shard.errors.get(method, 0) + 1
+
+    def observe_consul(self, op: str, duration: float) -> None:
+        """Records a Consul request taking `duration` seconds."""
+        shard = self._shard()
+        histogram = shard.consul.get(op)
+        if histogram is None:
+            histogram = shard.consul[op] = Histogram()
+        histogram.record(int(duration * 1e9))
+
+    def inc(self, counter: str, n: int = 1) -> None:
+        shard = self._shard()
+        shard.counters[counter] = shard.counters.get(counter, 0) + n
+
+    def collect(self) -> _Shard:
+        """Returns the sum of the metrics of all threads."""
+        total = _Shard(None)
+        with self._lock:
+            alive = []
+            for shard in self._shards:
+                if shard.thread is not None and shard.thread.is_alive():
+                    alive.append(shard)
+                else:
+                    self._retired.merge(shard)
+            self._shards = alive
+            total.merge(self._retired)
+            for shard in alive:
+                total.merge(shard)
+        return total
+
+    def _after_fork(self) -> None:
+        # A forked child starts counting from zero
+        self._local = local()
+        self._lock = Lock()
+        self._shards = []
+        self._retired = _Shard(None)
+
+
+metrics = Metrics()
+os.register_at_fork(after_in_child=metrics._after_fork)
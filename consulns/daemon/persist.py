@@ -0,0 +1,125 @@
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+from consulns.store.consul import Consul
+
+MAGIC = b"CNSSNAP\n"
+VERSION = 1
+# Magic, version and length of the index
+_HEADER = struct.Struct(f"<{len(MAGIC)}sIQ")
+
+
+class InvalidSnapshot(Exception):
+    pass
+
+
+class SnapshotFile:
+    """A versioned on-disk copy of the cache, read through a memory map.
+
+    The file starts with a header and a JSON index of the zones it holds,
+    and of the instances of the services they use, followed by the data of
+    each zone (`Zone.Data` as JSON) back to back. Reading only parses the
+    index: the data of a zone is handed out as a view into the map, to be
+    decoded when first needed.
+    """
+
+    class Entry(BaseModel):
+        name: str
+        id: int
+        index: int
+        services: List[str]
+        records: int
+        # Filled in by write
+        offset: int = 0
+        length: int = 0
+
+    class Index(BaseModel):
+        index: int
+        # Ids handed out to zones so far, dropped zones included
+        ids: Dict[str, int]
+        zones: List["SnapshotFile.Entry"]
+        # Healthy instances of the services used by the zones, when written
+        services: Dict[str, List[Consul.ServiceInstance]] = {}
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def read(self) -> Tuple[Index, List[memoryview]]:
+        """Maps the file, returning its index and a view on each zone."""
+        try:
+            with open(self._path, "rb") as f:
+                # The map stays valid after the file is closed, and after it
+                # is replaced by a newer snapshot.
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as err:
+            raise InvalidSnapshot(err) from err
+
+        view = memoryview(mm)
+        if len(view) < _HEADER.size:
+            raise InvalidSnapshot("truncated header")
+        magic, version, index_len = _HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise InvalidSnapshot("not a snapshot file")
+        if version != VERSION:
+            raise InvalidSnapshot(f"unsupported version {version}")
+
+        start = _HEADER.size + index_len
+        try:
+            index = self.Index.model_validate_json(
+                bytes(view[_HEADER.size : start])
+            )
+        except ValidationError as err:
+            raise InvalidSnapshot(err) from err
+
+        zones = []
+        for entry in index.zones:
+            end = start + entry.offset + entry.length
+            if end > len(view):
+                raise InvalidSnapshot(f"truncated data for {entry.name}")
+            zones.append(view[start + entry.offset : end])
+        return index, zones
+
+    def write(
+        self,
+        index: int,
+        ids: Dict[str, int],
+        zones: Iterable[Tuple[Entry, bytes | memoryview]],
+        services: Dict[str, List[Consul.ServiceInstance]],
+    ) -> None:
+        """Atomically replaces the file with a new snapshot.
+
+        Each zone is given as its entry in the index and its data.
+        """
+        entries = []
+        blobs = []
+        offset = 0
+        for entry, blob in zones:
+            entry.offset = offset
+            entry.length = len(blob)
+            entries.append(entry)
+            blobs.append(blob)
+            offset += len(blob)
+        raw_index = (
+            self.Index(index=index, ids=ids, zones=entries, services=services)
+            .model_dump_json()
+            .encode("utf-8")
+        )
+
+        tmp = self._path.with_name(self._path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, len(raw_index)))
+            f.write(raw_index)
+            for blob in blobs:
+                f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path)
@@ -1,7 +1,16 @@
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
-from typing import Annotated, List as TList, Literal, Optional, Dict
+from itertools import islice
+from typing import (
+    Annotated,
+    Iterable,
+    Iterator,
+    List as TList,
+    Literal,
+    Optional,
+    Dict,
+)
 from pydantic import BaseModel, Field, TypeAdapter
 
 from consulns.store.zone import AddKey, Key
@@ -43,6 +52,7 @@ class QType(Enum):
     CNAME = "CNAME"
     MX = "MX"
     NS = "NS"
+    SRV = "SRV"
 
 
 class LookupParameters(BaseModel):
@@ -126,6 +136,7 @@ class RemoveDomainKey(BaseModel):
 
 
 class GetBeforeAndAfterNamesAbsoluteParameters(BaseModel):
+    id: Optional[int] = None
     qname: str
 
 
@@ -205,14 +216,84 @@ class BeforeAndAfterNames(BaseModel):
     unhashed: str
 
 
+Result = (
+    bool
+    | TList[DomainInfo]
+    | DomainInfo
+    | TList[RecordInfo]
+    | TList[Key]
+    | Dict[str, TList[str]]
+    | TList[str]
+    | BeforeAndAfterNames
+)
+
+
 class Response(BaseModel):
-    result: (
-        bool
-        | TList[DomainInfo]
-        | DomainInfo
-        | TList[RecordInfo]
-        | TList[Key]
-        | Dict[str, TList[str]]
-        | TList[str]
-        | BeforeAndAfterNames
-    )
+    result: Result
+
+
+# Codec
+#
+# Decoding goes through pydantic-core, which parses and validates the whole
+# Query union faster than a hand-written parser building the same models in
+# Python would. Encoding instead skips the Response model entirely: building
+# one validates `result` against every member of the union, only for it to be
+# serialized right away. Results are serialized directly, without validation.
+
+_result_adapter: TypeAdapter[Result] = TypeAdapter(Result)
+_records_adapter: TypeAdapter[TList[RecordInfo]] = TypeAdapter(
+    TList[RecordInfo]
+)
+
+_true_response = b'{"result":true}'
+_false_response = b'{"result":false}'
+
+
+def decode_query(raw: bytes) -> Query:
+    """Decodes a raw query, raising a ValidationError if it is malformed."""
+    return QueryAdapter.validate_json(raw)
+
+
+def encode_response(result: Result) -> bytes:
+    """Serializes a response, without validating its result."""
+    if result is True:
+        return _true_response
+    if result is False:
+        return _false_response
+
+    return b'{"result":%s}' % _result_adapter.dump_json(result)
+
+
+# Records serialized by a single call into pydantic-core
+RECORDS_BATCH = 256
+# Size past which a chunk of a streamed response is handed out
+CHUNK_SIZE = 1 << 16
+
+
+def encode_records(
+    records: Iterable[RecordInfo], chunk_size: int = CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Serializes a response listing records, in chunks of about chunk_size.
+
+    Records are consumed lazily, so no more than a chunk of the response is in
+    memory at any time, regardless of the number of records.
+    """
+    it = iter(records)
+    buf = bytearray(b'{"result":[')
+    first = True
+    while True:
+        batch = list(islice(it, RECORDS_BATCH))
+        if len(batch) == 0:
+            break
+
+        if not first:
+            buf += b","
+        first = False
+        # Strip the brackets off the serialized list
+        buf += memoryview(_records_adapter.dump_json(batch))[1:-1]
+        if len(buf) >= chunk_size:
+            yield bytes(buf)
+            buf.clear()
+
+    buf += b"]}"
+    yield bytes(buf)
@@ -0,0 +1,195 @@
+import os
+import sys
+import traceback
+from collections import deque
+from datetime import datetime
+from itertools import count
+from pathlib import Path
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from typing import Any, Deque, Dict, List, TextIO, Tuple
+
+from structlog import get_logger
+
+from consulns.daemon.config import Config
+from consulns.daemon.proto import Query
+
+log = get_logger()
+
+# Wall clock time, connection id, query, latency in ns and raw response
+QueryEvent = Tuple[float, int, Query, int, object]
+
+
+class QueryLog:
+    """Logs a line per query without slowing down the queries themselves.
+
+    Recording a query appends a small tuple, holding references to objects
+    that already exist, to a bounded ring buffer: the oldest events are
+    dropped when the writer cannot keep up. Formatting and writing happen in
+    batches from a background thread. Exceptions are reported from the same
+    thread, at most `exc_burst` per `exc_interval` seconds for each type.
+    """
+
+    def __init__(self) -> None:
+        # Checked by callers before recording, so that a disabled log costs
+        # a single attribute access.
+        self.enabled = False
+        self._size = 8192
+        self._sample = 1
+        self._path: Path | None = None
+        self._interval = 1.0
+        self._exc_burst = 5
+        self._exc_interval = 60.0
+
+        self._events: Deque[QueryEvent] = deque(maxlen=self._size)
+        self._exceptions: Deque[Tuple[float, BaseException]] = deque(
+            maxlen=self._exc_burst
+        )
+        self._counter = count()
+        self._dropped = 0
+        self._wakeup = Event()
+        self._thread: Thread | None = None
+
+        self._exc_lock = Lock()
+        # Exception type -> start of the current window, reports and
+        # suppressed reports in it
+        self._exc_windows: Dict[type, List[Any]] = {}
+
+    def configure(self, config: Config) -> None:
+        self._size = config.query_log_size
+        self._sample = max(config.query_log_sample, 1)
+        self._path = config.query_log_path
+        self._interval = config.query_log_interval
+        self._exc_burst = config.exception_burst
+        self._exc_interval = config.exception_interval
+        self._events = deque(maxlen=self._size)
+        self._exceptions = deque(maxlen=self._exc_burst)
+        self.enabled = config.query_log
+
+    def start(self) -> None:
+        self._thread = Thread(target=self._run, name="querylog")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _after_fork(self) -> None:
+        # Threads do not survive a fork, and the child must not write out the
+        # events of its parent.
+        self._events.clear()
+        self._exceptions.clear()
+        self._exc_lock = Lock()
+        self._wakeup = Event()
+        if self._thread is not None:
+            self.start()
+
+    def record(
+        self, conn_id: int, query: Query, latency: int, raw_resp: object
+    ) -> None:
+        if next(self._counter) % self._sample != 0:
+            return
+        if len(self._events) == self._size:
+            self._dropped += 1
+        self._events.append((time(), conn_id, query, latency, raw_resp))
+
+    def exception(self, err: BaseException) -> None:
+        """Reports an exception, unless too many of its type were reported."""
+        now = monotonic()
+        with self._exc_lock:
+            window = self._exc_windows.get(type(err))
+            if window is None or now - window[0] >= self._exc_interval:
+                window = self._exc_windows[type(err)] = [now, 0, 0]
+            if window[1] >= self._exc_burst:
+                window[2] += 1
+                return
+            window[1] += 1
+        self._exceptions.append((time(), err))
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        out = self._open()
+        while True:
+            self._wakeup.wait(self._interval)
+            self._wakeup.clear()
+            try:
+                self._flush(out)
+            except Exception as err:
+                log.error("could not write the query log", err=err)
+
+    def _open(self) -> TextIO:
+        if self._path is None:
+            return sys.stderr
+        return open(self._path, "a", buffering=1 << 16)
+
+    def _flush(self, out: TextIO) -> None:
+        lines = []
+        while len(self._exceptions) > 0:
+            lines.append(self._format_exception(*self._exceptions.popleft()))
+        while len(self._events) > 0:
+            lines.append(self._format_event(self._events.popleft()))
+
+        dropped, self._dropped = self._dropped, 0
+        if dropped > 0:
+            lines.append(f"{_timestamp(time())} dropped={dropped}\n")
+        suppressed = self._suppressed()
+        if suppressed > 0:
+            lines.append(
+                f"{_timestamp(time())} suppressed_exceptions={suppressed}\n"
+            )
+
+        if len(lines) > 0:
+            out.write("".join(lines))
+            out.flush()
+
+    def _suppressed(self) -> int:
+        with self._exc_lock:
+            suppressed = 0
+            for window in self._exc_windows.values():
+                suppressed += window[2]
+                window[2] = 0
+        return suppressed
+
+    @staticmethod
+    def _format_event(event: QueryEvent) -> str:
+        t, conn_id, query, latency, raw_resp = event
+        params = query.parameters
+        fields = [
+            _timestamp(t),
+            f"conn={conn_id}",
+            f"method={query.method}",
+        ]
+        for attr in ("qname", "name", "zonename"):
+            qname = getattr(params, attr, None)
+            if qname is not None:
+                fields.append(f"qname={qname}")
+                break
+        qtype = getattr(params, "qtype", None)
+        if qtype is not None:
+            fields.append(f"qtype={qtype.value}")
+        zone_id = getattr(params, "zone_id", None)
+        if zone_id is None:
+            zone_id = getattr(params, "domain_id", None)
+        if zone_id is not None:
+            fields.append(f"zone_id={zone_id}")
+        fields.append(f"latency_us={latency / 1000:.1f}")
+        if isinstance(raw_resp, bytes):
+            fields.append(f"records={raw_resp.count(_RECORD_START)}")
+        elif raw_resp is None:
+            fields.append("failed")
+        return " ".join(fields) + "\n"
+
+    @staticmethod
+    def _format_exception(t: float, err: BaseException) -> str:
+        return f"{_timestamp(t)} exception\n" + "".join(
+            traceback.format_exception(err)
+        )
+
+
+# Every record in a serialized response starts with this
+_RECORD_START = b'{"qtype":'
+
+
+def _timestamp(t: float) -> str:
+    return datetime.fromtimestamp(t).isoformat(timespec="milliseconds")
+
+
+querylog = QueryLog()
+os.register_at_fork(after_in_child=querylog._after_fork)
@@ -0,0 +1,136 @@
+import asyncio
+from socket import socket
+from threading import Thread
+from typing import List
+
+from structlog import get_logger
+
+from consulns.daemon.cache import Cache
+from consulns.daemon.framing import MAX_QUERY_SIZE, Framer, QueryTooLarge
+from consulns.daemon.handler import BLOCKING_METHODS, Handler, Reply
+from consulns.daemon.metrics import metrics
+
+log = get_logger()
+
+
+def _handle_connection(sock: socket, cache: Cache) -> None:
+    handler = Handler(cache)
+    handler.log.info("connection enstablished")
+    metrics.inc("connections_opened")
+    framer = Framer(sock, max_size=MAX_QUERY_SIZE)
+    try:
+        while True:
+            try:
+                raw_queries = framer.read()
+            except QueryTooLarge as err:
+                handler.log.error("query exceeds maximum size", err=err)
+                break
+            if len(raw_queries) == 0:
+                break
+
+            # Replies to queries received together are sent together, only
+            # streamed ones are written on their own.
+            batch: List[bytes] = []
+            for raw_query in raw_queries:
+                raw_resp = handler.handle(raw_query)
+                if raw_resp is None:
+                    continue
+                if isinstance(raw_resp, bytes):
+                    handler.log.debug(
+                        "sending raw response", raw_response=raw_resp
+                    )
+                    batch.append(raw_resp)
+                else:
+                    framer.write(batch)
+                    batch = []
+                    handler.log.debug("streaming raw response")
+                    for chunk in raw_resp:
+                        sock.sendall(chunk)
+            framer.write(batch)
+    finally:
+        handler.log.info("connection closed")
+        metrics.inc("connections_closed")
+        sock.close()
+
+
+def serve_threaded(srv: socket, cache: Cache) -> None:
+    """Serves each connection from its own thread."""
+    while True:
+        sock, _ = srv.accept()
+        thr = Thread(target=_handle_connection, args=(sock, cache))
+        thr.daemon = True
+        thr.start()
+
+
+async def _handle_stream(
+    cache: Cache, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    loop = asyncio.get_running_loop()
+    handler = Handler(cache)
+    handler.log.info("connection enstablished")
+    metrics.inc("connections_opened")
+    try:
+        while True:
+            try:
+                raw_query = await reader.readline()
+            except ValueError as err:
+                handler.log.error("query exceeds maximum size", err=err)
+                break
+            if len(raw_query) == 0:
+                break
+
+            query = handler.decode(raw_query)
+            raw_resp: Reply | None
+            if query is None:
+                raw_resp = handler.reply(False)
+            elif query.method in BLOCKING_METHODS:
+                raw_resp = await loop.run_in_executor(
+                    None, handler.handle_query, query
+                )
+            else:
+                raw_resp = handler.handle_query(query)
+
+            if raw_resp is not None:
+                await _write(handler, writer, raw_resp)
+    except ConnectionError as err:
+        handler.log.warning("connection lost", err=err)
+    finally:
+        handler.log.info("connection closed")
+        metrics.inc("connections_closed")
+        writer.close()
+
+
+async def _write(
+    handler: Handler, writer: asyncio.StreamWriter, raw_resp: Reply
+) -> None:
+    if isinstance(raw_resp, bytes):
+        handler.log.debug("sending raw response", raw_response=raw_resp)
+        writer.write(raw_resp)
+        await writer.drain()
+        return
+
+    # Draining after every chunk bounds the memory held by the transport, and
+    # lets other connections be served in between.
+    handler.log.debug("streaming raw response")
+    for chunk in raw_resp:
+        writer.write(chunk)
+        await writer.drain()
+
+
+async def _serve_asyncio(srv: socket, cache: Cache) -> None:
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: _handle_stream(cache, reader, writer),
+        sock=srv,
+        limit=MAX_QUERY_SIZE,
+    )
+    async with server:
+        await server.serve_forever()
+
+
+def serve_asyncio(srv: socket, cache: Cache) -> None:
+    """Serves all connections from a single asyncio event loop.
+
+    Queries that write to Consul are run in the default executor, so that
+    they never block the event loop.
+    """
+    asyncio.run(_serve_asyncio(srv, cache))
@@ -0,0 +1,210 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from socket import AF_UNIX, SOCK_STREAM, socket
+from threading import Thread
+from typing import Dict, List
+
+from structlog import get_logger
+
+from consulns.daemon.cache import Cache
+from consulns.daemon.metrics import Histogram, metrics
+
+log = get_logger()
+
+# Histogram buckets exported to Prometheus, powers of two from about a
+# microsecond to about 17 seconds, in nanoseconds
+EXPORTED_BOUNDS = [1 << bits for bits in range(10, 35)]
+QUANTILES = [0.5, 0.99, 0.999]
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _labels(**labels: object) -> str:
+    if len(labels) == 0:
+        return ""
+    pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + pairs + "}"
+
+
+class _Writer:
+    def __init__(self) -> None:
+        self._lines: List[str] = []
+
+    def family(self, name: str, kind: str, help: str) -> None:
+        self._lines.append(f"# HELP {name} {help}")
+        self._lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value: float, **labels: object) -> None:
+        self._lines.append(f"{name}{_labels(**labels)} {value}")
+
+    def histograms(
+        self, name: str, help: str, label: str, hs: Dict[str, Histogram]
+    ) -> None:
+        self.family(name, "histogram", help)
+        for key, h in sorted(hs.items()):
+            for bound, n in h.cumulative(EXPORTED_BOUNDS):
+                self.sample(
+                    f"{name}_bucket", n, **{label: key, "le": bound / 1e9}
+                )
+            self.sample(f"{name}_bucket", h.count, **{label: key, "le": "+Inf"})
+            self.sample(f"{name}_sum", h.sum / 1e9, **{label: key})
+            self.sample(f"{name}_count", h.count, **{label: key})
+
+        self.family(
+            f"{name}_quantile",
+            "gauge",
+            f"{help}, upper bound of the quantile",
+        )
+        for key, h in sorted(hs.items()):
+            for q in QUANTILES:
+                self.sample(
+                    f"{name}_quantile",
+                    h.quantile(q) / 1e9,
+                    **{label: key, "quantile": q},
+                )
+
+    def text(self) -> str:
+        return "\n".join(self._lines) + "\n"
+
+
+def render(cache: Cache) -> str:
+    """Renders the metrics of this process in Prometheus text format."""
+    m = metrics.collect()
+    w = _Writer()
+
+    w.histograms(
+        "cnsd_query_duration_seconds",
+        "Time spent handling queries",
+        "method",
+        m.queries,
+    )
+    w.family("cnsd_query_errors_total", "counter", "Queries that failed")
+    for method, n in sorted(m.errors.items()):
+        w.sample("cnsd_query_errors_total", n, method=method)
+
+    opened = m.counters.get("connections_opened", 0)
+    closed = m.counters.get("connections_closed", 0)
+    w.family("cnsd_connections_total", "counter", "Connections accepted")
+    w.sample("cnsd_connections_total", opened)
+    w.family("cnsd_connections_open", "gauge", "Connections currently open")
+    w.sample("cnsd_connections_open", opened - closed)
+
+    # Neither the names nor the record counts decode mapped zones
+    snapshot = cache.snapshot
+    czs = snapshot.zones_by_name
+    w.family("cnsd_zones", "gauge", "Zones in the cache")
+    w.sample("cnsd_zones", len(czs))
+    w.family("cnsd_zone_records", "gauge", "Records in each cached zone")
+    for zone_name, (_, cz) in czs.items():
+        w.sample(
+            "cnsd_zone_records", cz.record_count, zone=zone_name.to_text()
+        )
+    w.family(
+        "cnsd_zone_load_duration_seconds",
+        "gauge",
+        "Duration of the last load of each zone from Consul",
+    )
+    for zone_name, duration in sorted(cache.load_durations.items()):
+        w.sample(
+            "cnsd_zone_load_duration_seconds",
+            duration,
+            zone=zone_name.to_text(),
+        )
+    w.family("cnsd_cache_index", "gauge", "Consul index of the cache")
+    w.sample("cnsd_cache_index", snapshot.index)
+    w.family(
+        "cnsd_cache_staleness_seconds",
+        "gauge",
+        "Time since the cache was last known to be up to date",
+    )
+    w.sample("cnsd_cache_staleness_seconds", cache.staleness)
+    w.family("cnsd_reloads_total", "counter", "Refreshes of the cache")
+    w.sample("cnsd_reloads_total", cache.refreshes)
+    w.family(
+        "cnsd_reload_duration_seconds",
+        "gauge",
+        "Duration of the last refresh of the cache",
+    )
+    w.sample("cnsd_reload_duration_seconds", cache.refresh_duration)
+
+    w.histograms(
+        "cnsd_consul_request_duration_seconds",
+        "Round-trip time of Consul requests, blocking queries excluded",
+        "op",
+        m.consul,
+    )
+    return w.text()
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+    cache: Cache
+
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render(self.cache).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+def serve_http(cache: Cache, port: int) -> None:
+    """Serves the metrics at /metrics on a local HTTP port, in background."""
+    handler = type("HTTPHandler", (_HTTPHandler,), {"cache": cache})
+    srv = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    srv.daemon_threads = True
+    thr = Thread(target=srv.serve_forever, name="stats-http")
+    thr.daemon = True
+    thr.start()
+    log.info("serving metrics over HTTP", port=port)
+
+
+def serve_unix(cache: Cache, path: Path) -> None:
+    """Writes the metrics to every client of a UNIX socket, in background."""
+    if path.exists():
+        path.unlink()
+    srv = socket(AF_UNIX, SOCK_STREAM)
+    srv.bind(str(path))
+    srv.listen()
+
+    def serve() -> None:
+        while True:
+            sock, _ = srv.accept()
+            try:
+                sock.sendall(render(cache).encode("utf-8"))
+            except Exception as err:
+                log.error("could not send metrics", err=err)
+            finally:
+                sock.close()
+
+    thr = Thread(target=serve, name="stats-unix")
+    thr.daemon = True
+    thr.start()
+    log.info("serving metrics on UNIX socket", path=path)
+
+
+def serve_stats(cache: Cache, worker: int | None = None) -> None:
+    """Starts the configured metrics endpoints.
+
+    Each worker process serves its own metrics: worker `n` (counting from 0)
+    listens on the configured port plus n + 1, or on the configured socket
+    path suffixed with `.n`.
+    """
+    config = cache.config
+    if config.metrics_port is not None:
+        port = config.metrics_port
+        serve_http(cache, port if worker is None else port + worker + 1)
+    if config.metrics_socket is not None:
+        path = config.metrics_socket
+        if worker is not None:
+            path = path.with_name(f"{path.name}.{worker}")
+        serve_unix(cache, path)
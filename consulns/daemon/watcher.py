@@ -0,0 +1,70 @@
+from threading import Thread
+from time import sleep
+
+from structlog import get_logger
+
+from consulns.daemon.cache import Cache
+from consulns.daemon.metrics import metrics
+from consulns.store.consul import Consul
+
+log = get_logger()
+
+# Seconds to wait before retrying after a failed blocking query
+RETRY_DELAY = 1
+
+
+class Watcher:
+    """Keeps a Cache up to date using Consul blocking queries.
+
+    The watcher long-polls the zones prefix starting from the index the cache
+    was loaded at. Whenever Consul reports a change, only the zones whose
+    ModifyIndex moved are reloaded, from the values the query returned.
+    """
+
+    def __init__(self, cache: Cache) -> None:
+        self._cache = cache
+        config = cache.config
+        # A dedicated client, so that the long-poll does not share a
+        # connection with the queries issued by the handlers.
+        self._consul = Consul(config.consul_client(), metrics.observe_consul)
+        self._wait = config.watch_wait
+
+    def start(self) -> None:
+        thr = Thread(target=self.watch, name="watcher")
+        thr.daemon = True
+        thr.start()
+
+    def watch(self) -> None:
+        index = self._cache.index
+        log.info("watching for changes", index=index)
+        while True:
+            try:
+                new_index, zones = self._consul.prefetch(
+                    index=index, wait=self._wait
+                )
+            except Exception as err:
+                log.error("error while watching for changes", err=err)
+                sleep(RETRY_DELAY)
+                continue
+
+            if new_index == index:
+                # The blocking query timed out without changes
+                self._cache.checked()
+                continue
+
+            try:
+                # Changed zones are built from the values just read, rather
+                # than read again
+                self._cache.refresh(
+                    new_index,
+                    {zone_name: i for zone_name, (i, _) in zones.items()},
+                    {zone_name: zone for zone_name, (_, zone) in zones.items()},
+                )
+            except Exception as err:
+                log.error("error while refreshing cache", err=err)
+                sleep(RETRY_DELAY)
+                continue
+
+            # Consul indexes are not guaranteed to be monotonic, reset the
+            # watch when they go backwards.
+            index = new_index if new_index > index else 0
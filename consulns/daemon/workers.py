@@ -0,0 +1,236 @@
+import gc
+import os
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection, wait
+from queue import SimpleQueue
+from signal import SIGTERM
+from socket import socket
+from threading import Thread
+from typing import Callable, Dict, List, Tuple
+
+from pydantic import BaseModel
+from structlog import get_logger
+
+from consulns.daemon.cache import Cache, Snapshot
+from consulns.daemon.watcher import Watcher
+from consulns.store.consul import Consul
+
+log = get_logger()
+
+
+class Update(BaseModel):
+    index: int
+    # Instances of the services that changed, or used by zones that changed
+    services: Dict[str, List[Consul.ServiceInstance]] = {}
+    # Whether zones changed, and the snapshot file has to be mapped again
+    remap: bool = False
+
+
+class Supervisor:
+    """Serves queries from several pre-forked worker processes.
+
+    The supervisor loads the cache, or maps it from the snapshot file, then
+    forks the workers, which share its memory copy-on-write, and a refresher.
+    It stays single-threaded for its whole life, so that no process is ever
+    forked with threads running.
+
+    The refresher keeps the cache up to date: it watches Consul and the
+    services used by zones, and writes the snapshot file. After each change
+    it sends an update through the supervisor to every worker, which maps the
+    snapshot file again. Workers never read zones from Consul themselves, nor
+    receive their data. Workers and the refresher are respawned if they exit,
+    a respawned worker is sent the changes it missed.
+    """
+
+    def __init__(
+        self,
+        srv: socket,
+        cache: Cache,
+        serve: Callable[[socket, Cache], None],
+        workers: int,
+        on_fork: Callable[[int | None], None] | None = None,
+    ) -> None:
+        self._srv = srv
+        self._cache = cache
+        self._serve = serve
+        self._n_workers = workers
+        # Called in each worker with its number, from 0 to workers - 1, and in
+        # the refresher with None
+        self._on_fork = on_fork
+        # Worker pid -> its number and connection, which is only ever read
+        # from when the worker exits
+        self._workers: Dict[int, Tuple[int, Connection]] = {}
+        self._refresher: Tuple[int, Connection] | None = None
+        # Changes sent to workers so far, for those spawned afterwards
+        self._update: Update | None = None
+
+    def run(self) -> None:
+        # Objects alive at this point are shared with the children for their
+        # whole life, keep the garbage collector from touching (and thus
+        # copying) them. The cache of the supervisor never changes.
+        gc.freeze()
+        self._spawn_refresher()
+        for n in range(self._n_workers):
+            self._spawn_worker(n)
+
+        try:
+            while True:
+                self._poll()
+        finally:
+            for pid in self._pids():
+                os.kill(pid, SIGTERM)
+
+    def _pids(self) -> List[int]:
+        pids = list(self._workers)
+        if self._refresher is not None:
+            pids.append(self._refresher[0])
+        return pids
+
+    def _poll(self) -> None:
+        assert self._refresher is not None
+        pid, refresher = self._refresher
+        ready = wait([refresher] + [c for _, c in self._workers.values()])
+        if refresher in ready:
+            try:
+                self._relay(refresher.recv_bytes())
+            except EOFError:
+                refresher.close()
+                self._reap(pid)
+                self._spawn_refresher()
+
+        for pid, (n, conn) in list(self._workers.items()):
+            if conn not in ready:
+                continue
+            # Workers never write, the worker exited
+            del self._workers[pid]
+            conn.close()
+            self._reap(pid)
+            self._spawn_worker(n)
+
+    def _reap(self, pid: int) -> None:
+        _, status = os.waitpid(pid, 0)
+        log.warning("child exited, respawning", pid=pid, status=status)
+
+    def _fork(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            # Connections to the other children belong to the supervisor
+            if self._refresher is not None:
+                self._refresher[1].close()
+            for _, conn in self._workers.values():
+                conn.close()
+            self._workers = {}
+            self._refresher = None
+        return pid
+
+    def _spawn_refresher(self) -> None:
+        reader, writer = Pipe(duplex=False)
+        pid = self._fork()
+        if pid == 0:
+            reader.close()
+            self._refresh(writer)
+
+        writer.close()
+        self._refresher = (pid, reader)
+        log.info("spawned refresher", pid=pid)
+
+    def _spawn_worker(self, n: int) -> None:
+        conn, child_conn = Pipe()
+        pid = self._fork()
+        if pid == 0:
+            conn.close()
+            self._work(n, child_conn)
+
+        child_conn.close()
+        if self._update is not None:
+            self._send(pid, conn, self._update.model_dump_json().encode())
+        self._workers[pid] = (n, conn)
+        log.info("spawned worker", pid=pid)
+
+    def _relay(self, raw_update: bytes) -> None:
+        update = Update.model_validate_json(raw_update)
+        if self._update is None:
+            self._update = update
+        else:
+            self._update.index = update.index
+            self._update.services.update(update.services)
+            self._update.remap |= update.remap
+
+        for pid, (_, conn) in self._workers.items():
+            self._send(pid, conn, raw_update)
+
+    def _send(self, pid: int, conn: Connection, raw_update: bytes) -> None:
+        try:
+            conn.send_bytes(raw_update)
+        except OSError as err:
+            log.error("could not update worker", pid=pid, err=err)
+
+    def _refresh(self, writer: Connection) -> None:
+        code = 0
+        try:
+            self._cache.reconnect()
+            if self._on_fork is not None:
+                self._on_fork(None)
+            updates: SimpleQueue[Update] = SimpleQueue()
+            self._cache.add_listener(
+                lambda old, new: updates.put(self._changes(old, new))
+            )
+            self._cache.start()
+            if self._cache.config.watch:
+                Watcher(self._cache).start()
+
+            while True:
+                update = updates.get()
+                if update.remap:
+                    # Workers map the file the update is about
+                    self._cache.save()
+                writer.send_bytes(update.model_dump_json().encode("utf-8"))
+        except BaseException as err:
+            log.error("refresher failed", err=err)
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _changes(self, old: Snapshot, new: Snapshot) -> Update:
+        old_zones = old.zones_by_name
+        new_zones = new.zones_by_name
+        remap = old_zones.keys() != new_zones.keys()
+        services = {}
+        for zone_name, (_, cz) in new_zones.items():
+            current = old_zones.get(zone_name)
+            if current is not None and current[1] is cz:
+                continue
+
+            if current is None or current[1].index != cz.index:
+                remap = True
+            for service in cz.services:
+                services[service] = self._cache.catalog.instances(service)
+        return Update(index=new.index, services=services, remap=remap)
+
+    def _work(self, n: int, conn: Connection) -> None:
+        code = 0
+        try:
+            self._cache.after_fork()
+            if self._on_fork is not None:
+                self._on_fork(n)
+            thr = Thread(target=self._receive, args=(conn,), name="updates")
+            thr.daemon = True
+            thr.start()
+            self._serve(self._srv, self._cache)
+        except BaseException as err:
+            log.error("worker failed", err=err)
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _receive(self, conn: Connection) -> None:
+        while True:
+            try:
+                raw_update = conn.recv_bytes()
+            except EOFError:
+                log.error("lost connection to the supervisor, exiting")
+                os._exit(1)
+
+            update = Update.model_validate_json(raw_update)
+            self._cache.install(update.services, update.remap)
+            log.info("installed update", index=update.index)
@@ -1,5 +1,18 @@
+from base64 import b64decode, b64encode
 from consul import Consul as ConsulClient
-from typing import Iterator, Tuple, TypedDict, Set
+from consul.exceptions import ClientError
+from contextlib import contextmanager
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Tuple,
+    TypedDict,
+    Set,
+)
 from dns.name import Name as DNSName, from_text as dns_from_text
 from pydantic import TypeAdapter, BaseModel
 
@@ -7,6 +20,8 @@ from consulns.store.zone import Zone
 
 from consulns.const import (
     CONSUL_PATH_CURRENT_ZONE,
+    CONSUL_PATH_ZONE_INFO,
+    CONSUL_PATH_ZONE_STAGING,
     CONSUL_PATH_ZONES,
 )
 
@@ -23,8 +38,32 @@ class KeyNotInserted(Exception):
     pass
 
 
+class TransactionConflict(Exception):
+    pass
+
+
+class TransactionTooLarge(Exception):
+    pass
+
+
+# Operations and bytes Consul accepts in a single transaction, by default
+TXN_MAX_OPS = 64
+TXN_MAX_SIZE = 512 * 1024
+
+
 class Consul:
-    def __init__(self, client: ConsulClient) -> None:
+    def __init__(
+        self,
+        client: ConsulClient,
+        on_request: Callable[[str, float], None] | None = None,
+    ) -> None:
+        self._client = client
+        # Called with the kind and duration in seconds of every request that
+        # is not a blocking query
+        self._on_request = on_request
+
+    def reset(self, client: ConsulClient) -> None:
+        """Switches to a new client, e.g. after forking."""
         self._client = client
 
     class Value(TypedDict):
@@ -37,23 +76,164 @@ class Consul:
 
     _value_ta = TypeAdapter(Value)
 
+    @contextmanager
+    def _request(self, op: str, blocking: bool = False) -> Iterator[None]:
+        if self._on_request is None or blocking:
+            yield
+            return
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._on_request(op, perf_counter() - start)
+
     def _kv_get[T: BaseModel](
         self, key: str, t: type[T]
     ) -> Tuple[int, T | None]:
-        self._client.kv
-        idx, raw_value = self._client.kv.get(key)
+        """Returns the ModifyIndex of a key, 0 when missing, and its value."""
+        with self._request("kv_get"):
+            _, raw_value = self._client.kv.get(key)
         if raw_value is None:
-            return idx, None
+            return 0, None
 
         value = self._value_ta.validate_python(raw_value)
         result = t.model_validate_json(value["Value"])
-        return idx, result
+        return value["ModifyIndex"], result
+
+    def _kv_get_prefix(
+        self, prefix: str, index: int | None = None, wait: str | None = None
+    ) -> Tuple[int, List[Value]]:
+        # When an index is given this is a Consul blocking query: the call
+        # only returns once something under the prefix changes (or `wait`
+        # expires).
+        with self._request("kv_get", blocking=index is not None):
+            idx, raw_values = self._client.kv.get(
+                prefix, index=index, wait=wait, recurse=True
+            )
+        if raw_values is None:
+            return int(idx), []
+
+        return int(idx), [self._value_ta.validate_python(v) for v in raw_values]
 
     def _kv_set(self, key: str, t: BaseModel) -> None:
-        success = self._client.kv.put(key, t.model_dump_json())
+        with self._request("kv_put"):
+            success = self._client.kv.put(key, t.model_dump_json())
         if not success:
             raise KeyNotInserted()
 
+    @staticmethod
+    def _txn_set(
+        key: str, t: BaseModel, index: int | None = None
+    ) -> Dict[str, Any]:
+        """A transaction operation setting key if its ModifyIndex is index.
+
+        An index of 0 only sets the key if it does not exist yet, None sets
+        it unconditionally.
+        """
+        value = b64encode(t.model_dump_json().encode("utf-8"))
+        op: Dict[str, Any] = {
+            "Verb": "set",
+            "Key": key,
+            "Value": value.decode("ascii"),
+        }
+        if index is not None:
+            op.update(Verb="cas", Index=index)
+        return {"KV": op}
+
+    @staticmethod
+    def _txn_delete(key: str, index: int) -> Dict[str, Any]:
+        """A transaction operation deleting key if its ModifyIndex is index."""
+        return {"KV": {"Verb": "delete-cas", "Key": key, "Index": index}}
+
+    @staticmethod
+    def _txn_op_size(op: Dict[str, Any]) -> int:
+        return len(op["KV"]["Key"]) + len(op["KV"].get("Value", ""))
+
+    def _txn(self, ops: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Applies KV operations atomically.
+
+        Returns the new ModifyIndex of set keys. When one of the
+        check-and-set fails nothing is applied, and TransactionConflict is
+        raised. Operations that do not fit in a single transaction raise
+        TransactionTooLarge, before anything is sent.
+        """
+        size = sum(self._txn_op_size(op) for op in ops)
+        if len(ops) > TXN_MAX_OPS or size > TXN_MAX_SIZE:
+            raise TransactionTooLarge(
+                f"{len(ops)} operations of {size} bytes, over the limits of "
+                f"{TXN_MAX_OPS} operations and {TXN_MAX_SIZE} bytes"
+            )
+        return self._txn_put(ops)
+
+    def _txn_batches(self, ops: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Applies KV operations in as few transactions as possible, in order.
+
+        Unlike _txn this is not atomic as a whole: a conflict in one of the
+        transactions leaves the ones before it applied. Only meant for bulk
+        writes that are safe to repeat. An operation too large for any
+        transaction raises TransactionTooLarge, before anything is sent.
+        """
+        for op in ops:
+            if self._txn_op_size(op) > TXN_MAX_SIZE:
+                raise TransactionTooLarge(
+                    f"an operation of {self._txn_op_size(op)} bytes, over the "
+                    f"limit of {TXN_MAX_SIZE} bytes"
+                )
+
+        indexes = {}
+        batch: List[Dict[str, Any]] = []
+        size = 0
+        for op in ops:
+            op_size = self._txn_op_size(op)
+            if batch and (
+                len(batch) >= TXN_MAX_OPS or size + op_size > TXN_MAX_SIZE
+            ):
+                indexes.update(self._txn_put(batch))
+                batch, size = [], 0
+            batch.append(op)
+            size += op_size
+        if batch:
+            indexes.update(self._txn_put(batch))
+        return indexes
+
+    def _txn_get_trees(self, prefixes: List[str]) -> List[Value]:
+        """Reads the keys under each prefix, TXN_MAX_OPS prefixes at a time.
+
+        Each transaction is a consistent read, but the reads as a whole are
+        not. Missing keys are left out.
+        """
+        values = []
+        for start in range(0, len(prefixes), TXN_MAX_OPS):
+            ops = [
+                {"KV": {"Verb": "get-tree", "Key": prefix}}
+                for prefix in prefixes[start : start + TXN_MAX_OPS]
+            ]
+            with self._request("txn"):
+                result = self._client.txn.put(ops)
+            for r in result.get("Results") or []:
+                # Unlike KV reads, values in transaction results are encoded
+                kv = dict(r["KV"])
+                kv["Value"] = b64decode(kv["Value"] or "")
+                values.append(self._value_ta.validate_python(kv))
+        return values
+
+    def _txn_put(self, ops: List[Dict[str, Any]]) -> Dict[str, int]:
+        with self._request("txn"):
+            try:
+                result = self._client.txn.put(ops)
+            except ClientError as err:
+                # Consul rolls back transactions with failed operations
+                if str(err).startswith("409"):
+                    raise TransactionConflict(err) from err
+                raise
+
+        return {
+            r["KV"]["Key"]: r["KV"]["ModifyIndex"]
+            for r in result.get("Results") or []
+            if "KV" in r
+        }
+
     class ZoneDNSNames(BaseModel):
         zones: Set[str]
 
@@ -69,6 +249,140 @@ class Consul:
         for zone_name in zone_names.zones:
             yield Zone(self, dns_from_text(zone_name))
 
+    def _fetch_zones(
+        self,
+        prefix: str = CONSUL_PATH_ZONES,
+        index: int | None = None,
+        wait: str | None = None,
+    ) -> Tuple[int, Dict[DNSName, Tuple[int, List[Value]]]]:
+        """Fetches a prefix of the zones prefix, grouping its values by zone.
+
+        Returns the Consul index and, for each zone, its ModifyIndex and the
+        values of its keys. The ModifyIndex of a zone is the highest
+        ModifyIndex among its keys, staging excluded, as staged changes are
+        not visible until committed. When the prefix does not cover the list
+        of zones, e.g. it is the prefix of a single zone, the zones are those
+        with keys under the prefix.
+        """
+        idx, values = self._kv_get_prefix(prefix, index, wait)
+        zone_names = self.ZoneDNSNames(zones=set())
+        zone_values: Dict[str, List[Consul.Value]] = {}
+        modify_indexes: Dict[str, int] = {}
+        for value in values:
+            if value["Key"] == CONSUL_PATH_ZONES:
+                zone_names = self.ZoneDNSNames.model_validate_json(
+                    value["Value"]
+                )
+                continue
+
+            zone_name, _, path = (
+                value["Key"]
+                .removeprefix(CONSUL_PATH_ZONES + "/")
+                .partition("/")
+            )
+            if not path:
+                continue
+
+            zone_values.setdefault(zone_name, []).append(value)
+            staging_path = CONSUL_PATH_ZONE_STAGING.format(zone=zone_name)
+            if value["Key"] != staging_path and not value["Key"].startswith(
+                staging_path + "/"
+            ):
+                modify_indexes[zone_name] = max(
+                    modify_indexes.get(zone_name, 0), value["ModifyIndex"]
+                )
+
+        if not CONSUL_PATH_ZONES.startswith(prefix):
+            zone_names.zones = set(zone_values)
+        zones = {}
+        for zone_name in zone_names.zones:
+            name = dns_from_text(zone_name)
+            zones[name] = (
+                modify_indexes.get(name.to_text(), 0),
+                zone_values.get(name.to_text(), []),
+            )
+        return idx, zones
+
+    def zone_indexes(
+        self, index: int | None = None, wait: str | None = None
+    ) -> Tuple[int, Dict[DNSName, int]]:
+        """Returns the ModifyIndex of each zone, along with the Consul index.
+
+        Passing the Consul index of a previous call turns this into a blocking
+        query that waits for changes under the zones prefix.
+        """
+        idx, zones = self._fetch_zones(index=index, wait=wait)
+        return idx, {name: i for name, (i, _) in zones.items()}
+
+    def prefetch(
+        self,
+        prefix: str = CONSUL_PATH_ZONES,
+        index: int | None = None,
+        wait: str | None = None,
+    ) -> Tuple[int, Dict[DNSName, Tuple[int, Zone]]]:
+        """Reads all zones under a prefix with a single request.
+
+        Returns the Consul index and, for each zone, its ModifyIndex (as in
+        zone_indexes) and the zone itself, with everything it would read
+        lazily already fetched. Reading a whole zone one key at a time
+        takes several requests, this takes one for all zones. The prefix
+        defaults to all zones, a single zone is read with the prefix of its
+        keys, trailing slash included. As with zone_indexes, passing the
+        Consul index of a previous call turns this into a blocking query.
+        """
+        idx, zones = self._fetch_zones(prefix, index, wait)
+        return idx, {
+            name: (i, Zone.from_values(self, name, values))
+            for name, (i, values) in zones.items()
+        }
+
+    def zone_infos(self) -> Dict[DNSName, Zone.ZoneInfo]:
+        """Reads the info of all zones, e.g. their serial, and nothing else.
+
+        Unlike prefetch, records are not read. A recursive read cannot skip
+        them, so info keys are read in transactions instead, TXN_MAX_OPS
+        zones at a time.
+        """
+        keys = {
+            CONSUL_PATH_ZONE_INFO.format(zone=name): dns_from_text(name)
+            for name in sorted(self._zone_names().zones)
+        }
+        # Zones without info read as default ones, as with Zone
+        infos = {name: Zone.ZoneInfo() for name in keys.values()}
+        for value in self._txn_get_trees(list(keys)):
+            if value["Key"] in keys:
+                infos[keys[value["Key"]]] = Zone.ZoneInfo.model_validate_json(
+                    value["Value"]
+                )
+        return infos
+
+    class ServiceInstance(BaseModel):
+        address: str
+        port: int
+
+    def service_instances(
+        self, service: str, index: int | None = None, wait: str | None = None
+    ) -> Tuple[int, List[ServiceInstance]]:
+        """Returns the instances of a service whose health checks pass.
+
+        Passing the Consul index of a previous call turns this into a blocking
+        query that waits for the set of healthy instances to change.
+        """
+        with self._request("health_service", blocking=index is not None):
+            idx, entries = self._client.health.service(
+                service, passing=True, index=index, wait=wait
+            )
+        instances = []
+        for entry in entries:
+            # The service address defaults to the one of its node when unset
+            address = entry["Service"]["Address"] or entry["Node"]["Address"]
+            instances.append(
+                self.ServiceInstance(
+                    address=address, port=entry["Service"]["Port"]
+                )
+            )
+        return int(idx), instances
+
     def add_zone(self, zone: "Zone") -> None:
         assert zone.name[-1] != "."
         zone_names = self._zone_names()
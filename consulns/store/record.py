@@ -1,7 +1,8 @@
 from enum import Enum
-from pydantic import UUID4, IPvAnyAddress, BaseModel
+from pydantic import UUID4, Field, IPvAnyAddress, BaseModel
 from uuid import uuid4
 from base64 import b64encode
+from hashlib import blake2b
 
 
 class RecordType(Enum):
@@ -18,7 +19,7 @@ class RecordType(Enum):
 
 
 class Record(BaseModel):
-    id: UUID4 = uuid4()
+    id: UUID4 = Field(default_factory=uuid4)
     record: str
     record_type: RecordType
     value: IPvAnyAddress | str
@@ -31,6 +32,15 @@ class Record(BaseModel):
         value = b64encode(concatenated_value.encode("utf-8")).decode("utf-8")
         return f"{record}.{value}"
 
+    @property
+    def content_hash(self) -> bytes:
+        """A hash of the name, type, value and TTL, the id left out."""
+        content = (
+            f"{self.record.lower()}\0{self.record_type.value}\0{self.value}"
+            f"\0{self.ttl}"
+        )
+        return blake2b(content.encode("utf-8"), digest_size=16).digest()
+
     @property
     def pretty_str(self) -> str:
         return (
@@ -1,16 +1,34 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Dict, Literal, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    Set,
+    Tuple,
+    Union,
+)
 from base64 import b64encode
 from collections.abc import Iterator
+from contextlib import contextmanager
 from pydantic import UUID4, Field, BaseModel
 
-from consulns.const import CONSUL_PATH_ZONE_STAGING
-from consulns.store.record import Record
+from consulns.const import (
+    CONSUL_PATH_ZONE_STAGING,
+    CONSUL_PATH_ZONE_STAGING_CHUNK,
+)
+from consulns.store.record import Record, RecordType
 
 if TYPE_CHECKING:
+    from consulns.store.consul import Consul
     from consulns.store.zone import Zone
 
+# Changes held by a single staging key
+CHUNK_CHANGES = 512
+
 
 class MissingChange(Exception):
     pass
@@ -46,52 +64,221 @@ class Change(BaseModel):
 class Stage:
     def __init__(self, zone: Zone) -> None:
         self._zone = zone
-        self.__staging = None
+        # Staged changes, spread over chunks of at most CHUNK_CHANGES changes
+        # in the order they were staged, by key of the chunk. Along with the
+        # ModifyIndex of each chunk, 0 for new ones, and the chunk of each
+        # change.
+        self.__chunks: Dict[str, Stage.Staging] | None = None
+        self.__indexes: Dict[str, int] = {}
+        self.__chunk_of: Dict[str, str] = {}
+        # Nesting depth of batch blocks, and chunks awaiting a write
+        self.__batch_depth = 0
+        self.__dirty: Set[str] = set()
 
     class Staging(BaseModel):
         changes: Dict[str, Change] = {}
 
     @property
-    def _staging(self) -> Staging:
-        if self.__staging is None:
+    def _chunks(self) -> Dict[str, Staging]:
+        if self.__chunks is None:
+            # The legacy single key comes along with the chunks
             staging_path = self._zone._compute_path(CONSUL_PATH_ZONE_STAGING)
-            _, staging = self._zone._consul._kv_get(staging_path, self.Staging)
-            if staging is None:
-                staging = self.Staging()
-            self.__staging = staging
+            _, values = self._zone._consul._kv_get_prefix(staging_path)
+            self._fill(values)
+
+        assert self.__chunks is not None
+        return self.__chunks
+
+    def _fill(self, values: Iterable[Consul.Value]) -> None:
+        """Sets the staging area to the values of its keys, already fetched."""
+        self.__chunks = {}
+        self.__indexes = {}
+        self.__chunk_of = {}
+        self.__dirty = set()
+        for value in sorted(values, key=lambda v: v["Key"]):
+            key = value["Key"]
+            chunk = self.Staging.model_validate_json(value["Value"])
+            self.__chunks[key] = chunk
+            self.__indexes[key] = value["ModifyIndex"]
+            for change_key in chunk.changes:
+                self.__chunk_of[change_key] = key
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Writes all changes made within the block at once, when it exits.
 
-        return self.__staging
+        Changes are applied in memory only, and each chunk they touch is
+        written a single time, instead of once per change. When the block
+        raises, none of its changes are written, and the staging area is
+        read again from Consul on next use.
+        """
+        self.__batch_depth += 1
+        try:
+            yield
+        except BaseException:
+            self.__batch_depth -= 1
+            if self.__batch_depth == 0:
+                self.__chunks = None
+                self.__dirty = set()
+            raise
+
+        self.__batch_depth -= 1
+        self._update_staging()
 
     def _update_staging(self) -> None:
-        staging_path = self._zone._compute_path(CONSUL_PATH_ZONE_STAGING)
-        self._zone._consul._kv_set(staging_path, self._staging)
+        """Writes the chunks changed since they were last written.
+
+        Chunks go out in as many transactions as needed, so that staging is
+        not bound by Consul's limits on a single one. On failure, the
+        staging area is read again from Consul on next use, as part of the
+        chunks may be written.
+        """
+        if self.__batch_depth > 0 or not self.__dirty:
+            return
+
+        consul = self._zone._consul
+        ops = []
+        for key in sorted(self.__dirty):
+            index = self.__indexes.get(key, 0)
+            if self._chunks[key].changes:
+                ops.append(consul._txn_set(key, self._chunks[key], index))
+            elif index != 0:
+                ops.append(consul._txn_delete(key, index))
+        try:
+            indexes = consul._txn_batches(ops)
+        except BaseException:
+            self.__chunks = None
+            self.__dirty = set()
+            raise
+
+        for key in self.__dirty:
+            if key in indexes:
+                self.__indexes[key] = indexes[key]
+            elif not self._chunks[key].changes:
+                # Deleted, or never written
+                del self._chunks[key]
+                self.__indexes.pop(key, None)
+        self.__dirty = set()
+
+    def _stage(self, change: Change) -> None:
+        chunks = self._chunks
+        key = self.__chunk_of.get(change.key)
+        if key is None:
+            key = self._last_chunk()
+        chunks[key].changes[change.key] = change
+        self.__chunk_of[change.key] = key
+        self.__dirty.add(key)
+        self._update_staging()
+
+    def _unstage(self, change: Change) -> None:
+        key = self.__chunk_of.pop(change.key)
+        del self._chunks[key].changes[change.key]
+        self.__dirty.add(key)
+        self._update_staging()
+
+    def _last_chunk(self) -> str:
+        """Returns the key of the last chunk, or of a new one when full."""
+        chunks = self._chunks
+        n = 0
+        if chunks:
+            last = next(reversed(chunks))
+            if len(chunks[last].changes) < CHUNK_CHANGES:
+                return last
+            staging_path = self._zone._compute_path(CONSUL_PATH_ZONE_STAGING)
+            if last != staging_path:
+                n = int(last.rpartition("/")[2], 16) + 1
+
+        key = CONSUL_PATH_ZONE_STAGING_CHUNK.format(
+            zone=self._zone.name, chunk=f"{n:08x}"
+        )
+        chunks[key] = self.Staging()
+        return key
 
     @property
     def changes(self) -> Iterator[Change]:
-        for value in self._staging.changes.values():
-            yield value
+        for chunk in self._chunks.values():
+            yield from chunk.changes.values()
 
     def add_record(self, record: Record) -> None:
         add_record = AddRecord(record=record)
-        change = Change(update=add_record)
-        self._staging.changes[change.key] = change
-        self._update_staging()
+        self._stage(Change(update=add_record))
 
     def del_record(self, record: Record) -> None:
         add_record = DelRecord(id=record.id)
-        change = Change(update=add_record)
-        self._staging.changes[change.key] = change
-        self._update_staging()
+        self._stage(Change(update=add_record))
+
+    def sync(
+        self,
+        records: Iterable[Record],
+        types: Set[RecordType] | None = None,
+    ) -> Tuple[int, int]:
+        """Stages the changes turning the records of the zone into records.
+
+        Records are compared by their content hash, so that only records
+        missing from the zone are added, and only records of the zone missing
+        from records, or duplicating another one, are deleted. When types is
+        given, records of the zone of other types are left alone. Returns the
+        number of additions and deletions staged, all in a single batch, or
+        none when the zone is already in sync.
+        """
+        current: Dict[bytes, Record] = {}
+        duplicates = []
+        for record in self._zone.records:
+            if types is not None and record.record_type not in types:
+                continue
+            if record.content_hash in current:
+                duplicates.append(record)
+            else:
+                current[record.content_hash] = record
+
+        added = 0
+        seen = set()
+        with self.batch():
+            for record in records:
+                content_hash = record.content_hash
+                if content_hash in seen:
+                    continue
+                seen.add(content_hash)
+                if content_hash not in current:
+                    self.add_record(record)
+                    added += 1
+
+            deleted = 0
+            for content_hash, record in current.items():
+                if content_hash not in seen:
+                    self.del_record(record)
+                    deleted += 1
+            for record in duplicates:
+                self.del_record(record)
+                deleted += 1
+
+        return added, deleted
 
     def revert(self, id: int) -> None:
         for i, change in enumerate(self.changes):
             if i == id:
-                del self._staging.changes[change.key]
-                self._update_staging()
+                self._unstage(change)
                 return
 
         raise MissingChange(id)
 
     def clear(self) -> None:
-        self._staging.changes.clear()
-        self._update_staging()
+        with self.batch():
+            for key, chunk in self._chunks.items():
+                chunk.changes.clear()
+                self.__dirty.add(key)
+            self.__chunk_of = {}
+
+    def _clear_ops(self) -> List[Dict[str, Any]]:
+        """Transaction operations clearing the changes, as they were read."""
+        consul = self._zone._consul
+        return [
+            consul._txn_delete(key, index)
+            for key, index in sorted(self.__indexes.items())
+        ]
+
+    def _cleared(self) -> None:
+        self.__chunks = {}
+        self.__indexes = {}
+        self.__chunk_of = {}
+        self.__dirty = set()
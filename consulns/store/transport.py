@@ -0,0 +1,268 @@
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, List, Tuple
+
+import requests
+from consul import Consul as ConsulClient
+from consul import base
+from consul.exceptions import ConsulException
+from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
+from tenacity import (
+    RetryCallState,
+    Retrying,
+    retry_if_exception_type,
+    retry_if_result,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+# Bounds, in seconds, of the jittered exponential backoff between retries
+RETRY_MIN = 0.05
+RETRY_MAX = 2.0
+# Maximum duration of a blocking query when no wait is given, as in Consul
+DEFAULT_WAIT = 300.0
+
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+# A client certificate, or a certificate and its key, as requests takes it
+Cert = str | Tuple[str, str] | None
+
+
+class CircuitOpen(ConsulException):
+    pass
+
+
+class Transport(BaseModel):
+    """How requests to Consul are sent."""
+
+    # Seconds to wait for a connection, and then for a response
+    connect_timeout: float = 2.0
+    read_timeout: float = 10.0
+    # Times a failed read is retried
+    retries: int = 3
+    # Connections kept alive
+    pool_size: int = 10
+    # Consecutive failures opening the circuit breaker, and seconds it stays
+    # open before a request is let through again
+    breaker_failures: int = 5
+    breaker_reset: float = 10.0
+
+
+class CircuitBreaker:
+    """Fails requests fast while Consul keeps failing.
+
+    After `failures` consecutive failed requests the breaker opens, and all
+    requests fail with CircuitOpen without reaching Consul. Once `reset`
+    seconds have passed a single request is let through: its success closes
+    the breaker, its failure opens it again.
+    """
+
+    def __init__(self, failures: int, reset: float) -> None:
+        self._lock = Lock()
+        self._threshold = failures
+        self._reset = reset
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def open(self) -> bool:
+        return self._opened_at is not None
+
+    def check(self) -> None:
+        """Raises CircuitOpen unless a request may go through."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if monotonic() - self._opened_at < self._reset or self._probing:
+                raise CircuitOpen(
+                    f"{self._failures} consecutive failed requests to Consul"
+                )
+            self._probing = True
+
+    def record(self, success: bool) -> None:
+        with self._lock:
+            self._probing = False
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                return
+
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self._threshold:
+                self._opened_at = monotonic()
+
+
+def _duration(wait: str) -> float:
+    for unit in sorted(_UNITS, key=len, reverse=True):
+        if wait.endswith(unit):
+            return float(wait.removesuffix(unit)) * _UNITS[unit]
+    return float(wait)
+
+
+def _blocking_wait(params: List[Tuple[str, Any]] | None) -> float | None:
+    """Returns how long Consul may hold a blocking query, None otherwise."""
+    query = dict(params or [])
+    if "index" not in query:
+        return None
+    wait = _duration(query["wait"]) if "wait" in query else DEFAULT_WAIT
+    # Consul adds up to wait/16 of jitter
+    return wait + wait / 16
+
+
+def _last_result(state: RetryCallState) -> requests.Response:
+    """Hands the last server error over to the callback, once out of retries."""
+    assert state.outcome is not None
+    response: requests.Response = state.outcome.result()
+    return response
+
+
+class HTTPClient(base.HTTPClient):
+    """Sends requests over a pool of keep-alive connections.
+
+    All requests have timeouts, extended for blocking queries by the time
+    Consul may hold them. Reads, other than blocking queries whose callers
+    poll anyway, are retried with jittered exponential backoff on connection
+    errors, timeouts and server errors. All requests go through a circuit
+    breaker.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        scheme: str,
+        verify: bool | str,
+        cert: Cert,
+        transport: Transport,
+    ) -> None:
+        super().__init__(host, port, scheme, verify, cert)
+        self._transport = transport
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=transport.pool_size
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._breaker = CircuitBreaker(
+            transport.breaker_failures, transport.breaker_reset
+        )
+        self._retrying = Retrying(
+            stop=stop_after_attempt(transport.retries + 1),
+            wait=wait_random_exponential(min=RETRY_MIN, max=RETRY_MAX),
+            retry=retry_if_exception_type(
+                (requests.ConnectionError, requests.Timeout)
+            )
+            | retry_if_result(lambda r: r.status_code >= 500),
+            retry_error_callback=_last_result,
+        )
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self._breaker
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        params: List[Tuple[str, Any]] | None,
+        data: str | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> base.Response:
+        uri = self.uri(path, params)
+        read_timeout = self._transport.read_timeout
+        blocking = _blocking_wait(params)
+        if blocking is not None:
+            read_timeout += blocking
+
+        def send() -> requests.Response:
+            self._breaker.check()
+            try:
+                response = self._session.request(
+                    method,
+                    uri,
+                    data=data,
+                    headers=headers,
+                    timeout=(self._transport.connect_timeout, read_timeout),
+                    verify=self.verify,
+                    cert=self.cert,
+                )
+            except requests.RequestException:
+                self._breaker.record(False)
+                raise
+            self._breaker.record(response.status_code < 500)
+            return response
+
+        if method == "GET" and blocking is None:
+            response = self._retrying.copy()(send)
+        else:
+            response = send()
+        response.encoding = "utf-8"
+        return base.Response(
+            response.status_code, response.headers, response.text
+        )
+
+    def get[T](
+        self,
+        callback: Callable[[base.Response], T],
+        path: str,
+        params: List[Tuple[str, Any]] | None = None,
+        headers: dict[str, str] | None = None,
+        **_: object,
+    ) -> T:
+        return callback(self._request("GET", path, params, headers=headers))
+
+    def put[T](
+        self,
+        callback: Callable[[base.Response], T],
+        path: str,
+        params: List[Tuple[str, Any]] | None = None,
+        data: str = "",
+        headers: dict[str, str] | None = None,
+        **_: object,
+    ) -> T:
+        return callback(self._request("PUT", path, params, data, headers))
+
+    def delete[T](
+        self,
+        callback: Callable[[base.Response], T],
+        path: str,
+        params: List[Tuple[str, Any]] | None = None,
+        headers: dict[str, str] | None = None,
+        **_: object,
+    ) -> T:
+        return callback(self._request("DELETE", path, params, headers=headers))
+
+    def post[T](
+        self,
+        callback: Callable[[base.Response], T],
+        path: str,
+        params: List[Tuple[str, Any]] | None = None,
+        data: str = "",
+        headers: dict[str, str] | None = None,
+        **_: object,
+    ) -> T:
+        return callback(self._request("POST", path, params, data, headers))
+
+    def close(self) -> None:
+        self._session.close()
+
+
+class Client(ConsulClient):
+    """A py-consul client sending its requests through a Transport."""
+
+    def __init__(self, transport: Transport, **kwargs: object) -> None:
+        # Set before the parent constructor connects
+        self._transport = transport
+        super().__init__(**kwargs)
+
+    def http_connect(
+        self,
+        host: str,
+        port: int,
+        scheme: str,
+        verify: bool | str = True,
+        cert: Cert = None,
+    ) -> HTTPClient:
+        return HTTPClient(host, port, scheme, verify, cert, self._transport)
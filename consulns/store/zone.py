@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import TYPE_CHECKING, Iterator, Dict, List
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Dict, List, Set
+from urllib.parse import quote
+from uuid import uuid4
 from dns.name import Name as DNSName
 from pydantic import UUID4, BaseModel
 
@@ -15,9 +17,24 @@ from consulns.const import (
     CONSUL_PATH_ZONE_INFO,
     CONSUL_PATH_ZONE_KEYS,
     CONSUL_PATH_ZONE_METADATA,
+    CONSUL_PATH_ZONE_RECORD_LOG,
+    CONSUL_PATH_ZONE_RECORD_LOG_ENTRY,
+    CONSUL_PATH_ZONE_RECORD_NAME,
+    CONSUL_PATH_ZONE_RECORD_NAMES,
     CONSUL_PATH_ZONE_RECORDS,
+    CONSUL_PATH_ZONE_STAGING,
 )
 
+# Commits retried on conflicting concurrent writes before giving up
+COMMIT_ATTEMPTS = 5
+# Names whose key add_records writes at once
+ADD_RECORDS_BATCH = 1000
+
+
+def _record_key(name: str) -> str:
+    """The key, under the names of the zone, holding the records of name."""
+    return quote(name.lower(), safe="")
+
 
 class AddKey(BaseModel):
     flags: int
@@ -34,11 +51,26 @@ class Zone:
     def __init__(self, consul: Consul, zone_name: DNSName) -> None:
         self._consul = consul
         self._zone_name = zone_name
-        self.__info = None
-        self.__stage = None
-        self.__records = None
-        self.__metadata = None
-        self.__keys = None
+        self.__metadata: Zone.Metadata | None = None
+        self.__keys: Zone.Keys | None = None
+        # Values fetched by Consul.prefetch, not decoded yet
+        self.__values: List[Consul.Value] | None = None
+        self._reset()
+
+    def _reset(self) -> None:
+        """Drops what commits read, to be read again from Consul."""
+        self.__info: Zone.ZoneInfo | None = None
+        self.__info_index = 0
+        self.__stage: Stage | None = None
+        self.__records: Zone.Records | None = None
+        # ModifyIndex of the keys of names present in Consul, of the log
+        # entries not moved to them yet, and of the keys of other layouts
+        # (e.g. the legacy single key) to migrate
+        self.__record_names: Dict[str, int] = {}
+        self.__record_log: Dict[str, int] = {}
+        self.__stale_records: Dict[str, int] = {}
+        # Keys of the names the log entries change
+        self.__unmoved: Set[str] = set()
 
     @property
     def name(self) -> DNSName:
@@ -55,18 +87,24 @@ class Zone:
 
     @property
     def _info(self) -> ZoneInfo:
+        self._read_values()
         if self.__info is None:
             info_path = self._compute_path(CONSUL_PATH_ZONE_INFO)
-            _, info = self._consul._kv_get(info_path, self.ZoneInfo)
+            index, info = self._consul._kv_get(info_path, self.ZoneInfo)
             if info is None:
                 info = self.ZoneInfo()
             self.__info = info
+            self.__info_index = index
 
         return self.__info
 
     def _update_info(self) -> None:
+        # Through a transaction, to learn the new ModifyIndex commits check
         info_path = self._compute_path(CONSUL_PATH_ZONE_INFO)
-        self._consul._kv_set(info_path, self._info)
+        indexes = self._consul._txn(
+            [self._consul._txn_set(info_path, self._info)]
+        )
+        self.__info_index = indexes[info_path]
 
     @property
     def serial(self) -> int:
@@ -102,6 +140,7 @@ class Zone:
 
     @property
     def stage(self) -> Stage:
+        self._read_values()
         if self.__stage is None:
             self.__stage = Stage(self)
 
@@ -110,20 +149,144 @@ class Zone:
     class Records(BaseModel):
         records: Dict[UUID4, Record] = {}
 
+    class RecordChanges(BaseModel):
+        """The changes of a commit, as logged until moved to their names."""
+
+        added: Dict[UUID4, Record] = {}
+        deleted: Set[UUID4] = set()
+        # Keys of the names whose records change
+        names: Set[str] = set()
+
     @property
     def _records(self) -> Records:
+        self._read_values()
         if self.__records is None:
+            # A single request fetches the keys of all names, the log and the
+            # legacy key
             records_path = self._compute_path(CONSUL_PATH_ZONE_RECORDS)
-            _, records = self._consul._kv_get(records_path, self.Records)
-            if records is None:
-                records = self.Records()
-            self.__records = records
+            _, values = self._consul._kv_get_prefix(records_path)
+            self._read_records(values)
 
+        assert self.__records is not None
         return self.__records
 
-    def _update_records(self) -> None:
-        records_path = self._compute_path(CONSUL_PATH_ZONE_RECORDS)
-        self._consul._kv_set(records_path, self._records)
+    def _read_records(self, values: Iterable[Consul.Value]) -> None:
+        """Reads the records of the zone from the values of its records keys.
+
+        The records of the keys of names, and of keys in other layouts, are
+        read first, then the log entries are applied over them, oldest
+        first. Applying an entry whose changes were already moved to the
+        keys of their names changes nothing.
+        """
+        names_path = self._compute_path(CONSUL_PATH_ZONE_RECORD_NAMES) + "/"
+        log_path = self._compute_path(CONSUL_PATH_ZONE_RECORD_LOG) + "/"
+        self.__records = self.Records()
+        log = []
+        for value in values:
+            key = value["Key"]
+            if key.startswith(log_path):
+                log.append(value)
+                continue
+
+            records = self.Records.model_validate_json(value["Value"])
+            self.__records.records.update(records.records)
+            if key.startswith(names_path):
+                name = key.removeprefix(names_path)
+                self.__record_names[name] = value["ModifyIndex"]
+            else:
+                self.__stale_records[key] = value["ModifyIndex"]
+
+        for value in sorted(log, key=lambda v: v["ModifyIndex"]):
+            changes = self.RecordChanges.model_validate_json(value["Value"])
+            self.__records.records.update(changes.added)
+            for id in changes.deleted:
+                self.__records.records.pop(id, None)
+            self.__record_log[value["Key"]] = value["ModifyIndex"]
+            self.__unmoved.update(changes.names)
+
+    def _records_ops(self) -> List[Dict[str, Any]]:
+        """Returns the operations moving the log to the keys of names.
+
+        The keys of the names the log entries change are written, then the
+        log entries deleted. Keys in other layouts are migrated, writing the
+        keys of all names before deleting them. Every operation only goes
+        through if its key did not change since it was read, and deletions
+        come last, so that the zone reads the same when only part of the
+        operations are applied.
+        """
+        records = self._records.records
+        names = set(self.__unmoved)
+        if self.__stale_records:
+            names.update(self.__record_names)
+            names.update(_record_key(r.record) for r in records.values())
+
+        by_name = {name: self.Records() for name in names}
+        for id, record in records.items():
+            name_records = by_name.get(_record_key(record.record))
+            if name_records is not None:
+                name_records.records[id] = record
+
+        ops = self._names_ops(by_name, names)
+        for key, index in sorted(self.__stale_records.items()):
+            ops.append(self._consul._txn_delete(key, index))
+        for key, index in sorted(
+            self.__record_log.items(), key=lambda item: item[1]
+        ):
+            ops.append(self._consul._txn_delete(key, index))
+        return ops
+
+    def _names_ops(
+        self, by_name: Dict[str, Records], names: Iterable[str]
+    ) -> List[Dict[str, Any]]:
+        """Returns the operations writing the keys of names, from by_name.
+
+        Names left without records have their key deleted.
+        """
+        ops = []
+        for name in sorted(names):
+            name_path = CONSUL_PATH_ZONE_RECORD_NAME.format(
+                zone=self.name, name=name
+            )
+            index = self.__record_names.get(name, 0)
+            name_records = by_name.get(name)
+            if name_records is not None and name_records.records:
+                ops.append(
+                    self._consul._txn_set(name_path, name_records, index)
+                )
+            elif index != 0:
+                ops.append(self._consul._txn_delete(name_path, index))
+        return ops
+
+    def _records_written(
+        self, ops: List[Dict[str, Any]], indexes: Dict[str, int]
+    ) -> None:
+        names_path = self._compute_path(CONSUL_PATH_ZONE_RECORD_NAMES) + "/"
+        for op in ops:
+            key = op["KV"]["Key"]
+            if not key.startswith(names_path):
+                continue
+            name = key.removeprefix(names_path)
+            if key in indexes:
+                self.__record_names[name] = indexes[key]
+            else:
+                self.__record_names.pop(name, None)
+        self.__record_log = {}
+        self.__stale_records = {}
+        self.__unmoved = set()
+
+    def _move_records(self) -> None:
+        """Moves the logged changes to the keys of their names.
+
+        Keys in other layouts are migrated along. Meant to run after
+        commits: this is not atomic, the keys going out in as many
+        transactions as needed, but the zone reads the same at any point,
+        and the next commit picks up where an interrupted move stopped.
+        """
+        if not self.__record_log and not self.__stale_records:
+            return
+
+        ops = self._records_ops()
+        self._records_written(ops, self._consul._txn_batches(ops))
 
     @property
     def records(self) -> Iterator[Record]:
@@ -138,25 +301,170 @@ class Zone:
         return None
 
     def commit(self) -> None:
-        for c in self.stage.changes:
+        """Applies the staged changes and bumps the serial of the zone.
+
+        The changes are logged, and info and staging written, in a single
+        Consul transaction, which only goes through if none of them changed
+        since they were read. Its size only depends on the changes, not on
+        the zone. On conflicts with a concurrent writer, the zone and its
+        staged changes are read again and the commit retried. Changes too
+        large for a single transaction raise TransactionTooLarge and stay
+        staged. Once committed, the changes are moved from the log to the
+        keys of their names, which is left to the next commit on conflicts.
+        """
+        # Imported here, as that module depends on this one
+        from consulns.store.consul import TransactionConflict
+
+        for attempt in range(COMMIT_ATTEMPTS):
+            try:
+                self._commit()
+                break
+            except TransactionConflict:
+                # Nothing was written, but the zone was changed in memory
+                self._reset()
+                if attempt == COMMIT_ATTEMPTS - 1:
+                    raise
+            except BaseException:
+                self._reset()
+                raise
+
+        try:
+            self._move_records()
+        except TransactionConflict:
+            # The changes are committed, and read from the log meanwhile
+            self._reset()
+
+    def _commit(self) -> None:
+        changes = list(self.stage.changes)
+        if len(changes) == 0:
+            return
+
+        records = self._records.records
+        log = self.RecordChanges()
+        for c in changes:
             updt = c.update
             if updt.change_type == "add":
-                self._records.records[updt.record.id] = updt.record
+                old = records.get(updt.record.id)
+                if old is not None:
+                    log.names.add(_record_key(old.record))
+                records[updt.record.id] = updt.record
+                log.added[updt.record.id] = updt.record
+                log.deleted.discard(updt.record.id)
+                log.names.add(_record_key(updt.record.record))
             elif updt.change_type == "del":
-                del self._records.records[updt.id]
+                # The record may already be gone, deleted by another change
+                old = records.pop(updt.id, None)
+                log.added.pop(updt.id, None)
+                if old is not None:
+                    log.deleted.add(updt.id)
+                    log.names.add(_record_key(old.record))
             else:
                 assert False
-        # First, apply the changes to the records object.
-        # If this fails, staging changes are preserved and the operation can be re-attempted.
-        self._update_records()
 
-        self.stage.clear()
+        log_path = CONSUL_PATH_ZONE_RECORD_LOG_ENTRY.format(
+            zone=self.name, id=uuid4().hex
+        )
+        indexes = self._bump_serial(
+            [
+                self._consul._txn_set(log_path, log, 0),
+                *self.stage._clear_ops(),
+            ]
+        )
+        self.__record_log[log_path] = indexes[log_path]
+        self.__unmoved.update(log.names)
+        self.stage._cleared()
+
+    def _bump_serial(
+        self, ops: List[Dict[str, Any]], atomic: bool = True
+    ) -> Dict[str, int]:
+        """Writes ops and bumps the serial of the zone.
+
+        All of it goes out in a single transaction, unless atomic is False,
+        in which case it is split as needed, the serial coming last.
+        """
+        info_path = self._compute_path(CONSUL_PATH_ZONE_INFO)
+        info = self._info.model_copy(update={"serial": self._info.serial + 1})
+        all_ops = [
+            *ops,
+            self._consul._txn_set(info_path, info, self.__info_index),
+        ]
+        if atomic:
+            indexes = self._consul._txn(all_ops)
+        else:
+            indexes = self._consul._txn_batches(all_ops)
+
+        self.__info = info
+        self.__info_index = indexes[info_path]
+        return indexes
+
+    def add_records(
+        self, records: Iterable[Record], replace: bool = False
+    ) -> int:
+        """Adds records to the zone directly, without staging them.
+
+        Meant for bulk imports, too large for the staging area. Records the
+        zone already has, with the same name, type, value and TTL, are
+        skipped. With replace, all records the zone had are dropped first.
+        The keys of the touched names are written every ADD_RECORDS_BATCH
+        names, in as few transactions as Consul's limits allow, and the
+        serial bumped last. This is not atomic, but running an interrupted
+        import again only adds the records still missing. Returns the number
+        of records added.
+        """
+        try:
+            # Then the keys of names hold all records of the zone
+            self._move_records()
+            by_name: Dict[str, Zone.Records] = {}
+            for id, record in self._records.records.items():
+                name = _record_key(record.record)
+                by_name.setdefault(name, self.Records()).records[id] = record
+
+            touched: Set[str] = set()
+            if replace:
+                touched.update(by_name)
+                by_name.clear()
+                self._records.records.clear()
+
+            existing = {r.content_hash for r in self._records.records.values()}
+            added = 0
+            changed = len(touched) > 0
+            for record in records:
+                if record.content_hash in existing:
+                    continue
+                existing.add(record.content_hash)
+                self._records.records[record.id] = record
+                name = _record_key(record.record)
+                by_name.setdefault(name, self.Records()).records[record.id] = (
+                    record
+                )
+                touched.add(name)
+                added += 1
+                changed = True
+                if len(touched) >= ADD_RECORDS_BATCH:
+                    self._write_names(by_name, touched)
+                    touched = set()
+
+            if changed:
+                self._write_names(by_name, touched)
+                self._bump_serial([], atomic=False)
+        except BaseException:
+            # Part of the records may be written, read them again
+            self._reset()
+            raise
+        return added
+
+    def _write_names(
+        self, by_name: Dict[str, Records], names: Set[str]
+    ) -> None:
+        ops = self._names_ops(by_name, names)
+        self._records_written(ops, self._consul._txn_batches(ops))
 
     class Metadata(BaseModel):
         metadata: Dict[str, List[str]] = {}
 
     @property
     def _metadata(self) -> Metadata:
+        self._read_values()
         if self.__metadata is None:
             metadata_path = self._compute_path(CONSUL_PATH_ZONE_METADATA)
             _, metadata = self._consul._kv_get(metadata_path, self.Metadata)
@@ -180,6 +488,7 @@ class Zone:
 
     @property
     def _keys(self) -> Keys:
+        self._read_values()
         if self.__keys is None:
             keys_path = self._compute_path(CONSUL_PATH_ZONE_KEYS)
             _, keys = self._consul._kv_get(keys_path, self.Keys)
@@ -226,3 +535,81 @@ class Zone:
         ]
         keys_path = self._compute_path(CONSUL_PATH_ZONE_KEYS)
         self._consul._kv_set(keys_path, self._keys)
+
+    class Data(BaseModel):
+        """All the committed data of a zone, as stored in Consul."""
+
+        info: Zone.ZoneInfo
+        records: Zone.Records
+        metadata: Zone.Metadata
+        keys: Zone.Keys
+
+    @property
+    def data(self) -> Data:
+        return self.Data(
+            info=self._info,
+            records=self._records,
+            metadata=self._metadata,
+            keys=self._keys,
+        )
+
+    @classmethod
+    def from_data(cls, consul: Consul, zone_name: DNSName, data: Data) -> Zone:
+        """Builds a zone from already fetched data, without reading Consul."""
+        zone = cls(consul, zone_name)
+        zone.__info = data.info
+        zone.__records = data.records
+        zone.__metadata = data.metadata
+        zone.__keys = data.keys
+        return zone
+
+    @classmethod
+    def from_values(
+        cls, consul: Consul, zone_name: DNSName, values: Iterable[Consul.Value]
+    ) -> Zone:
+        """Builds a zone from the values of its keys, without reading Consul.
+
+        Everything the zone would read lazily, staging included, is taken from
+        the values along with its ModifyIndex, on first use. Missing keys are
+        treated as missing in Consul.
+        """
+        zone = cls(consul, zone_name)
+        zone.__values = list(values)
+        return zone
+
+    def _read_values(self) -> None:
+        """Reads the values given to from_values, on first use.
+
+        Decoding is deferred so that the zones of a prefetch can be decoded
+        from several threads, and only when used.
+        """
+        if self.__values is None:
+            return
+        values, self.__values = self.__values, None
+
+        self.__info = self.ZoneInfo()
+        self.__metadata = self.Metadata()
+        self.__keys = self.Keys()
+
+        info_path = self._compute_path(CONSUL_PATH_ZONE_INFO)
+        records_path = self._compute_path(CONSUL_PATH_ZONE_RECORDS)
+        metadata_path = self._compute_path(CONSUL_PATH_ZONE_METADATA)
+        keys_path = self._compute_path(CONSUL_PATH_ZONE_KEYS)
+        staging_path = self._compute_path(CONSUL_PATH_ZONE_STAGING)
+        record_values = []
+        staging_values = []
+        for value in values:
+            key, raw = value["Key"], value["Value"]
+            if key == info_path:
+                self.__info = self.ZoneInfo.model_validate_json(raw)
+                self.__info_index = value["ModifyIndex"]
+            elif key == records_path or key.startswith(records_path + "/"):
+                record_values.append(value)
+            elif key == metadata_path:
+                self.__metadata = self.Metadata.model_validate_json(raw)
+            elif key == keys_path:
+                self.__keys = self.Keys.model_validate_json(raw)
+            elif key == staging_path or key.startswith(staging_path + "/"):
+                staging_values.append(value)
+        self._read_records(record_values)
+        self.stage._fill(staging_values)
@@ -0,0 +1,149 @@
+from typing import Any, Callable, Dict, Iterator, List, TextIO, Tuple
+
+import dns.rdataclass
+import dns.rdatatype
+import dns.tokenizer
+import dns.zone
+import dns.zonefile
+from dns.name import Name as DNSName
+from pydantic import TypeAdapter
+
+from consulns.store.record import Record, RecordType
+from consulns.store.zone import Zone
+
+# Lines of a zone file read, and records validated and handed over, at once
+BATCH_SIZE = 1000
+
+rdtype2rtype = {
+    dns.rdatatype.A: RecordType.A,
+    dns.rdatatype.AAAA: RecordType.AAAA,
+    dns.rdatatype.CNAME: RecordType.CNAME,
+    dns.rdatatype.MX: RecordType.MX,
+    dns.rdatatype.NS: RecordType.NS,
+}
+
+_records_adapter = TypeAdapter(List[Record])
+
+
+def _depth(line: str, depth: int) -> int:
+    """Returns the depth of parentheses at the end of a zone file line."""
+    quoted = escaped = False
+    for c in line:
+        if escaped:
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif quoted:
+            quoted = c != '"'
+        elif c == '"':
+            quoted = True
+        elif c == ";":
+            break
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+    return depth
+
+
+def _chunks(f: TextIO) -> Iterator[Tuple[int, str]]:
+    """Splits a zone file in chunks of about BATCH_SIZE lines.
+
+    Chunks only end outside of parentheses, so that records spanning
+    several lines are never split. Yields the number of the first line of
+    each chunk along with it.
+    """
+    lines: List[str] = []
+    first = 1
+    depth = 0
+    for n, line in enumerate(f, start=1):
+        lines.append(line)
+        if depth > 0 or "(" in line or ")" in line:
+            depth = _depth(line, depth)
+        if depth == 0 and len(lines) >= BATCH_SIZE:
+            yield first, "".join(lines)
+            lines.clear()
+            first = n + 1
+    if lines:
+        yield first, "".join(lines)
+
+
+def read_zone_file(
+    f: TextIO,
+    origin: DNSName,
+    on_skipped: Callable[[DNSName, str], None] | None = None,
+) -> Iterator[List[Record]]:
+    """Reads the records of an RFC 1035 zone file, in batches.
+
+    The file is parsed by dnspython BATCH_SIZE lines at a time, each batch
+    read in a transaction of its own zone, whose records are then validated
+    and yielded. The same reader goes through all batches, carrying the
+    origin, default TTL and owner name of the previous line over, so that
+    only a batch of the file is held at once. Records of types consulns does
+    not support are passed to on_skipped, with the exception of the SOA
+    record which cnsd synthesizes.
+    """
+    filename = getattr(f, "name", "<file>")
+    reader = None
+    for line, text in _chunks(f):
+        zone = dns.zone.Zone(origin, relativize=False)
+        tok = dns.tokenizer.Tokenizer(text, filename)
+        # So that errors point at the line of the file
+        tok.line_number = line
+        with zone.writer() as txn:
+            if reader is None:
+                reader = dns.zonefile.Reader(tok, dns.rdataclass.IN, txn)
+            else:
+                reader.tok, reader.txn = tok, txn
+            reader.read()
+
+        batch: List[Dict[str, Any]] = []
+        for name, rdataset in zone.iterate_rdatasets():
+            rtype = rdtype2rtype.get(rdataset.rdtype)
+            if rtype is None:
+                if (
+                    rdataset.rdtype != dns.rdatatype.SOA
+                    and on_skipped is not None
+                ):
+                    on_skipped(name, dns.rdatatype.to_text(rdataset.rdtype))
+                continue
+
+            record = (
+                "@" if name == origin else name.relativize(origin).to_text()
+            )
+            for rdata in rdataset:
+                batch.append(
+                    {
+                        "record": record,
+                        "record_type": rtype,
+                        "value": rdata.to_text(),
+                        "ttl": rdataset.ttl,
+                    }
+                )
+        if batch:
+            yield _records_adapter.validate_python(batch)
+
+
+def write_zone_file(f: TextIO, zone: Zone) -> None:
+    """Writes the records of a zone as an RFC 1035 zone file.
+
+    Records are grouped by owner name in a single pass, then written one
+    line at a time, the apex first and then each name in order, by type
+    within a name. The SOA record is left out, and CONSUL records, which
+    have no zone file representation, are written as comments.
+    """
+    by_name: Dict[str, List[Record]] = {}
+    for record in zone.records:
+        by_name.setdefault(record.record, []).append(record)
+
+    f.write(f"$ORIGIN {zone.name.to_text()}\n")
+    apex = by_name.pop("@", [])
+    for records in [apex, *(by_name[name] for name in sorted(by_name))]:
+        for record in sorted(records, key=lambda r: r.record_type.value):
+            line = (
+                f"{record.record}\t{record.ttl}\tIN\t"
+                f"{record.record_type.value}\t{record.value}\n"
+            )
+            if record.record_type == RecordType.CONSUL:
+                line = f"; {line}"
+            f.write(line)
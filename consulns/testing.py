@@ -0,0 +1,220 @@
+from base64 import b64decode, b64encode
+from threading import Condition
+from time import monotonic
+from typing import Any, Dict, List, Tuple
+
+from consul.exceptions import ClientError
+
+from consulns.store.consul import Consul
+
+
+def _wait_seconds(wait: str | None) -> float:
+    if wait is None:
+        return 300.0
+    units = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    for unit in sorted(units, key=len, reverse=True):
+        if wait.endswith(unit):
+            return float(wait.removesuffix(unit)) * units[unit]
+    return float(wait)
+
+
+class _KV:
+    def __init__(self, consul: "FakeConsul") -> None:
+        self._consul = consul
+
+    def get(
+        self,
+        key: str,
+        index: int | str | None = None,
+        recurse: bool = False,
+        wait: str | None = None,
+        keys: bool = False,
+        **_: object,
+    ) -> Tuple[str, Any]:
+        c = self._consul
+        with c.cond:
+            c.block(index, wait)
+            c.requests += 1
+            if recurse or keys:
+                values = [
+                    dict(v)
+                    for k, v in sorted(c.data.items())
+                    if k.startswith(key)
+                ]
+                if keys:
+                    return str(c.index), [v["Key"] for v in values] or None
+                return str(c.index), values or None
+
+            value = c.data.get(key)
+            return str(c.index), dict(value) if value is not None else None
+
+    def put(
+        self,
+        key: str,
+        value: str | bytes,
+        cas: int | None = None,
+        **_: object,
+    ) -> bool:
+        c = self._consul
+        with c.cond:
+            c.requests += 1
+            return c.set(key, value, cas)
+
+    def delete(
+        self, key: str, recurse: bool | None = None, cas: int | None = None
+    ) -> bool:
+        c = self._consul
+        with c.cond:
+            c.requests += 1
+            return c.delete(key, recurse or False, cas)
+
+
+class _Txn:
+    def __init__(self, consul: "FakeConsul") -> None:
+        self._consul = consul
+
+    def put(self, payload: List[Dict[str, Any]]) -> Dict[str, Any]:
+        c = self._consul
+        with c.cond:
+            c.requests += 1
+            # Check all operations before applying any
+            errors = []
+            for i, op in enumerate(payload):
+                kv = op["KV"]
+                if kv["Verb"] not in ("cas", "delete-cas"):
+                    continue
+                old = c.data.get(kv["Key"])
+                current = old["ModifyIndex"] if old is not None else 0
+                if current != kv["Index"]:
+                    errors.append({"OpIndex": i, "What": "index mismatch"})
+            if errors:
+                raise ClientError(f"409 {errors}")
+
+            results: List[Dict[str, Any]] = []
+            for op in payload:
+                kv = op["KV"]
+                if kv["Verb"] == "get-tree":
+                    results.extend(
+                        {"KV": dict(v, Value=b64encode(v["Value"]).decode())}
+                        for k, v in sorted(c.data.items())
+                        if k.startswith(kv["Key"])
+                    )
+                elif kv["Verb"] in ("set", "cas"):
+                    c.set(kv["Key"], b64decode(kv["Value"]), None)
+                    results.append({"KV": dict(c.data[kv["Key"]], Value=None)})
+                elif kv["Verb"] in ("delete", "delete-cas"):
+                    c.delete(kv["Key"], False, None)
+            return {"Results": results, "Errors": None}
+
+
+class _Health:
+    def __init__(self, consul: "FakeConsul") -> None:
+        self._consul = consul
+
+    def service(
+        self,
+        service: str,
+        index: int | str | None = None,
+        wait: str | None = None,
+        passing: bool = False,
+        **_: object,
+    ) -> Tuple[str, List[Dict[str, Any]]]:
+        c = self._consul
+        with c.cond:
+            c.block(index, wait)
+            c.requests += 1
+            entries = []
+            for address, port, healthy in c.services.get(service, []):
+                if passing and not healthy:
+                    continue
+                entries.append(
+                    {
+                        "Node": {"Address": address},
+                        "Service": {"Address": address, "Port": port},
+                    }
+                )
+            return str(c.index), entries
+
+
+class FakeConsul:
+    """An in-process fake of the `consul.Consul` client.
+
+    It implements the parts of the Consul API used by consulns closely enough
+    for the store and the daemon to run against it unmodified: KV reads,
+    writes, deletes and transactions with blocking queries and check-and-set,
+    and service health. All requests go through a single condition variable,
+    which also wakes up blocking queries whenever the index moves.
+    """
+
+    def __init__(self) -> None:
+        self.cond = Condition()
+        self.index = 1
+        self.data: Dict[str, Dict[str, Any]] = {}
+        # Service -> (address, port, healthy) for each instance
+        self.services: Dict[str, List[Tuple[str, int, bool]]] = {}
+        self.requests = 0
+
+        self.kv = _KV(self)
+        self.txn = _Txn(self)
+        self.health = _Health(self)
+
+    def block(self, index: int | str | None, wait: str | None) -> None:
+        if index is None:
+            return
+        deadline = monotonic() + _wait_seconds(wait)
+        while self.index <= int(index):
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return
+            self.cond.wait(remaining)
+
+    def _bump(self) -> int:
+        self.index += 1
+        self.cond.notify_all()
+        return self.index
+
+    def set(self, key: str, value: str | bytes, cas: int | None) -> bool:
+        old = self.data.get(key)
+        if cas is not None:
+            current = old["ModifyIndex"] if old is not None else 0
+            if current != int(cas):
+                return False
+
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        index = self._bump()
+        self.data[key] = {
+            "LockIndex": 0,
+            "Key": key,
+            "Flags": 0,
+            "Value": value,
+            "CreateIndex": old["CreateIndex"] if old is not None else index,
+            "ModifyIndex": index,
+        }
+        return True
+
+    def delete(self, key: str, recurse: bool, cas: int | None) -> bool:
+        if cas is not None:
+            old = self.data.get(key)
+            if old is None or old["ModifyIndex"] != int(cas):
+                return False
+
+        if recurse:
+            for k in [k for k in self.data if k.startswith(key)]:
+                del self.data[k]
+        else:
+            self.data.pop(key, None)
+        self._bump()
+        return True
+
+    def set_service(
+        self, service: str, instances: List[Tuple[str, int, bool]]
+    ) -> None:
+        """Replaces the instances of a service, and their health."""
+        with self.cond:
+            self.services[service] = instances
+            self._bump()
+
+    def store(self) -> Consul:
+        """Returns a consulns store backed by this fake."""
+        return Consul(self)  # type: ignore[arg-type]
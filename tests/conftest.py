@@ -0,0 +1,22 @@
+import pytest
+
+from consulns.daemon.config import Config
+from consulns.store.consul import Consul
+from consulns.testing import FakeConsul
+
+
+@pytest.fixture
+def fake() -> FakeConsul:
+    return FakeConsul()
+
+
+@pytest.fixture
+def consul(fake: FakeConsul) -> Consul:
+    return fake.store()
+
+
+@pytest.fixture
+def config(fake: FakeConsul, monkeypatch: pytest.MonkeyPatch) -> Config:
+    """A daemon configuration whose clients all talk to the fake."""
+    monkeypatch.setattr(Config, "consul_client", lambda _: fake)
+    return Config(watch=False, watch_services=False, watch_wait="1s")
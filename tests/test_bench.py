@@ -0,0 +1,93 @@
+import json
+import socket
+from itertools import repeat
+from pathlib import Path
+from threading import Thread
+from typing import List
+
+import pytest
+
+from consulns.bench.load import BackendError, Connection, run
+
+RESULT = [{"qname": 'a{"b}\\', "content": "é€😀}"}, {"x": [{}]}]
+
+
+def _serve(path: Path, chunk_size: int) -> None:
+    """Answers a single query with RESULT, chunk_size bytes at a time."""
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    srv.bind(str(path))
+    srv.listen()
+
+    def serve() -> None:
+        conn, _ = srv.accept()
+        with conn, srv:
+            conn.recv(1 << 16)
+            raw = json.dumps({"result": RESULT}, ensure_ascii=False).encode()
+            for i in range(0, len(raw), chunk_size):
+                conn.sendall(raw[i : i + chunk_size])
+
+    thr = Thread(target=serve)
+    thr.daemon = True
+    thr.start()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1 << 16])
+def test_query_split_response(tmp_path: Path, chunk_size: int) -> None:
+    path = tmp_path / "cnsd.sock"
+    _serve(path, chunk_size)
+    conn = Connection(path)
+    try:
+        assert conn.query(b'{"method":"lookup"}\n') == RESULT
+    finally:
+        conn.close()
+
+
+def test_run_without_cnsd(tmp_path: Path) -> None:
+    with pytest.raises(BackendError):
+        run(tmp_path / "missing.sock", lambda _: repeat(("lookup", b"")), 4, 1)
+
+
+def _serve_silent(path: Path, queries: List[bytes]) -> None:
+    """Reads queries without ever answering them, as cnsd does when a
+    handler fails."""
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    srv.bind(str(path))
+    srv.listen()
+
+    def serve() -> None:
+        with srv:
+            while True:
+                conn, _ = srv.accept()
+                Thread(target=read, args=(conn,), daemon=True).start()
+
+    def read(conn: socket.socket) -> None:
+        with conn:
+            while raw := conn.recv(1 << 16):
+                queries.append(raw)
+
+    Thread(target=serve, daemon=True).start()
+
+
+def test_query_timeout(tmp_path: Path) -> None:
+    path = tmp_path / "cnsd.sock"
+    _serve_silent(path, [])
+    conn = Connection(path, timeout=0.05)
+    try:
+        with pytest.raises(BackendError, match="no response"):
+            conn.query(b'{"method":"lookup"}\n')
+    finally:
+        conn.close()
+
+
+def test_run_counts_timeouts(tmp_path: Path) -> None:
+    path = tmp_path / "cnsd.sock"
+    queries: List[bytes] = []
+    _serve_silent(path, queries)
+    raw = b'{"method":"lookup"}\n'
+
+    stats, _ = run(path, lambda _: repeat(("lookup", raw)), 2, 0.3, 0.05)
+
+    # Each query timed out, and was sent again over a new connection
+    assert stats.errors >= 4
+    assert stats.errors <= len(queries)
+    assert stats.latencies == {}
@@ -0,0 +1,60 @@
+from typing import List
+
+from consulns.daemon.catalog import Catalog
+from consulns.daemon.config import Config
+from consulns.testing import FakeConsul
+from tests.util import wait_until
+
+
+def _addresses(catalog: Catalog, service: str) -> List[str]:
+    return sorted(i.address for i in catalog.instances(service))
+
+
+def test_only_healthy_instances(fake: FakeConsul, config: Config) -> None:
+    fake.set_service("api", [("10.0.0.1", 80, True), ("10.0.0.2", 80, False)])
+    catalog = Catalog(config, fake.store())
+
+    assert _addresses(catalog, "api") == ["10.0.0.1"]
+    assert catalog.instances("missing") == []
+
+
+def test_health_transitions(fake: FakeConsul, config: Config) -> None:
+    config.watch_services = True
+    fake.set_service("api", [("10.0.0.1", 80, True), ("10.0.0.2", 80, True)])
+    catalog = Catalog(config, fake.store())
+    changes: List[str] = []
+    catalog.add_listener(changes.append)
+    assert _addresses(catalog, "api") == ["10.0.0.1", "10.0.0.2"]
+
+    # An instance failing its checks is dropped
+    fake.set_service("api", [("10.0.0.1", 80, True), ("10.0.0.2", 80, False)])
+    wait_until(lambda: _addresses(catalog, "api") == ["10.0.0.1"])
+    assert changes == ["api"]
+
+    # And comes back once healthy again
+    fake.set_service("api", [("10.0.0.1", 80, True), ("10.0.0.2", 80, True)])
+    wait_until(lambda: len(changes) == 2)
+    assert _addresses(catalog, "api") == ["10.0.0.1", "10.0.0.2"]
+
+    # All instances failing leave the service without any
+    fake.set_service("api", [("10.0.0.1", 80, False), ("10.0.0.2", 80, False)])
+    wait_until(lambda: len(changes) == 3)
+    assert catalog.instances("api") == []
+
+
+def test_unrelated_changes_do_not_notify(
+    fake: FakeConsul, config: Config
+) -> None:
+    config.watch_services = True
+    fake.set_service("api", [("10.0.0.1", 80, True)])
+    fake.set_service("db", [("10.0.0.5", 5432, True)])
+    catalog = Catalog(config, fake.store())
+    changes: List[str] = []
+    catalog.add_listener(changes.append)
+    catalog.instances("api")
+
+    # Moves the index the watch blocks on, without changing the instances
+    fake.set_service("db", [("10.0.0.6", 5432, True)])
+    fake.set_service("api", [("10.0.0.2", 80, True)])
+    wait_until(lambda: changes == ["api"])
+    assert _addresses(catalog, "api") == ["10.0.0.2"]
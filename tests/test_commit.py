@@ -0,0 +1,203 @@
+from typing import Any, Dict, List
+
+import pytest
+from consul.exceptions import ClientError
+from dns.name import from_text as dns_from_text
+
+from consulns.const import (
+    CONSUL_PATH_ZONE_RECORD_LOG,
+    CONSUL_PATH_ZONE_RECORD_NAMES,
+    CONSUL_PATH_ZONE_RECORDS,
+)
+from consulns.store import consul as consul_module
+from consulns.store.consul import Consul, TransactionTooLarge
+from consulns.store.record import Record, RecordType
+from consulns.store.zone import Zone
+from consulns.testing import FakeConsul
+from tests.util import add_zone
+
+
+def _record(name: str, value: str = "10.0.0.1") -> Record:
+    return Record(record=name, record_type=RecordType.A, value=value, ttl=60)
+
+
+def _names(consul: Consul) -> list[str]:
+    zone = consul.zone(dns_from_text("example.com"))
+    return sorted(r.record for r in zone.records)
+
+
+def test_commit(consul: Consul) -> None:
+    zone = add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    www = next(zone.records)
+    assert zone.serial == 1
+
+    zone.stage.add_record(_record("api"))
+    zone.stage.del_record(www)
+    zone.commit()
+
+    assert _names(consul) == ["api"]
+    fresh = consul.zone(dns_from_text("example.com"))
+    assert fresh.serial == 2
+    assert list(fresh.stage.changes) == []
+
+
+def test_commit_nothing_staged(fake: FakeConsul, consul: Consul) -> None:
+    zone = add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    requests = fake.requests
+
+    zone.commit()
+    assert fake.requests == requests
+    assert zone.serial == 1
+
+
+def test_commit_retried_on_conflict(consul: Consul) -> None:
+    zone = add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    zone.stage.add_record(_record("api"))
+
+    # Another writer changes the zone after it was read
+    other = consul.zone(dns_from_text("example.com"))
+    other.add_records([_record("mail", "10.0.0.2")])
+
+    zone.commit()
+    assert _names(consul) == ["api", "mail", "www"]
+    assert consul.zone(dns_from_text("example.com")).serial == 3
+
+
+def test_delete_of_deleted_record(consul: Consul) -> None:
+    zone = add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    www = next(zone.records)
+    zone.stage.del_record(www)
+    zone.stage.add_record(_record("api"))
+
+    # The record is deleted, and the zone rewritten, by another writer
+    other = consul.zone(dns_from_text("example.com"))
+    other.add_records([], replace=True)
+
+    zone.commit()
+    assert _names(consul) == ["api"]
+
+
+def test_commit_too_large(
+    fake: FakeConsul, consul: Consul, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    zone = add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    with zone.stage.batch():
+        for i in range(20):
+            zone.stage.add_record(_record(f"host{i}"))
+    data = dict(fake.data)
+
+    # The log of twenty records is larger than this allows
+    monkeypatch.setattr(consul_module, "TXN_MAX_SIZE", 2048)
+    with pytest.raises(TransactionTooLarge):
+        zone.commit()
+
+    # Nothing was written, the changes are still staged
+    assert fake.data == data
+    assert _names(consul) == ["www"]
+    assert len(list(zone.stage.changes)) == 20
+    assert sorted(r.record for r in zone.records) == ["www"]
+
+    monkeypatch.setattr(consul_module, "TXN_MAX_SIZE", 512 * 1024)
+    zone.commit()
+    assert len(_names(consul)) == 21
+
+
+def _log_keys(fake: FakeConsul) -> list[str]:
+    log_path = CONSUL_PATH_ZONE_RECORD_LOG.format(zone="example.com.")
+    return [key for key in fake.data if key.startswith(log_path + "/")]
+
+
+def test_large_commit_single_transaction(
+    fake: FakeConsul, consul: Consul, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    zone = add_zone(consul, "example.com", [])
+    with zone.stage.batch():
+        for i in range(200):
+            zone.stage.add_record(_record(f"host{i}"))
+
+    transactions: List[List[Dict[str, Any]]] = []
+    put = fake.txn.put
+
+    def first_put(ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        transactions.append(ops)
+        if len(transactions) > 1:
+            # Another writer gets in the way of moving the changes
+            raise ClientError("409 index mismatch")
+        return put(ops)
+
+    monkeypatch.setattr(fake.txn, "put", first_put)
+    zone.commit()
+
+    # The commit went through with the first transaction, its changes are
+    # read from the log until moved to the keys of their names
+    assert len(transactions) == 2
+    assert len(_names(consul)) == 200
+    assert list(consul.zone(dns_from_text("example.com")).stage.changes) == []
+    assert len(_log_keys(fake)) == 1
+
+    monkeypatch.setattr(fake.txn, "put", put)
+    zone.stage.add_record(_record("api"))
+    zone.commit()
+    assert len(_names(consul)) == 201
+    assert _log_keys(fake) == []
+
+
+def _op_sizes(
+    fake: FakeConsul, monkeypatch: pytest.MonkeyPatch
+) -> List[int]:
+    """Records the size of the transactions sent from now on."""
+    sizes: List[int] = []
+    put = fake.txn.put
+
+    def sizing_put(ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        sizes.append(sum(Consul._txn_op_size(op) for op in ops))
+        return put(ops)
+
+    monkeypatch.setattr(fake.txn, "put", sizing_put)
+    return sizes
+
+
+def test_large_change_on_large_zone(
+    fake: FakeConsul, consul: Consul, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    zone = add_zone(consul, "example.com", [])
+    zone.add_records(_record(f"host{i}") for i in range(5000))
+    records = list(zone.records)
+
+    zone = consul.zone(dns_from_text("example.com"))
+    with zone.stage.batch():
+        for i in range(100):
+            zone.stage.add_record(_record(f"new{i}"))
+        for record in records[:100]:
+            zone.stage.del_record(record)
+    sizes = _op_sizes(fake, monkeypatch)
+    zone.commit()
+
+    # What is written depends on the size of the change, not of the zone
+    assert len(_names(consul)) == 5000
+    assert sum(sizes) < 100 * 1024
+    assert _log_keys(fake) == []
+
+
+def test_migrate_large_legacy_zone(
+    fake: FakeConsul, consul: Consul, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    zone = add_zone(consul, "example.com", [])
+    legacy = Zone.Records(
+        records={r.id: r for r in (_record(f"host{i}") for i in range(5000))}
+    )
+    raw = legacy.model_dump_json()
+    assert len(raw) > consul_module.TXN_MAX_SIZE
+    records_path = CONSUL_PATH_ZONE_RECORDS.format(zone="example.com.")
+    fake.kv.put(records_path, raw)
+
+    zone = consul.zone(dns_from_text("example.com"))
+    zone.stage.add_record(_record("api"))
+    sizes = _op_sizes(fake, monkeypatch)
+    zone.commit()
+
+    assert records_path not in fake.data
+    names_path = CONSUL_PATH_ZONE_RECORD_NAMES.format(zone="example.com.")
+    assert len([k for k in fake.data if k.startswith(names_path)]) == 5001
+    assert max(sizes) <= consul_module.TXN_MAX_SIZE
+    assert len(_names(consul)) == 5001
@@ -0,0 +1,120 @@
+from socket import socket
+from typing import Iterable, List, cast
+
+import pytest
+
+from consulns.daemon import framing
+from consulns.daemon.framing import Framer, QueryTooLarge
+
+
+class FakeSocket:
+    """Hands out the given chunks, one per read, and takes at most
+    max_send bytes per write."""
+
+    def __init__(
+        self, chunks: Iterable[bytes], max_send: int = 1 << 30
+    ) -> None:
+        self._chunks = list(chunks)
+        self._max_send = max_send
+        self.sent = bytearray()
+        self.sends: List[int] = []
+
+    def recv_into(self, buf: memoryview) -> int:
+        if len(self._chunks) == 0:
+            return 0
+        chunk = self._chunks.pop(0)
+        assert len(chunk) <= len(buf)
+        buf[: len(chunk)] = chunk
+        return len(chunk)
+
+    def sendmsg(self, bufs: List[memoryview]) -> int:
+        self.sends.append(len(bufs))
+        data = b"".join(bufs)[: self._max_send]
+        self.sent += data
+        return len(data)
+
+
+def _framer(sock: FakeSocket, recv_size: int = 8, max_size: int = 64) -> Framer:
+    return Framer(cast(socket, sock), recv_size=recv_size, max_size=max_size)
+
+
+def _read_all(framer: Framer) -> List[List[bytes]]:
+    reads = []
+    while queries := framer.read():
+        reads.append(queries)
+    return reads
+
+
+def test_queries_received_together() -> None:
+    framer = _framer(FakeSocket([b"a\nbc\nd\n"]))
+
+    assert _read_all(framer) == [[b"a\n", b"bc\n", b"d\n"]]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8])
+def test_queries_split_across_reads(size: int) -> None:
+    data = b'{"method":"lookup"}\n{"method":"list"}\nx\n'
+    chunks = [data[i : i + size] for i in range(0, len(data), size)]
+    framer = _framer(FakeSocket(chunks))
+
+    queries = [q for queries in _read_all(framer) for q in queries]
+    assert queries == [b'{"method":"lookup"}\n', b'{"method":"list"}\n', b"x\n"]
+
+
+def test_partial_query_kept_after_split() -> None:
+    framer = _framer(FakeSocket([b"a\nb", b"c\nd", b"\n"]))
+
+    assert _read_all(framer) == [[b"a\n"], [b"bc\n"], [b"d\n"]]
+
+
+def test_unterminated_query_dropped_on_close() -> None:
+    framer = _framer(FakeSocket([b"a\nb"]))
+
+    assert _read_all(framer) == [[b"a\n"]]
+
+
+def test_query_too_large() -> None:
+    framer = _framer(FakeSocket([b"x" * 8] * 16), max_size=64)
+
+    with pytest.raises(QueryTooLarge):
+        framer.read()
+
+
+def test_query_up_to_max_size() -> None:
+    query = b"x" * 63 + b"\n"
+    chunks = [query[i : i + 8] for i in range(0, len(query), 8)]
+    framer = _framer(FakeSocket([*chunks, b"y\n"]), max_size=64)
+
+    assert _read_all(framer) == [[query], [b"y\n"]]
+
+
+def test_large_queries_after_small_ones() -> None:
+    # The buffer is compacted and grown around the pending data
+    chunks = [b"a\nb", b"x" * 8, b"x" * 8, b"\nc\n"]
+    framer = _framer(FakeSocket(chunks))
+
+    queries = [q for queries in _read_all(framer) for q in queries]
+    assert queries == [b"a\n", b"b" + b"x" * 16 + b"\n", b"c\n"]
+
+
+def test_write_batch() -> None:
+    sock = FakeSocket([])
+    replies = [b"a\n", b"", b"bc\n"]
+    _framer(sock).write(replies)
+
+    assert sock.sent == b"a\nbc\n"
+    assert sock.sends == [2]
+
+
+@pytest.mark.parametrize("max_send", [1, 3, 7, 1000])
+def test_write_resumed_after_partial_send(
+    max_send: int, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(framing, "MAX_BUFFERS", 4)
+    replies = [f"reply {i}\n".encode() * (i % 3 + 1) for i in range(50)]
+    sock = FakeSocket([], max_send=max_send)
+    _framer(sock).write(replies)
+
+    assert sock.sent == b"".join(replies)
+    # No write is given more buffers than allowed
+    assert max(sock.sends) <= 4
@@ -0,0 +1,110 @@
+from random import Random
+from typing import List
+
+from consulns.daemon.metrics import (
+    MAX_BITS,
+    N_BUCKETS,
+    SUB_BUCKETS,
+    Histogram,
+    _bucket,
+    _upper_bound,
+)
+
+
+def _lower_bound(bucket: int) -> int:
+    return 0 if bucket == 0 else _upper_bound(bucket - 1)
+
+
+def _edges() -> List[int]:
+    """Values around every power of two and every bucket bound."""
+    values = set(range(4 * SUB_BUCKETS))
+    for bits in range(MAX_BITS + 2):
+        values.update({(1 << bits) - 1, 1 << bits, (1 << bits) + 1})
+    for bucket in range(N_BUCKETS):
+        bound = _upper_bound(bucket)
+        values.update({bound - 1, bound})
+    return sorted(values)
+
+
+def test_buckets_cover_values_contiguously() -> None:
+    assert _upper_bound(N_BUCKETS - 1) == 1 << MAX_BITS
+    for bucket in range(N_BUCKETS):
+        lower, upper = _lower_bound(bucket), _upper_bound(bucket)
+        assert lower < upper
+        assert _bucket(lower) == bucket
+        assert _bucket(upper - 1) == bucket
+
+
+def test_values_within_bucket_bounds() -> None:
+    for value in _edges():
+        bucket = _bucket(value)
+        if value >= 1 << MAX_BITS:
+            assert bucket == N_BUCKETS - 1
+        else:
+            assert _lower_bound(bucket) <= value < _upper_bound(bucket)
+
+
+def test_bucket_width() -> None:
+    # Small values have a bucket each, then buckets are at most
+    # 1/SUB_BUCKETS of their lower bound wide
+    for bucket in range(N_BUCKETS):
+        lower, upper = _lower_bound(bucket), _upper_bound(bucket)
+        if lower < SUB_BUCKETS:
+            assert upper - lower == 1
+        else:
+            assert (upper - lower) * SUB_BUCKETS <= lower
+
+
+def test_values_above_max_in_last_bucket() -> None:
+    h = Histogram()
+    h.record(1 << MAX_BITS)
+    h.record(1 << (MAX_BITS + 10))
+
+    assert h.counts[N_BUCKETS - 1] == 2
+    assert h.quantile(1.0) == 1 << MAX_BITS
+
+
+def test_quantile_upper_bound() -> None:
+    rng = Random(0)
+    values = sorted(rng.randrange(1 << 30) for _ in range(10000))
+    h = Histogram()
+    for value in values:
+        h.record(value)
+
+    for q in [0.01, 0.5, 0.9, 0.99, 0.999, 1.0]:
+        exact = values[max(int(q * len(values)) - 1, 0)]
+        estimate = h.quantile(q)
+        assert exact < estimate
+        assert estimate <= exact + exact // SUB_BUCKETS + 1
+
+
+def test_quantile_empty() -> None:
+    assert Histogram().quantile(0.5) == 0
+
+
+def test_merge() -> None:
+    a, b, both = Histogram(), Histogram(), Histogram()
+    for value in [1, 100, 10000]:
+        a.record(value)
+        both.record(value)
+    for value in [5, 100, 1 << MAX_BITS]:
+        b.record(value)
+        both.record(value)
+
+    a.merge(b)
+    assert (a.counts, a.count, a.sum) == (both.counts, both.count, both.sum)
+
+
+def test_cumulative() -> None:
+    h = Histogram()
+    for value in [0, 1, 1023, 1024, 1025, 5000, 1 << 20, 1 << MAX_BITS]:
+        h.record(value)
+
+    # Values counted below each bound, the bounds being bucket bounds
+    assert list(h.cumulative([1, 1024, 2048, 1 << 20, 1 << 30])) == [
+        (1, 1),
+        (1024, 3),
+        (2048, 5),
+        (1 << 20, 6),
+        (1 << 30, 7),
+    ]
@@ -0,0 +1,69 @@
+from typing import List, Tuple
+
+import pytest
+
+from consulns.daemon.cache import Cache
+from consulns.daemon.config import Config
+from consulns.daemon.handler import Handler
+from consulns.store.consul import Consul
+from tests.util import add_zone, call
+
+# Owner names of RFC 4034 section 6.1, in canonical order
+CANONICAL = [
+    "a",
+    "yljkjljk.a",
+    "Z.a",
+    "zABC.a",
+    "z",
+    "\\001.z",
+    "*.z",
+    "\\200.z",
+]
+
+
+@pytest.fixture
+def handler(consul: Consul, config: Config) -> Handler:
+    # Added in reverse, the zone has to sort them
+    records = [(name, "A", "10.0.0.1") for name in reversed(CANONICAL)]
+    add_zone(consul, "example", records)
+    return Handler(Cache(config))
+
+
+def _before_and_after(handler: Handler, qname: str) -> Tuple[str, str]:
+    result = call(handler, "getBeforeAndAfterNamesAbsolute", qname=qname)
+    assert isinstance(result, dict)
+    return result["before"], result["after"]
+
+
+def test_owner_names_surround_themselves(handler: Handler) -> None:
+    names: List[str] = ["", *CANONICAL]
+    for i, name in enumerate(names):
+        qname = f"{name}.example." if name else "example."
+        before, after = _before_and_after(handler, qname)
+        assert before.lower() == name.lower()
+        assert after.lower() == names[(i + 1) % len(names)].lower()
+
+
+@pytest.mark.parametrize(
+    "qname,before,after",
+    [
+        # Between two owner names
+        ("b.example.", "zabc.a", "z"),
+        ("aa.yljkjljk.a.example.", "yljkjljk.a", "z.a"),
+        # Case does not matter
+        ("B.EXAMPLE.", "zabc.a", "z"),
+        # Past the last name wraps around to the apex
+        ("zz.example.", "\\200.z", ""),
+    ],
+)
+def test_missing_names(
+    handler: Handler, qname: str, before: str, after: str
+) -> None:
+    result = _before_and_after(handler, qname)
+    assert (result[0].lower(), result[1].lower()) == (before, after)
+
+
+def test_relative_to_zone_id(handler: Handler) -> None:
+    result = call(handler, "getBeforeAndAfterNamesAbsolute", id=0, qname="b")
+    assert isinstance(result, dict)
+    assert (result["before"].lower(), result["after"]) == ("zabc.a", "z")
@@ -0,0 +1,106 @@
+from typing import Any, Tuple
+
+import pytest
+from dns.name import from_text as dns_from_text
+
+from consulns.const import CONSUL_PATH_ZONE, CONSUL_PATH_ZONES
+from consulns.daemon.cache import Cache
+from consulns.daemon.config import Config
+from consulns.daemon.proto import QType
+from consulns.daemon.watcher import Watcher
+from consulns.store.consul import TXN_MAX_OPS, Consul
+from consulns.store.record import Record, RecordType
+from consulns.testing import FakeConsul
+from tests.util import add_zone, wait_until
+
+
+def _records(consul: Consul, zone_name: str) -> list[str]:
+    zone = consul.zone(dns_from_text(zone_name))
+    return sorted(f"{r.record} {r.value}" for r in zone.records)
+
+
+def test_prefetch(fake: FakeConsul, consul: Consul) -> None:
+    add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    add_zone(consul, "example.org", [("api", "A", "10.0.1.1")])
+    requests = fake.requests
+
+    index, zones = consul.prefetch()
+    assert fake.requests == requests + 1
+    assert index == fake.index
+    assert sorted(zones) == [
+        dns_from_text("example.com"),
+        dns_from_text("example.org"),
+    ]
+    for zone_name, (_, zone) in zones.items():
+        assert sorted(
+            f"{r.record} {r.value}" for r in zone.records
+        ) == _records(consul, zone_name.to_text())
+
+
+def test_prefetch_single_zone(consul: Consul) -> None:
+    add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    add_zone(consul, "example.com.au", [("www", "A", "10.0.1.1")])
+
+    prefix = CONSUL_PATH_ZONE.format(zone="example.com.") + "/"
+    _, zones = consul.prefetch(prefix)
+    [(zone_name, (_, zone))] = zones.items()
+    assert zone_name == dns_from_text("example.com")
+    assert [str(r.value) for r in zone.records] == ["10.0.0.1"]
+
+
+def test_zone_infos(fake: FakeConsul, consul: Consul) -> None:
+    names = [f"zone{i}.example" for i in range(TXN_MAX_OPS + 1)]
+    for name in names:
+        add_zone(consul, name, [("www", "A", "10.0.0.1")])
+    zone = consul.zone(dns_from_text(names[0]))
+    zone.stage.add_record(
+        Record(record="api", record_type=RecordType.A, value="10.0.0.2", ttl=60)
+    )
+    zone.commit()
+    requests = fake.requests
+
+    infos = consul.zone_infos()
+    # The list of zones, then two transactions
+    assert fake.requests == requests + 3
+    assert sorted(infos) == sorted(dns_from_text(name) for name in names)
+    assert infos[dns_from_text(names[0])].serial == 2
+    assert infos[dns_from_text(names[1])].serial == 1
+
+
+def test_watcher_reuses_values(
+    fake: FakeConsul,
+    consul: Consul,
+    config: Config,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    example = add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    cache = Cache(config)
+    keys = []
+    get = fake.kv.get
+
+    def record_get(
+        key: str,
+        index: int | str | None = None,
+        recurse: bool = False,
+        wait: str | None = None,
+    ) -> Tuple[str, Any]:
+        keys.append(key)
+        return get(key, index=index, recurse=recurse, wait=wait)
+
+    monkeypatch.setattr(fake.kv, "get", record_get)
+    Watcher(cache).start()
+
+    example.stage.add_record(
+        Record(record="api", record_type=RecordType.A, value="10.0.0.2", ttl=60)
+    )
+    example.commit()
+    wait_until(lambda: _values(cache, "api.example.com") == ["10.0.0.2"])
+
+    # The changed zone is not read again after the blocking query
+    assert set(keys) == {CONSUL_PATH_ZONES}
+
+
+def _values(cache: Cache, qname: str) -> list[str]:
+    _, zone = cache.zone_by_qname(dns_from_text(qname))
+    assert zone is not None
+    return [i.content for i in zone.lookup(QType.A, dns_from_text(qname))]
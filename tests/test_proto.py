@@ -0,0 +1,173 @@
+import json
+from datetime import datetime, timedelta
+from random import Random
+from typing import Callable, Dict, List
+
+import pytest
+from pydantic import BaseModel, ValidationError
+
+from consulns.daemon.proto import (
+    BeforeAndAfterNames,
+    DomainInfo,
+    QType,
+    QueryAdapter,
+    RecordInfo,
+    Response,
+    Result,
+    ZoneKind,
+    decode_query,
+    encode_records,
+    encode_response,
+)
+from consulns.store.zone import Key
+
+SEEDS = range(20)
+# Characters JSON has to escape, and multibyte ones, mixed in names
+ALPHABET = 'abcz09-.*_\\"\n\t\x00é€😀'
+
+
+def _text(rand: Random) -> str:
+    return "".join(rand.choice(ALPHABET) for _ in range(rand.randrange(12)))
+
+
+def _int(rand: Random) -> int:
+    return rand.choice([0, -1, 1, 2**31, -(2**63), rand.randrange(1 << 32)])
+
+
+def _record(rand: Random) -> RecordInfo:
+    return RecordInfo(
+        qtype=rand.choice(list(QType)),
+        qname=_text(rand),
+        content=_text(rand),
+        ttl=_int(rand),
+        auth=rand.random() < 0.5,
+    )
+
+
+def _domain(rand: Random) -> DomainInfo:
+    return DomainInfo(
+        id=_int(rand),
+        zone=_text(rand),
+        serial=_int(rand),
+        notified_serial=_int(rand),
+        last_check=datetime(2000, 1, 1)
+        + timedelta(microseconds=rand.randrange(1 << 50)),
+        kind=rand.choice(list(ZoneKind)),
+    )
+
+
+def _key(rand: Random) -> Key:
+    return Key(
+        id=_int(rand),
+        flags=_int(rand),
+        active=rand.random() < 0.5,
+        published=rand.random() < 0.5,
+        content=_text(rand),
+    )
+
+
+def _many(rand: Random, f: Callable[[Random], object]) -> List[object]:
+    return [f(rand) for _ in range(rand.randrange(5))]
+
+
+# A generator for each member of the Result union
+RESULTS: List[Callable[[Random], object]] = [
+    lambda rand: rand.random() < 0.5,
+    lambda rand: _many(rand, _domain),
+    _domain,
+    lambda rand: _many(rand, _record),
+    lambda rand: _many(rand, _key),
+    lambda rand: {_text(rand): _many(rand, _text) for _ in range(3)},
+    lambda rand: _many(rand, _text),
+    lambda rand: BeforeAndAfterNames(
+        before=_text(rand), after=_text(rand), unhashed=_text(rand)
+    ),
+]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_encode_response_matches_pydantic(seed: int) -> None:
+    rand = Random(seed)
+    for generate in RESULTS:
+        result: Result = generate(rand)  # type: ignore[assignment]
+        expected = Response(result=result).model_dump_json().encode()
+        assert encode_response(result) == expected
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_encode_records_matches_pydantic(seed: int) -> None:
+    rand = Random(seed)
+    records = [_record(rand) for _ in range(rand.randrange(600))]
+    chunks = list(encode_records(records, chunk_size=rand.randrange(1, 4096)))
+    expected = Response(result=records).model_dump_json().encode()
+    assert b"".join(chunks) == expected
+
+
+def _lookup(rand: Random) -> Dict[str, object]:
+    return {
+        "qname": _text(rand),
+        "qtype": rand.choice(list(QType)).value,
+        "zone-id": _int(rand),
+        "remote": "192.0.2.1",
+    }
+
+
+def _domain_metadata(rand: Random) -> Dict[str, object]:
+    return {"name": _text(rand), "kind": _text(rand)}
+
+
+def _domain_info(rand: Random) -> Dict[str, object]:
+    return {"name": _text(rand)}
+
+
+QUERIES: Dict[str, Callable[[Random], Dict[str, object]]] = {
+    "lookup": _lookup,
+    "getDomainMetadata": _domain_metadata,
+    "getDomainInfo": _domain_info,
+}
+
+
+def _query(
+    rand: Random, method: str, params: Dict[str, object]
+) -> Dict[str, object]:
+    """Builds a query, randomly broken or left valid."""
+    mutation = rand.randrange(5)
+    if mutation == 0:
+        del params[rand.choice(sorted(params))]
+    elif mutation == 1:
+        params[rand.choice(sorted(params))] = rand.choice([None, [], {}, 1.5])
+    elif mutation == 2:
+        method = _text(rand)
+    elif mutation == 3:
+        return {"method": method}
+    return {"method": method, "parameters": params}
+
+
+def _validate(raw: bytes) -> BaseModel | ValidationError:
+    try:
+        return QueryAdapter.validate_json(raw)
+    except ValidationError as e:
+        return e
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_decode_query_matches_pydantic(seed: int) -> None:
+    rand = Random(seed)
+    for method, generate in QUERIES.items():
+        for _ in range(10):
+            query = _query(rand, method, generate(rand))
+            raw = json.dumps(query).encode()
+            expected = _validate(raw)
+            if isinstance(expected, ValidationError):
+                with pytest.raises(ValidationError):
+                    decode_query(raw)
+            else:
+                assert decode_query(raw) == expected
+
+
+@pytest.mark.parametrize(
+    "raw", [b"", b"{", b"[]", b"null", b'{"method":"lookup"}', b"\xff"]
+)
+def test_decode_query_rejects_malformed(raw: bytes) -> None:
+    with pytest.raises(ValidationError):
+        decode_query(raw)
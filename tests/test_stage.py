@@ -0,0 +1,139 @@
+from typing import Any, Dict, List
+
+import pytest
+from click.testing import CliRunner, Result
+from dns.name import from_text as dns_from_text
+
+from consulns.client import client
+from consulns.const import CLICK_CONSUL_CTX_KEY, CONSUL_PATH_ZONE_STAGING
+from consulns.store import consul as consul_module
+from consulns.store.consul import Consul
+from consulns.store.record import Record, RecordType
+from consulns.store.stage import CHUNK_CHANGES, AddRecord, Change, Stage
+from consulns.testing import FakeConsul
+from tests.util import add_zone
+
+STAGING_PATH = CONSUL_PATH_ZONE_STAGING.format(zone="example.com.")
+
+
+def _record(name: str) -> Record:
+    return Record(
+        record=name, record_type=RecordType.A, value="10.0.0.1", ttl=60
+    )
+
+
+def _staged(consul: Consul) -> List[str]:
+    zone = consul.zone(dns_from_text("example.com"))
+    names = []
+    for change in zone.stage.changes:
+        assert change.update.change_type == "add"
+        names.append(change.update.record.record)
+    return names
+
+
+def _chunks(fake: FakeConsul) -> List[str]:
+    return sorted(k for k in fake.data if k.startswith(STAGING_PATH + "/"))
+
+
+def test_stage_many_records(fake: FakeConsul, consul: Consul) -> None:
+    zone = add_zone(consul, "example.com", [])
+    names = [f"host{i}" for i in range(10000)]
+    with zone.stage.batch():
+        for name in names:
+            zone.stage.add_record(_record(name))
+
+    assert len(_chunks(fake)) == -(-len(names) // CHUNK_CHANGES)
+    assert _staged(consul) == names
+
+
+def test_change_rewrites_one_chunk(
+    fake: FakeConsul, consul: Consul, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    zone = add_zone(consul, "example.com", [])
+    with zone.stage.batch():
+        for i in range(3 * CHUNK_CHANGES):
+            zone.stage.add_record(_record(f"host{i}"))
+
+    transactions: List[List[Dict[str, Any]]] = []
+    put = fake.txn.put
+
+    def counting_put(ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        transactions.append(ops)
+        return put(ops)
+
+    monkeypatch.setattr(fake.txn, "put", counting_put)
+    zone.stage.revert(CHUNK_CHANGES)
+    zone.stage.add_record(_record("api"))
+
+    assert [len(ops) for ops in transactions] == [1, 1]
+    staged = _staged(consul)
+    assert len(staged) == 3 * CHUNK_CHANGES
+    assert f"host{CHUNK_CHANGES}" not in staged
+    assert staged[-1] == "api"
+
+
+def test_commit_clears_chunks(fake: FakeConsul, consul: Consul) -> None:
+    zone = add_zone(consul, "example.com", [])
+    with zone.stage.batch():
+        for i in range(2 * CHUNK_CHANGES):
+            zone.stage.add_record(_record(f"host{i}"))
+    zone.commit()
+
+    assert _chunks(fake) == []
+    assert _staged(consul) == []
+    fresh = consul.zone(dns_from_text("example.com"))
+    assert len(list(fresh.records)) == 2 * CHUNK_CHANGES
+
+
+def test_legacy_staging(fake: FakeConsul, consul: Consul) -> None:
+    add_zone(consul, "example.com", [])
+    change = Change(update=AddRecord(record=_record("www")))
+    legacy = Stage.Staging(changes={change.key: change})
+    fake.kv.put(STAGING_PATH, legacy.model_dump_json())
+
+    zone = consul.zone(dns_from_text("example.com"))
+    zone.stage.add_record(_record("api"))
+    assert _staged(consul) == ["www", "api"]
+
+    zone.commit()
+    assert STAGING_PATH not in fake.data
+    assert _chunks(fake) == []
+    fresh = consul.zone(dns_from_text("example.com"))
+    assert sorted(r.record for r in fresh.records) == ["api", "www"]
+
+
+def _cli(consul: Consul, *args: str, input: str | None = None) -> Result:
+    return CliRunner().invoke(
+        client, args, input=input, obj={CLICK_CONSUL_CTX_KEY: consul}
+    )
+
+
+def test_stage_from_file_too_large(
+    fake: FakeConsul, consul: Consul, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    zone = add_zone(consul, "example.com", [])
+    consul.use_zone(zone)
+    data = dict(fake.data)
+
+    monkeypatch.setattr(consul_module, "TXN_MAX_SIZE", 1024)
+    lines = "".join(f"host{i} IN A 60 10.0.0.1\n" for i in range(100))
+    result = _cli(consul, "stage", "add", "--from-file", "-", input=lines)
+
+    assert result.exit_code == 1
+    assert "nothing was staged" in result.output
+    assert fake.data == data
+
+
+def test_sync_too_large(
+    fake: FakeConsul, consul: Consul, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    zone = add_zone(consul, "example.com", [])
+    consul.use_zone(zone)
+
+    monkeypatch.setattr(consul_module, "TXN_MAX_SIZE", 1024)
+    lines = "".join(f"host{i} 60 IN A 10.0.0.1\n" for i in range(100))
+    result = _cli(consul, "zone", "sync", "-", input=lines)
+
+    assert result.exit_code == 1
+    assert "nothing was staged" in result.output
+    assert _staged(consul) == []
@@ -0,0 +1,79 @@
+from typing import List, Tuple
+
+from dns.name import from_text as dns_from_text
+
+from consulns.store.consul import Consul
+from consulns.store.record import Record, RecordType
+from consulns.store.zonefile import rdtype2rtype
+from consulns.testing import FakeConsul
+from tests.util import add_zone
+
+
+def _record(name: str, rtype: str, value: str) -> Record:
+    return Record(
+        record=name, record_type=RecordType(rtype), value=value, ttl=60
+    )
+
+
+def _tuples(consul: Consul) -> List[Tuple[str, str, str]]:
+    zone = consul.zone(dns_from_text("example.com"))
+    return sorted(
+        (r.record, r.record_type.value, str(r.value)) for r in zone.records
+    )
+
+
+def test_sync_stages_minimal_diff(consul: Consul) -> None:
+    zone = add_zone(
+        consul,
+        "example.com",
+        [
+            ("www", "A", "10.0.0.1"),
+            ("old", "A", "10.0.0.2"),
+            ("api", "CONSUL", "api"),
+        ],
+    )
+    # A duplicate, committed separately
+    zone.stage.add_record(_record("www", "A", "10.0.0.1"))
+    zone.commit()
+    target = [
+        _record("www", "A", "10.0.0.1"),
+        _record("new", "AAAA", "2001:db8::1"),
+        _record("new", "AAAA", "2001:db8::1"),
+    ]
+
+    added, deleted = zone.stage.sync(target, set(rdtype2rtype.values()))
+    # The duplicate www record and old are deleted, CONSUL records are kept
+    assert (added, deleted) == (1, 2)
+    zone.commit()
+    assert _tuples(consul) == [
+        ("api", "CONSUL", "api"),
+        ("new", "AAAA", "2001:db8::1"),
+        ("www", "A", "10.0.0.1"),
+    ]
+
+
+def test_sync_ttl_change(consul: Consul) -> None:
+    zone = add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    record = _record("www", "A", "10.0.0.1")
+    record.ttl = 300
+
+    assert zone.stage.sync([record]) == (1, 1)
+    zone.commit()
+    zone = consul.zone(dns_from_text("example.com"))
+    assert [r.ttl for r in zone.records] == [300]
+
+
+def test_sync_in_sync(fake: FakeConsul, consul: Consul) -> None:
+    zone = add_zone(
+        consul,
+        "example.com",
+        [("www", "A", "10.0.0.1"), ("mail", "A", "10.0.0.2")],
+    )
+    zone = consul.zone(dns_from_text("example.com"))
+    target = [_record("mail", "A", "10.0.0.2"), _record("WWW", "A", "10.0.0.1")]
+    index = fake.index
+
+    assert zone.stage.sync(target) == (0, 0)
+    # Nothing was written
+    assert fake.index == index
+    assert list(zone.stage.changes) == []
@@ -0,0 +1,216 @@
+from typing import Any, List, Tuple
+
+import pytest
+import requests
+
+from consulns.store import transport
+from consulns.store.transport import (
+    CircuitBreaker,
+    CircuitOpen,
+    HTTPClient,
+    Transport,
+)
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(transport, "monotonic", clock)
+    return clock
+
+
+def _fail(breaker: CircuitBreaker, times: int) -> None:
+    for _ in range(times):
+        breaker.check()
+        breaker.record(False)
+
+
+def test_breaker_opens_after_consecutive_failures(clock: Clock) -> None:
+    breaker = CircuitBreaker(failures=3, reset=10)
+    _fail(breaker, 2)
+    assert not breaker.open
+
+    _fail(breaker, 1)
+    assert breaker.open
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+
+
+def test_breaker_success_resets_failures(clock: Clock) -> None:
+    breaker = CircuitBreaker(failures=3, reset=10)
+    _fail(breaker, 2)
+    breaker.record(True)
+    _fail(breaker, 2)
+
+    assert not breaker.open
+
+
+def test_breaker_probe_success_closes(clock: Clock) -> None:
+    breaker = CircuitBreaker(failures=1, reset=10)
+    _fail(breaker, 1)
+
+    clock.now += 9.9
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+
+    clock.now += 0.1
+    breaker.check()
+    # A single request is let through until it completes
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+
+    breaker.record(True)
+    assert not breaker.open
+    breaker.check()
+
+
+def test_breaker_probe_failure_reopens(clock: Clock) -> None:
+    breaker = CircuitBreaker(failures=2, reset=10)
+    _fail(breaker, 2)
+
+    clock.now += 10
+    breaker.check()
+    breaker.record(False)
+    assert breaker.open
+
+    # The breaker stays open for another reset period
+    clock.now += 5
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    clock.now += 5
+    breaker.check()
+
+
+class FakeSession:
+    """Answers requests with the given responses, or raises the given
+    exceptions, in order."""
+
+    def __init__(self, outcomes: List[int | Exception]) -> None:
+        self._outcomes = outcomes
+        self.calls: List[dict[str, object]] = []
+
+    def request(
+        self, method: str, uri: str, **kwargs: object
+    ) -> requests.Response:
+        self.calls.append({"method": method, "uri": uri, **kwargs})
+        outcome = self._outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        response._content = f"{outcome}".encode()
+        return response
+
+
+def _client(
+    monkeypatch: pytest.MonkeyPatch,
+    outcomes: List[int | Exception],
+    **options: float,
+) -> Tuple[HTTPClient, FakeSession]:
+    monkeypatch.setattr(transport, "RETRY_MIN", 0)
+    monkeypatch.setattr(transport, "RETRY_MAX", 0)
+    client = HTTPClient(
+        "localhost", 8500, "http", True, None, Transport(**options)
+    )
+    session = FakeSession(outcomes)
+    monkeypatch.setattr(client, "_session", session)
+    return client, session
+
+
+def _code(
+    client: HTTPClient,
+    method: str,
+    params: List[Tuple[str, Any]] | None = None,
+) -> int:
+    send = getattr(client, method.lower())
+    code: int = send(lambda r: r.code, "/v1/kv/zones", params)
+    return code
+
+
+def test_read_retried(monkeypatch: pytest.MonkeyPatch) -> None:
+    client, session = _client(
+        monkeypatch, [requests.ConnectionError(), requests.Timeout(), 503, 200]
+    )
+
+    assert _code(client, "GET") == 200
+    assert len(session.calls) == 4
+    # Each failure counted towards the breaker, the success reset it
+    assert not client.breaker.open
+
+
+def test_read_out_of_retries(monkeypatch: pytest.MonkeyPatch) -> None:
+    client, session = _client(monkeypatch, [500] * 3, retries=2)
+
+    # The last server error is handed over to the callback
+    assert _code(client, "GET") == 500
+    assert len(session.calls) == 3
+
+
+def test_read_out_of_retries_raises(monkeypatch: pytest.MonkeyPatch) -> None:
+    errors: List[int | Exception] = [requests.ConnectionError()] * 3
+    client, session = _client(monkeypatch, errors, retries=2)
+
+    with pytest.raises(requests.ConnectionError):
+        _code(client, "GET")
+    assert len(session.calls) == 3
+
+
+def test_client_error_not_retried(monkeypatch: pytest.MonkeyPatch) -> None:
+    client, session = _client(monkeypatch, [404])
+
+    assert _code(client, "GET") == 404
+    assert len(session.calls) == 1
+
+
+def test_write_not_retried(monkeypatch: pytest.MonkeyPatch) -> None:
+    client, session = _client(monkeypatch, [503])
+
+    assert _code(client, "PUT") == 503
+    assert len(session.calls) == 1
+
+
+def test_blocking_read_not_retried(monkeypatch: pytest.MonkeyPatch) -> None:
+    client, session = _client(monkeypatch, [503], read_timeout=10)
+
+    params = [("index", 42), ("wait", "32s")]
+    assert _code(client, "GET", params=params) == 503
+    [call] = session.calls
+    # The read timeout covers the time Consul may hold the query
+    assert call["timeout"] == (2.0, 10 + 32 + 2)
+
+
+def test_breaker_fails_requests_fast(
+    monkeypatch: pytest.MonkeyPatch, clock: Clock
+) -> None:
+    client, session = _client(
+        monkeypatch, [500] * 3 + [200], retries=0, breaker_failures=3
+    )
+    for _ in range(3):
+        assert _code(client, "PUT") == 500
+    assert client.breaker.open
+
+    with pytest.raises(CircuitOpen):
+        _code(client, "GET")
+    assert len(session.calls) == 3
+
+    clock.now += Transport().breaker_reset
+    assert _code(client, "GET") == 200
+    assert not client.breaker.open
+
+
+def test_retries_stop_at_open_breaker(monkeypatch: pytest.MonkeyPatch) -> None:
+    client, session = _client(
+        monkeypatch, [500] * 2, retries=5, breaker_failures=2
+    )
+
+    with pytest.raises(CircuitOpen):
+        _code(client, "GET")
+    assert len(session.calls) == 2
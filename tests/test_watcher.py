@@ -0,0 +1,90 @@
+from dns.name import from_text as dns_from_text
+
+from consulns.const import CONSUL_PATH_ZONES
+from consulns.daemon.cache import Cache
+from consulns.daemon.config import Config
+from consulns.daemon.proto import QType
+from consulns.daemon.watcher import Watcher
+from consulns.store.consul import Consul
+from consulns.store.record import Record, RecordType
+from tests.util import add_zone, wait_until
+
+
+def _values(cache: Cache, qname: str, qtype: QType) -> list[str]:
+    _, zone = cache.zone_by_qname(dns_from_text(qname))
+    assert zone is not None
+    return [i.content for i in zone.lookup(qtype, dns_from_text(qname))]
+
+
+def test_refresh_on_commit(consul: Consul, config: Config) -> None:
+    example = add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    add_zone(consul, "example.org", [("www", "A", "10.0.1.1")])
+    cache = Cache(config)
+    Watcher(cache).start()
+    _, org = cache.zone_by_qname(dns_from_text("example.org"))
+
+    example.stage.add_record(
+        Record(record="api", record_type=RecordType.A, value="10.0.0.2", ttl=60)
+    )
+    example.commit()
+    wait_until(lambda: _values(cache, "api.example.com", QType.A) != [])
+
+    assert _values(cache, "api.example.com", QType.A) == ["10.0.0.2"]
+    assert _values(cache, "www.example.com", QType.A) == ["10.0.0.1"]
+    # Zones that did not change are carried over as they are
+    assert cache.zone_by_qname(dns_from_text("example.org"))[1] is org
+
+
+def test_staging_does_not_refresh(consul: Consul, config: Config) -> None:
+    example = add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    cache = Cache(config)
+    Watcher(cache).start()
+    _, before = cache.zone_by_qname(dns_from_text("example.com"))
+    refreshes = cache.refreshes
+
+    example.stage.add_record(
+        Record(record="api", record_type=RecordType.A, value="10.0.0.2", ttl=60)
+    )
+    wait_until(lambda: cache.refreshes > refreshes)
+
+    assert cache.zone_by_qname(dns_from_text("example.com"))[1] is before
+    assert _values(cache, "api.example.com", QType.A) == []
+
+
+def test_new_and_removed_zones(consul: Consul, config: Config) -> None:
+    add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    cache = Cache(config)
+    Watcher(cache).start()
+
+    add_zone(consul, "example.net", [("www", "A", "10.0.2.1")])
+    wait_until(lambda: len(list(cache.zones)) == 2)
+    # The zone is listed before its records are committed
+    wait_until(
+        lambda: _values(cache, "www.example.net", QType.A) == ["10.0.2.1"]
+    )
+
+    zones = consul._zone_names()
+    zones.zones.discard("example.com.")
+    consul._kv_set(CONSUL_PATH_ZONES, zones)
+    wait_until(lambda: len(list(cache.zones)) == 1)
+    _, zone = cache.zone_by_qname(dns_from_text("www.example.com"))
+    assert zone is None
+
+
+def test_reloaded_zones_keep_order_and_ids(
+    consul: Consul, config: Config
+) -> None:
+    for name in ["a.example", "b.example", "c.example"]:
+        add_zone(consul, name, [("www", "A", "10.0.0.1")])
+    cache = Cache(config)
+    before = [(i, cz.zone.name) for i, cz in cache.zones]
+
+    b = consul.zone(dns_from_text("b.example."))
+    b.stage.add_record(
+        Record(record="api", record_type=RecordType.A, value="10.0.0.2", ttl=60)
+    )
+    b.commit()
+    cache.refresh(*consul.zone_indexes())
+
+    assert [(i, cz.zone.name) for i, cz in cache.zones] == before
+    assert _values(cache, "api.b.example", QType.A) == ["10.0.0.2"]
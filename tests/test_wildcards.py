@@ -0,0 +1,87 @@
+from typing import List
+
+import pytest
+
+from consulns.daemon.cache import Cache
+from consulns.daemon.config import Config
+from consulns.daemon.handler import Handler
+from consulns.store.consul import Consul
+from tests.util import add_zone, call
+
+
+@pytest.fixture
+def handler(consul: Consul, config: Config) -> Handler:
+    add_zone(
+        consul,
+        "example.com",
+        [
+            ("*", "A", "10.0.0.9"),
+            ("www", "A", "10.0.0.1"),
+            ("*.sub", "A", "10.0.0.8"),
+            ("*.sub", "MX", "10 mail.example.com."),
+            ("host.sub", "A", "10.0.0.7"),
+            ("a.b.deep", "A", "10.0.0.6"),
+        ],
+    )
+    return Handler(Cache(config))
+
+
+def _lookup(handler: Handler, qname: str, qtype: str = "A") -> List[str]:
+    result = call(
+        handler, "lookup", qname=qname, qtype=qtype, **{"zone-id": -1}
+    )
+    assert isinstance(result, list)
+    for info in result:
+        # Synthesized answers are owned by the name queried, in any case
+        assert info["qname"] == qname
+    return [info["content"] for info in result]
+
+
+@pytest.mark.parametrize(
+    "qname,qtype,expected",
+    [
+        # Existing names are never answered by a wildcard
+        ("www.example.com.", "A", ["10.0.0.1"]),
+        ("www.example.com.", "AAAA", []),
+        ("host.sub.example.com.", "A", ["10.0.0.7"]),
+        # Nor are empty non-terminals, or names below them
+        ("deep.example.com.", "A", []),
+        ("b.deep.example.com.", "A", []),
+        ("x.b.deep.example.com.", "A", []),
+        # The wildcard of the closest encloser answers for missing names
+        ("foo.example.com.", "A", ["10.0.0.9"]),
+        ("a.b.c.example.com.", "A", ["10.0.0.9"]),
+        ("FOO.Example.COM.", "A", ["10.0.0.9"]),
+        ("foo.sub.example.com.", "A", ["10.0.0.8"]),
+        ("foo.sub.example.com.", "MX", ["10 mail.example.com."]),
+        ("foo.sub.example.com.", "AAAA", []),
+        ("x.foo.sub.example.com.", "A", ["10.0.0.8"]),
+        # Wildcards also answer queries for themselves
+        ("*.example.com.", "A", ["10.0.0.9"]),
+        ("*.sub.example.com.", "A", ["10.0.0.8"]),
+    ],
+)
+def test_wildcard_answers(
+    handler: Handler, qname: str, qtype: str, expected: List[str]
+) -> None:
+    assert sorted(_lookup(handler, qname, qtype)) == expected
+
+
+def test_any_on_synthesized_name(handler: Handler) -> None:
+    assert sorted(_lookup(handler, "foo.sub.example.com.", "ANY")) == [
+        "10 mail.example.com.",
+        "10.0.0.8",
+    ]
+
+
+def test_names_outside_the_zone(handler: Handler) -> None:
+    assert (
+        call(
+            handler,
+            "lookup",
+            qname="www.example.org.",
+            qtype="A",
+            **{"zone-id": -1},
+        )
+        is False
+    )
@@ -0,0 +1,179 @@
+import gc
+import mmap
+import weakref
+from pathlib import Path
+from socket import socket
+from typing import List, Tuple
+
+import pytest
+from dns.name import from_text as dns_from_text
+
+from consulns.daemon.cache import Cache, MappedZone
+from consulns.daemon.config import Config
+from consulns.daemon.proto import QType
+from consulns.daemon.stats import render
+from consulns.daemon.workers import Supervisor, Update
+from consulns.store.consul import Consul
+from consulns.store.record import Record, RecordType
+from consulns.testing import FakeConsul
+from tests.util import add_zone
+
+
+@pytest.fixture
+def caches(
+    consul: Consul, config: Config, tmp_path: Path
+) -> Tuple[Cache, Cache]:
+    """The cache of a refresher, and the one of a worker forked from it."""
+    add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    add_zone(consul, "example.org", [("api", "CONSUL", "api")])
+    config.snapshot_path = tmp_path / "snapshot"
+    refresher = Cache(config)
+    worker = Cache(config, background=False)
+    worker.after_fork()
+    return refresher, worker
+
+
+def _values(cache: Cache, qname: str, qtype: QType) -> List[str]:
+    _, zone = cache.zone_by_qname(dns_from_text(qname))
+    assert zone is not None
+    return [i.content for i in zone.lookup(qtype, dns_from_text(qname))]
+
+
+def test_worker_remaps_changed_zones(
+    consul: Consul, caches: Tuple[Cache, Cache]
+) -> None:
+    refresher, worker = caches
+    updates: List[Update] = []
+    with socket() as srv:
+        supervisor = Supervisor(srv, refresher, lambda *_: None, 0)
+    refresher.add_listener(
+        lambda old, new: updates.append(supervisor._changes(old, new))
+    )
+    _, org = worker.zone_by_qname(dns_from_text("example.org"))
+
+    example = consul.zone(dns_from_text("example.com."))
+    example.stage.add_record(
+        Record(record="api", record_type=RecordType.A, value="10.0.0.2", ttl=60)
+    )
+    example.commit()
+    refresher.refresh(*consul.zone_indexes())
+
+    [update] = updates
+    assert update.remap
+    worker.install(update.services, update.remap)
+    assert _values(worker, "api.example.com", QType.A) == ["10.0.0.2"]
+    assert worker.index == refresher.index
+    # Zones that did not change are carried over as they are
+    assert worker.zone_by_qname(dns_from_text("example.org"))[1] is org
+
+
+def test_worker_rebuilds_zones_using_services(
+    fake: FakeConsul, caches: Tuple[Cache, Cache]
+) -> None:
+    _, worker = caches
+    assert _values(worker, "api.example.org", QType.A) == []
+
+    fake.set_service("api", [("10.0.1.1", 80, True)])
+    _, instances = fake.store().service_instances("api")
+    worker.install({"api": instances}, remap=False)
+    assert _values(worker, "api.example.org", QType.A) == ["10.0.1.1"]
+
+
+def test_snapshot_written_only_on_change(
+    consul: Consul, config: Config, caches: Tuple[Cache, Cache]
+) -> None:
+    refresher, _ = caches
+    assert config.snapshot_path is not None
+    written = config.snapshot_path.stat().st_ino
+
+    refresher.refresh(*consul.zone_indexes())
+    assert config.snapshot_path.stat().st_ino == written
+
+    example = consul.zone(dns_from_text("example.com."))
+    example.stage.add_record(
+        Record(record="api", record_type=RecordType.A, value="10.0.0.2", ttl=60)
+    )
+    example.commit()
+    refresher.refresh(*consul.zone_indexes())
+    assert config.snapshot_path.stat().st_ino != written
+
+
+def test_remaps_release_old_maps(
+    consul: Consul,
+    config: Config,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    add_zone(consul, "example.com", [("www", "A", "10.0.0.1")])
+    add_zone(consul, "example.org", [("www", "A", "10.0.1.1")])
+    config.snapshot_path = tmp_path / "snapshot"
+    refresher = Cache(config)
+
+    maps: List[weakref.ref[mmap.mmap]] = []
+    new_mmap = mmap.mmap
+
+    def tracked_mmap(fileno: int, length: int, access: int) -> mmap.mmap:
+        mm = new_mmap(fileno, length, access=access)
+        maps.append(weakref.ref(mm))
+        return mm
+
+    monkeypatch.setattr(mmap, "mmap", tracked_mmap)
+    worker = Cache(config, background=False)
+    worker.after_fork()
+    example = consul.zone(dns_from_text("example.com."))
+    for i in range(9):
+        example.stage.add_record(
+            Record(
+                record=f"host{i}",
+                record_type=RecordType.A,
+                value="10.0.0.2",
+                ttl=60,
+            )
+        )
+        example.commit()
+        refresher.refresh(*consul.zone_indexes())
+        worker.install({}, remap=True)
+        if i % 2 == 0:
+            # Decoded zones let go of their map, the others move to the new
+            # one, as example.org does
+            assert _values(worker, f"host{i}.example.com", QType.A) == [
+                "10.0.0.2"
+            ]
+
+    gc.collect()
+    assert len(maps) == 10
+    assert [m for m in maps if m() is not None] == [maps[-1]]
+    assert _values(worker, "www.example.org", QType.A) == ["10.0.1.1"]
+
+
+def test_stats_do_not_decode_mapped_zones(
+    caches: Tuple[Cache, Cache],
+) -> None:
+    _, worker = caches
+    text = render(worker)
+
+    assert 'cnsd_zone_records{zone="example.com."} 1\n' in text
+    for _, cz in worker.snapshot.zones_by_name.values():
+        assert isinstance(cz, MappedZone)
+        assert "_zone" not in cz.__dict__
+
+
+def test_mapped_zones_resolve_services_from_snapshot(
+    fake: FakeConsul,
+    consul: Consul,
+    config: Config,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    add_zone(consul, "example.org", [("api", "CONSUL", "api")])
+    fake.set_service("api", [("10.0.1.1", 80, True)])
+    config.snapshot_path = tmp_path / "snapshot"
+    Cache(config)
+
+    def unreachable(service: str, **_: object) -> None:
+        raise ConnectionError("Consul is down")
+
+    monkeypatch.setattr(fake.health, "service", unreachable)
+    worker = Cache(config, background=False)
+    worker.after_fork()
+    assert _values(worker, "api.example.org", QType.A) == ["10.0.1.1"]
@@ -0,0 +1,163 @@
+from io import StringIO
+from typing import List, Tuple
+
+import pytest
+from click.testing import CliRunner
+from dns.name import from_text as dns_from_text
+
+from consulns.client import client
+from consulns.const import CLICK_CONSUL_CTX_KEY
+from consulns.store import zonefile
+from consulns.store.consul import Consul
+from consulns.store.record import Record
+from consulns.store.zonefile import read_zone_file, write_zone_file
+from tests.util import add_zone
+
+ZONE_FILE = """$ORIGIN example.com.
+$TTL 3600
+@ IN SOA ns1 hostmaster 1 7200 900 1209600 300
+@ IN NS ns1
+ns1 IN A 192.0.2.1
+www 300 IN A 192.0.2.2
+    IN AAAA 2001:db8::1
+www IN A 192.0.2.3
+txt IN TXT "hello"
+mail.example.com. IN MX 10 mx.example.org.
+alias IN CNAME www
+*.w IN A 192.0.2.9
+"""
+
+EXPECTED = [
+    ("*.w", "A", "192.0.2.9", 3600),
+    ("@", "NS", "ns1.example.com.", 3600),
+    ("alias", "CNAME", "www.example.com.", 3600),
+    ("mail", "MX", "10 mx.example.org.", 3600),
+    ("ns1", "A", "192.0.2.1", 3600),
+    ("www", "A", "192.0.2.2", 300),
+    ("www", "A", "192.0.2.3", 300),
+    ("www", "AAAA", "2001:db8::1", 3600),
+]
+
+
+def _tuples(records: List[Record]) -> List[Tuple[str, str, str, int]]:
+    return sorted(
+        (r.record, r.record_type.value, str(r.value), r.ttl) for r in records
+    )
+
+
+def _read(text: str) -> List[Record]:
+    origin = dns_from_text("example.com")
+    return [r for b in read_zone_file(StringIO(text), origin) for r in b]
+
+
+def test_read() -> None:
+    skipped: List[str] = []
+    batches = list(
+        read_zone_file(
+            StringIO(ZONE_FILE),
+            dns_from_text("example.com"),
+            lambda name, rdtype: skipped.append(f"{name} {rdtype}"),
+        )
+    )
+
+    assert _tuples([r for b in batches for r in b]) == EXPECTED
+    # The SOA record is synthesized by cnsd, and skipped silently
+    assert skipped == ["txt.example.com. TXT"]
+
+
+def test_read_in_batches(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(zonefile, "BATCH_SIZE", 2)
+    text = "".join(f"h{i} 60 IN A 10.0.0.{i}\n" for i in range(5))
+    batches = list(read_zone_file(StringIO(text), dns_from_text("example.com")))
+
+    assert [len(b) for b in batches] == [2, 2, 1]
+
+
+def test_read_across_batches(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(zonefile, "BATCH_SIZE", 2)
+    text = """$TTL 120
+www A 10.0.0.1
+    A 10.0.0.2
+@ SOA ns1 hostmaster (
+    1 ; serial, with a ( in the comment
+    3600 600 86400 60 )
+mail 60 MX 10 mx
+"""
+    batches = list(read_zone_file(StringIO(text), dns_from_text("example.com")))
+
+    # The owner name and default TTL carry over to the next batch, and the
+    # SOA record spanning several lines is read in one batch
+    assert [
+        (r.record, r.record_type.value, str(r.value), r.ttl)
+        for b in batches
+        for r in b
+    ] == [
+        ("www", "A", "10.0.0.1", 120),
+        ("www", "A", "10.0.0.2", 120),
+        ("mail", "MX", "10 mx.example.com.", 60),
+    ]
+
+
+def test_export_round_trip(consul: Consul) -> None:
+    zone = add_zone(
+        consul,
+        "example.com",
+        [
+            ("@", "MX", "10 mail.example.com."),
+            ("www", "A", "192.0.2.2"),
+            ("*.w", "AAAA", "2001:db8::1"),
+            ("api", "CONSUL", "api"),
+        ],
+    )
+    out = StringIO()
+    write_zone_file(out, zone)
+
+    # CONSUL records have no zone file representation
+    assert "; api\t60\tIN\tCONSUL\tapi\n" in out.getvalue()
+    assert _tuples(_read(out.getvalue())) == _tuples(
+        [r for r in zone.records if r.record_type.value != "CONSUL"]
+    )
+
+
+def _cli(consul: Consul, *args: str, input: str | None = None) -> str:
+    result = CliRunner().invoke(
+        client, args, input=input, obj={CLICK_CONSUL_CTX_KEY: consul}
+    )
+    assert result.exception is None, result.output
+    return result.output
+
+
+def test_import(consul: Consul) -> None:
+    zone = add_zone(consul, "example.com", [])
+    consul.use_zone(zone)
+
+    output = _cli(consul, "zone", "import", "-", input=ZONE_FILE)
+    assert "Imported 8 records" in output
+    assert "Skipped 1 unsupported TXT record(s)" in output
+
+    # Importing again adds nothing
+    output = _cli(consul, "zone", "import", "-", input=ZONE_FILE)
+    assert "Imported 0 records" in output
+
+    imported = consul.zone(dns_from_text("example.com"))
+    assert _tuples(list(imported.records)) == EXPECTED
+    assert imported.serial == 1
+
+
+def test_import_replace(consul: Consul) -> None:
+    zone = add_zone(consul, "example.com", [("old", "A", "192.0.2.99")])
+    consul.use_zone(zone)
+
+    _cli(consul, "zone", "import", "--replace", "-", input=ZONE_FILE)
+    imported = consul.zone(dns_from_text("example.com"))
+    assert _tuples(list(imported.records)) == EXPECTED
+
+
+def test_export(consul: Consul) -> None:
+    zone = add_zone(consul, "example.com", [])
+    consul.use_zone(zone)
+    _cli(consul, "zone", "import", "-", input=ZONE_FILE)
+
+    output = _cli(consul, "zone", "export")
+    assert output.startswith("$ORIGIN example.com.\n")
+    assert _tuples(_read(output)) == EXPECTED
@@ -0,0 +1,50 @@
+import json
+from time import monotonic, sleep
+from typing import Callable, List, Tuple
+
+from dns.name import from_text as dns_from_text
+
+from consulns.daemon.handler import Handler
+from consulns.store.consul import Consul
+from consulns.store.record import Record, RecordType
+from consulns.store.zone import Zone
+
+
+def wait_until(predicate: Callable[[], bool], timeout: float = 5.0) -> None:
+    """Waits for a background thread to make predicate true."""
+    deadline = monotonic() + timeout
+    while not predicate():
+        if monotonic() > deadline:
+            raise AssertionError("timed out")
+        sleep(0.01)
+
+
+def add_zone(
+    consul: Consul, zone: str, records: List[Tuple[str, str, str]]
+) -> Zone:
+    """Adds a zone with (name, type, value) records, committed at once."""
+    z = Zone(consul, dns_from_text(zone))
+    consul.add_zone(z)
+    with z.stage.batch():
+        for name, rtype, value in records:
+            z.stage.add_record(
+                Record(
+                    record=name,
+                    record_type=RecordType(rtype),
+                    value=value,
+                    ttl=60,
+                )
+            )
+    z.commit()
+    return z
+
+
+def call(handler: Handler, method: str, **parameters: object) -> object:
+    """Sends a remote backend query, returning the result of the response."""
+    raw = handler.handle(
+        json.dumps({"method": method, "parameters": parameters}).encode()
+    )
+    assert raw is not None
+    if not isinstance(raw, bytes):
+        raw = b"".join(raw)
+    return json.loads(raw)["result"]